@@ -0,0 +1,42 @@
+import json
+from pathlib import Path
+from typing import Dict
+
+from rich.console import Console
+from rich.table import Table
+
+Results = Dict[str, Dict[str, float]]
+
+
+def _ratio(ratio: float, threshold: float) -> str:
+    ratio_str = f"{ratio:.2f}x"
+    if ratio > threshold:
+        return f"[red]{ratio_str}[/red]"
+    elif ratio < 1 / threshold:
+        return f"[green]{ratio_str}[/green]"
+    return ratio_str
+
+
+def compare(results: Results, baseline_file: Path, threshold: float, save: bool = False) -> bool:
+    """Print results next to the stored baseline, returning whether any timing regressed"""
+
+    baseline = json.loads(baseline_file.read_text()) if baseline_file.exists() else {}
+
+    table = Table("Benchmark", "Case", "Baseline", "Current", "Ratio")
+    regressed = False
+    for name, cases in results.items():
+        for case, duration in cases.items():
+            previous = baseline.get(name, {}).get(case)
+            if previous:
+                ratio = duration / previous
+                regressed |= ratio > threshold
+                table.add_row(name, case, f"{previous:.6f}s", f"{duration:.6f}s", _ratio(ratio, threshold))
+            else:
+                table.add_row(name, case, "-", f"{duration:.6f}s", "-")
+
+    Console().print(table)
+
+    if save:
+        baseline_file.write_text(json.dumps({**baseline, **results}, indent=2, sort_keys=True) + "\n")
+
+    return regressed
@@ -0,0 +1,109 @@
+"""Generators of synthetic instater setups for benchmarking
+
+Each generator writes a complete setup into `root` (a `setup.yml` plus any
+files it references) and returns the path of the setup file. Destinations of
+copy tasks are written within `root / "dest"` so setups can be applied
+without touching the rest of the system.
+"""
+
+from pathlib import Path
+from typing import Sequence
+
+import yaml
+
+
+def _write_setup(root: Path, tasks: list, vars_files: Sequence[str] = ()) -> Path:
+    setup = {"tasks": tasks}
+    if vars_files:
+        setup["vars_files"] = list(vars_files)
+
+    setup_file = root / "setup.yml"
+    setup_file.write_text(yaml.safe_dump(setup))
+    return setup_file
+
+
+def _copy_task(index: int, root: Path) -> dict:
+    return {
+        "name": f"Copy file {index}",
+        "copy": {"content": f"content of file {index} for {{{{ user }}}}\n", "dest": f"{root}/dest/file{index}"},
+    }
+
+
+def many_tasks(root: Path, tasks: int) -> Path:
+    """A single setup file with `tasks` templated copy tasks"""
+
+    (root / "vars.yml").write_text(yaml.safe_dump({"user": "benchmark"}))
+    return _write_setup(root, [_copy_task(index, root) for index in range(tasks)], ["vars.yml"])
+
+
+def many_includes(root: Path, includes: int, tasks_per_include: int) -> Path:
+    """`includes` included task files, each with `tasks_per_include` copy tasks"""
+
+    (root / "vars.yml").write_text(yaml.safe_dump({"user": "benchmark"}))
+    (root / "tasks").mkdir()
+
+    setup_tasks = []
+    for include in range(includes):
+        tasks = [_copy_task(include * tasks_per_include + index, root) for index in range(tasks_per_include)]
+        (root / "tasks" / f"include{include}.yml").write_text(yaml.safe_dump(tasks))
+        setup_tasks.append({"include": f"tasks/include{include}.yml", "tags": [f"include{include}"]})
+
+    return _write_setup(root, setup_tasks, ["vars.yml"])
+
+
+def copy_tree(root: Path, files: int, files_per_directory: int = 50, file_size: int = 1024) -> Path:
+    """One `copy` task of a directory tree containing `files` files"""
+
+    source = root / "files" / "tree"
+    for index in range(files):
+        directory = source / f"directory{index // files_per_directory}"
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f"file{index}").write_text(f"{index}\n".rjust(file_size, "x"))
+
+    return _write_setup(root, [{"name": "Copy tree", "copy": {"src": "files/tree", "dest": f"{root}/dest/tree"}}])
+
+
+def large_vars(root: Path, variables: int, tasks: int = 10) -> Path:
+    """A vars file with `variables` variables, each templated from the previous one"""
+
+    values = {"var0": "value"}
+    for index in range(1, variables):
+        values[f"var{index}"] = f"{{{{ var{index - 1} }}}}-{index}"
+
+    (root / "vars.yml").write_text(yaml.safe_dump(values, sort_keys=False))
+    copy_tasks = [
+        {"name": f"Copy {index}", "copy": {"content": f"{{{{ var{variables - 1} }}}}", "dest": f"{root}/dest/{index}"}}
+        for index in range(tasks)
+    ]
+    return _write_setup(root, copy_tasks, ["vars.yml"])
+
+
+def deep_fileglob(root: Path, depth: int, width: int, globs: int) -> Path:
+    """`globs` tasks each expanding `**/*.yml` over a tree `depth` directories deep and `width` wide"""
+
+    directories = [root / "tree"]
+    for _ in range(depth):
+        directories = [directory / f"d{index}" for directory in directories for index in range(width)]
+
+    for index, directory in enumerate(directories):
+        directory.mkdir(parents=True)
+        (directory / "leaf.yml").write_text(yaml.safe_dump([{"name": f"Leaf {index}", "debug": "leaf"}]))
+        (directory / "ignored.txt").touch()
+
+    setup_tasks = [{"include": "{{ item }}", "with_fileglob": "tree/**/*.yml"} for _ in range(globs)]
+    return _write_setup(root, setup_tasks)
+
+
+def system_tasks(root: Path, tasks: int) -> Path:
+    """`tasks` each of pacman, service, group, and user tasks, meant to run with a `SimulatedBackend`"""
+
+    setup_tasks = []
+    for index in range(tasks):
+        setup_tasks += [
+            {"name": f"Package {index}", "pacman": {"packages": f"package{index}"}},
+            {"name": f"Service {index}", "service": {"service": f"service{index}", "started": True, "enabled": True}},
+            {"name": f"Group {index}", "group": {"group": f"group{index}"}},
+            {"name": f"User {index}", "user": {"user": f"user{index}", "groups": [f"group{index}"]}},
+        ]
+
+    return _write_setup(root, setup_tasks)
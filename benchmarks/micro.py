@@ -0,0 +1,194 @@
+"""Microbenchmarks of hot paths, each timed at several input sizes
+
+The scaling table shows the exponent between consecutive sizes (how time
+grows with the input): ~1 is linear, ~2 is quadratic.
+
+Usage:
+
+    python -m benchmarks.micro                # compare against benchmarks/micro_baseline.json
+    python -m benchmarks.micro diff_lines     # only run some benchmarks
+    python -m benchmarks.micro --save         # overwrite the baseline with this machine's timings
+"""
+
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, ContextManager, Dict, Iterator, List
+
+from rich.console import Console
+from rich.table import Table
+
+from instater import diff, util
+from instater.context import Context
+from instater.tasks.copy import Copy
+
+from .compare import compare
+
+BASELINE_FILE = Path(__file__).resolve().parent / "micro_baseline.json"
+
+# each benchmark is a context manager that sets up an input of the given size,
+# and yields the function to be timed
+Benchmark = Callable[[int], ContextManager[Callable[[], object]]]
+
+_QUIET_CONSOLE = Console(file=open(os.devnull, "w"))
+
+
+def _context(root: Path) -> Context:
+    return Context(root_directory=root, extra_vars={"value": "x" * 20}, tags=(), console=_QUIET_CONSOLE)
+
+
+def _lines(size: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    return [f"key_{index} = {rng.randrange(1000)} # some comment about this line" for index in range(size)]
+
+
+def _modified(lines: List[str], fraction: float = 0.1) -> List[str]:
+    rng = random.Random(len(lines))
+    return [line.replace("line", "LINE") if rng.random() < fraction else line for line in lines]
+
+
+@contextmanager
+def diff_lines(size: int):
+    a = _lines(size, seed=1)
+    b = _modified(a)
+    a_str, b_str = "\n".join(a), "\n".join(b)
+    yield lambda: diff.diff_lines(a_str, b_str, "a", "b")
+
+
+@contextmanager
+def diff_strings(size: int):
+    rng = random.Random(size)
+    a = "".join(rng.choice("abcdefgh ") for _ in range(size))
+    b = "".join(char.upper() if rng.random() < 0.1 else char for char in a)
+    yield lambda: diff.diff_strings(a, b)
+
+
+@contextmanager
+def jinja_string(size: int):
+    context = _context(Path("."))
+    template = "\n".join(f"line {index}: {{{{ value }}}}" for index in range(size))
+    yield lambda: context.jinja_string(template)
+
+
+@contextmanager
+def jinja_object(size: int):
+    context = _context(Path("."))
+    template = [f"item {index}: {{{{ value }}}}" for index in range(size)]
+    yield lambda: context.jinja_object(template)
+
+
+@contextmanager
+def _directory(size: int) -> Iterator[Path]:
+    directory = Path(tempfile.mkdtemp())
+    try:
+        for index in range(size):
+            subdirectory = directory / "src" / f"directory{index // 50}"
+            subdirectory.mkdir(parents=True, exist_ok=True)
+            (subdirectory / f"file{index}").write_text(f"{index}\n".rjust(1024, "x"))
+        yield directory
+    finally:
+        shutil.rmtree(directory)
+
+
+@contextmanager
+def update_file_metadata(size: int):
+    with _directory(size) as directory:
+        context = _context(directory)
+        paths = [path for path in (directory / "src").glob("**/*") if path.is_file()]
+        for path in paths:
+            path.chmod(0o644)
+
+        def update():
+            for path in paths:
+                util.update_file_metadata(path, None, None, 0o644, context)
+
+        yield update
+
+
+@contextmanager
+def update_dir(size: int):
+    with _directory(size) as directory:
+        context = _context(directory)
+        src, dest = directory / "src", directory / "dest"
+        task = Copy(src=str(src), dest=str(dest))
+        # the first update copies all files, so that timed updates only compare
+        task._update_dir(src, dest, context)
+        yield lambda: task._update_dir(src, dest, context)
+
+
+BENCHMARKS: Dict[str, Benchmark] = {
+    "diff_lines": diff_lines,
+    "diff_strings": diff_strings,
+    "jinja_string": jinja_string,
+    "jinja_object": jinja_object,
+    "update_file_metadata": update_file_metadata,
+    "update_dir": update_dir,
+}
+
+SIZES = [100, 1000, 10000]
+
+
+def _time(function: Callable[[], object], minimum_time: float = 0.2) -> float:
+    """The fastest of as many calls as fit within `minimum_time` (at least 3)"""
+
+    durations: List[float] = []
+    while len(durations) < 3 or sum(durations) < minimum_time:
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def _print_scaling(results: Dict[str, Dict[str, float]], sizes: List[int]):
+    table = Table("Benchmark", *(f"n={size}" for size in sizes), "Exponents")
+    for name, timings in results.items():
+        durations = [timings[str(size)] for size in sizes]
+        exponents = [
+            math.log(durations[index + 1] / durations[index]) / math.log(sizes[index + 1] / sizes[index])
+            for index in range(len(sizes) - 1)
+        ]
+        table.add_row(
+            name,
+            *(f"{duration * 1000:.3f}ms" for duration in durations),
+            ", ".join(f"{exponent:.2f}" for exponent in exponents),
+        )
+
+    Console().print(table)
+
+
+def main():
+    parser = ArgumentParser(description="Microbenchmarks of instater hot paths at several input sizes")
+    parser.add_argument("benchmarks", nargs="*", help=f"Benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Input sizes to time each benchmark at")
+    parser.add_argument("--save", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="Exit with an error if any timing regressed")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Ratio to the baseline counted as a regression")
+    args = parser.parse_args()
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results: Dict[str, Dict[str, float]] = {}
+    for name in args.benchmarks or BENCHMARKS:
+        results[name] = {}
+        for size in args.sizes:
+            with BENCHMARKS[name](size) as function:
+                results[name][str(size)] = _time(function)
+
+    _print_scaling(results, args.sizes)
+    regressed = compare(results, BASELINE_FILE, args.threshold, save=args.save)
+
+    if args.check and regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
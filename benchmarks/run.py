@@ -0,0 +1,108 @@
+"""Benchmarks of loading and running synthetic setups
+
+Each scenario generates a setup with `benchmarks.generators`, applies it once
+so that destinations exist, then times:
+
+- `load`: parsing the setup, variables, and tasks (equivalent to `skip_tasks=True`)
+- `dry_run`: running all loaded tasks with `--dry-run`
+
+System tasks (packages, services, users, etc) run against a
+`SimulatedBackend`, with `--latency` seconds per simulated command.
+
+Usage:
+
+    python -m benchmarks.run                  # compare against benchmarks/baseline.json
+    python -m benchmarks.run --save           # overwrite the baseline with this machine's timings
+    python -m benchmarks.run --check          # exit with an error when a timing regressed
+
+Baselines are machine specific, so compare against a baseline saved on the same
+machine (save one from the main branch before measuring a change).
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Callable, Dict
+
+from rich.console import Console
+
+from instater.backend import SimulatedBackend
+from instater.main import _load_context, _run_loaded_tasks
+
+from . import generators
+from .compare import compare
+
+BASELINE_FILE = Path(__file__).resolve().parent / "baseline.json"
+
+SCENARIOS: Dict[str, Callable[[Path], Path]] = {
+    "many_tasks": lambda root: generators.many_tasks(root, tasks=1000),
+    "many_includes": lambda root: generators.many_includes(root, includes=100, tasks_per_include=10),
+    "copy_tree": lambda root: generators.copy_tree(root, files=2000),
+    "large_vars": lambda root: generators.large_vars(root, variables=1000),
+    "deep_fileglob": lambda root: generators.deep_fileglob(root, depth=3, width=6, globs=4),
+    "system_tasks": lambda root: generators.system_tasks(root, tasks=100),
+}
+
+
+_QUIET_CONSOLE = Console(file=open(os.devnull, "w"))
+
+
+def _load(setup_file: Path, backend: SimulatedBackend, dry_run: bool = False):
+    context, _ = _load_context(setup_file, {}, (), dry_run=dry_run, console=_QUIET_CONSOLE, backend=backend)
+    return context
+
+
+def _time(function: Callable[[], object], repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def run_scenario(make_setup: Callable[[Path], Path], repeat: int, latency: float = 0.0) -> Dict[str, float]:
+    backend = SimulatedBackend(latency=latency)
+    with tempfile.TemporaryDirectory() as directory:
+        setup_file = make_setup(Path(directory))
+
+        # apply once so that dry runs compare against existing destinations
+        context = _load(setup_file, backend)
+        _run_loaded_tasks(context, context.tasks)
+
+        dry_run_context = _load(setup_file, backend, dry_run=True)
+        return {
+            "load": _time(lambda: _load(setup_file, backend), repeat),
+            "dry_run": _time(lambda: _run_loaded_tasks(dry_run_context, dry_run_context.tasks), repeat),
+        }
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark loading and running synthetic instater setups")
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timed repetitions (the median is used)")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds each simulated system command takes (default: 0)"
+    )
+    parser.add_argument("--save", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="Exit with an error if any timing regressed")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Ratio to the baseline counted as a regression")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = {name: run_scenario(SCENARIOS[name], args.repeat, args.latency) for name in args.scenarios or SCENARIOS}
+    regressed = compare(results, BASELINE_FILE, args.threshold, save=args.save)
+
+    if args.check and regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
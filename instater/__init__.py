@@ -1,21 +1,33 @@
-try:
-    # Python 3.8+
-    import importlib.metadata as _metadata
-except ModuleNotFoundError:  # pragma: no cover
-    # Python 3.7
-    import importlib_metadata as _metadata  # type: ignore
-
-from rich.traceback import install
-
 from .exceptions import InstaterError
-from .main import run_tasks
-
-install()
-
-__version__ = _metadata.version("instater")
 
 __all__ = [
     "InstaterError",
+    "Session",
     "__version__",
     "run_tasks",
 ]
+
+
+def __getattr__(name: str):
+    # imported lazily, so that `instater --version` and `--help` do not load every dependency
+    if name == "run_tasks":
+        from .main import run_tasks
+
+        return run_tasks
+
+    if name == "Session":
+        from .session import Session
+
+        return Session
+
+    if name == "__version__":
+        try:
+            # Python 3.8+
+            import importlib.metadata as _metadata
+        except ModuleNotFoundError:  # pragma: no cover
+            # Python 3.7
+            import importlib_metadata as _metadata  # type: ignore
+
+        return _metadata.version("instater")
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,419 @@
+import shutil
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from . import pacman_db, util
+
+
+class SystemBackend:
+    """Queries and changes system state (packages, services, users, etc)
+
+    Tasks go through the backend rather than running system binaries directly,
+    so that the real system can be swapped out (see `SimulatedBackend`).
+
+    Installed packages are read directly from the pacman local database at
+    `pacman_db_path` when it exists (see `pacman_db`), or queried with
+    `pacman` otherwise.
+
+    Sync databases are refreshed (`-Sy`) at most once per backend, by the first
+    install, and not at all if every database in `pacman_sync_path` is newer
+    than `sync_max_age` seconds.
+    """
+
+    def __init__(
+        self,
+        pacman_db_path: Path = pacman_db.DEFAULT_PATH,
+        pacman_cache_file: Optional[Path] = None,
+        pacman_sync_path: Path = Path("/var/lib/pacman/sync"),
+        sync_max_age: Optional[float] = None,
+    ):
+        self.pacman_db_path = pacman_db_path
+        self.pacman_cache_file = pacman_cache_file or util.cache_directory() / "pacman-local.json"
+        self.pacman_sync_path = pacman_sync_path
+        self.sync_max_age = sync_max_age
+        self._synced = False
+
+    def invalidate(self):
+        """Forget system state observed by earlier runs (whether the sync databases were refreshed)"""
+        self._synced = False
+
+    # pacman
+
+    def has_pacman(self) -> bool:
+        return shutil.which("pacman") is not None
+
+    def _pacman_database(self) -> Optional[pacman_db.LocalDatabase]:
+        if not self.pacman_db_path.is_dir():
+            return None
+        return pacman_db.read(self.pacman_db_path, self.pacman_cache_file)
+
+    def package_installed(self, package: str) -> bool:
+        database = self._pacman_database()
+        if database is not None:
+            return database.installed(package)
+
+        result_package = util.probe(["pacman", "-Qi", package], valid_return_codes=(0, 1))
+        if result_package.return_code == 0:
+            return True
+
+        result_group = util.probe(["pacman", "-Qg", package], valid_return_codes=(0, 1))
+        return result_group.return_code == 0
+
+    def explicitly_installed_packages(self) -> Set[str]:
+        database = self._pacman_database()
+        if database is not None:
+            return database.explicitly_installed()
+
+        output = util.probe(["pacman", "-Qe"])
+        return set(line.split()[0] for line in output.stdout.splitlines() if line)
+
+    def package_or_group_packages(self, package: str) -> Set[str]:
+        database = self._pacman_database()
+        if database is not None:
+            return database.package_or_group_packages(package)
+
+        group_output = util.probe(["pacman", "-Qg", package], valid_return_codes=(0, 1))
+        if group_output.return_code == 1:
+            return {package}
+        else:
+            return set(line.split()[1] for line in group_output.stdout.splitlines())
+
+    def _sync_databases_outdated(self) -> bool:
+        if self.sync_max_age is None:
+            return True
+
+        databases = list(self.pacman_sync_path.glob("*.db"))
+        oldest = min((path.stat().st_mtime for path in databases), default=0.0)
+        return not databases or time.time() - oldest > self.sync_max_age
+
+    def _sync_flag(self) -> str:
+        """`-Sy` for the first install that needs to refresh the sync databases, `-S` otherwise"""
+
+        if self._synced or not self._sync_databases_outdated():
+            return "-S"
+
+        self._synced = True
+        return "-Sy"
+
+    def install_packages(self, packages: List[str], stream: Optional[util.OutputStream] = None):
+        util.shell(
+            ["pacman", self._sync_flag(), "--noconfirm", "--noprogressbar", "--needed", *packages], stream=stream
+        )
+
+    def install_aur_packages(
+        self, packages: List[str], become: Optional[str], stream: Optional[util.OutputStream] = None
+    ):
+        if shutil.which("yay"):
+            # TODO: make the `makepkg` user configurable
+            util.shell(
+                ["yay", self._sync_flag(), "--noconfirm", "--needed", "--cleanafter", *packages],
+                become="makepkg",
+                stream=stream,
+            )
+        else:
+            for package in packages:
+                self._makepkg_install(package, become, stream)
+
+    # TODO: this currently requires root to run properly (to delete the cloned directory created by another user)
+    def _makepkg_install(self, package: str, become: Optional[str], stream: Optional[util.OutputStream]):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            if become:
+                util.shell(["chown", become, tmpdir])
+
+            clone_dir = tmpdir + "/" + package
+
+            util.shell(
+                ["git", "clone", "--depth", "1", f"https://aur.archlinux.org/{package}.git", clone_dir],
+                become=become,
+            )
+
+            util.shell(
+                ["makepkg", "--syncdeps", "--install", "--noconfirm", "--needed"],
+                directory=clone_dir,
+                become=become,
+                stream=stream,
+            )
+
+    # systemd services
+
+    def service_started(self, service: str) -> bool:
+        result = util.probe(["systemctl", "is-active", service], valid_return_codes=(0, 3))
+        return result.stdout == "active"
+
+    def service_enabled(self, service: str) -> bool:
+        result = util.probe(["systemctl", "is-enabled", service], valid_return_codes=(0, 1))
+        return result.stdout == "enabled"
+
+    def start_service(self, service: str):
+        util.shell(["systemctl", "start", service])
+
+    def enable_service(self, service: str):
+        util.shell(["systemctl", "enable", service])
+
+    def disable_service(self, service: str):
+        util.shell(["systemctl", "disable", service])
+
+    # users and groups
+
+    def user_exists(self, user: str) -> bool:
+        result = util.probe(["getent", "passwd", user], valid_return_codes=(0, 2))
+        return result.return_code == 0
+
+    def create_user(self, user: str, system: bool, create_home: bool, password: Optional[str]):
+        command = ["useradd", user]
+
+        if system:
+            command.append("--system")
+
+        if create_home:
+            command.append("--create-home")
+
+        if password:
+            command.append("--password")
+            command.append(password)
+
+        util.shell(command)
+
+    def user_groups(self, user: str) -> List[str]:
+        result = util.probe(["groups", user])
+        return result.stdout.split(" ")
+
+    def add_user_groups(self, user: str, groups: Iterable[str]):
+        group_str = ",".join(groups)
+        util.shell(["usermod", "-a", "-G", group_str, user])
+
+    def user_shell(self, user: str) -> str:
+        result = util.probe(["getent", "passwd", user])
+        return result.stdout.split(":")[-1]
+
+    def set_user_shell(self, user: str, shell: str):
+        util.shell(["usermod", "-s", shell, user])
+
+    def user_password_hash(self, user: str) -> Optional[str]:
+        """The hashed password of a user, or None if the user does not exist or the shadow file is unreadable"""
+        result = util.probe(["getent", "shadow", user], valid_return_codes=(0, 2))
+        if result.return_code != 0:
+            return None
+        return result.stdout.split(":")[1]
+
+    def group_exists(self, group: str) -> bool:
+        result = util.probe(["getent", "group", group], valid_return_codes=(0, 2))
+        return result.return_code == 0
+
+    def create_group(self, group: str):
+        util.shell(["groupadd", group])
+
+    # git repositories
+
+    def git_clone(self, repo: str, dest: Path, depth: Optional[str], become: Optional[str]):
+        command = ["git", "clone", repo]
+        if depth is not None:
+            command += ["--depth", depth]
+
+        command.append(str(dest))
+        util.shell(command, become=become)
+
+    def git_remote(self, dest: Path, become: Optional[str]) -> str:
+        result = util.probe(["git", "config", "--get", "remote.origin.url"], directory=dest, become=become)
+        return result.stdout
+
+    def git_fetch_dry_run(self, dest: Path, tags_flag: str, become: Optional[str]) -> str:
+        """Output of a dry run fetch, empty when the remote has not changed relative to local"""
+        result = util.shell(["git", "fetch", "--dry-run", tags_flag], directory=dest, become=become)
+        return result.stdout
+
+    def git_unpulled_commits(self, dest: Path, become: Optional[str]) -> str:
+        """Commits on the remote branch that are not in the local branch"""
+        result = util.probe(["git", "log", "-1", "--format=oneline", "@..@{push}"], directory=dest, become=become)
+        return result.stdout
+
+    def git_pull(self, dest: Path, tags_flag: str, become: Optional[str]):
+        branch = util.probe(["git", "branch", "--show-current"], directory=dest, become=become).stdout
+        util.shell(["git", "pull", "origin", branch, tags_flag], directory=dest, become=become)
+
+    # file ownership
+
+    def file_owner(self, path: Path) -> Tuple[str, str]:
+        return path.owner(), path.group()
+
+    def chown(self, path: Path, owner: Optional[str], group: Optional[str]):
+        shutil.chown(path, user=owner, group=group)  # type: ignore
+
+
+class SimulatedBackend(SystemBackend):
+    """In-memory system state with simulated command latency
+
+    Useful for benchmarking and testing tasks without root or an Arch Linux
+    system. Each query sleeps for `latency` seconds and each change for
+    `change_latency` seconds, and every call is counted in `calls`. Files are
+    still read and written on the real filesystem, only ownership is simulated.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        change_latency: Optional[float] = None,
+        packages: Iterable[str] = (),
+        package_groups: Optional[Dict[str, Iterable[str]]] = None,
+        services: Optional[Dict[str, Dict[str, bool]]] = None,
+        users: Iterable[str] = (),
+        groups: Iterable[str] = (),
+        sync_max_age: Optional[float] = None,
+    ):
+        super().__init__(sync_max_age=sync_max_age)
+        self.latency = latency
+        self.change_latency = latency if change_latency is None else change_latency
+        self.calls: Counter = Counter()
+
+        # package name -> whether it was explicitly installed
+        self.packages: Dict[str, bool] = {package: True for package in packages}
+        self.package_groups = {group: set(members) for group, members in (package_groups or {}).items()}
+        self.services = {
+            name: {"started": False, "enabled": False, **state} for name, state in (services or {}).items()
+        }
+        self.users: Dict[str, dict] = {user: {"groups": [user], "shell": "/bin/sh"} for user in users}
+        self.groups: Set[str] = set(groups) | set(self.users)
+        # repository destination -> {"remote": url, "behind": number of unpulled commits}
+        self.repos: Dict[Path, dict] = {}
+        self.owners: Dict[Path, Tuple[str, str]] = {}
+
+    def _query(self, name: str):
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _change(self, name: str):
+        self.calls[name] += 1
+        if self.change_latency:
+            time.sleep(self.change_latency)
+
+    def has_pacman(self) -> bool:
+        return True
+
+    def package_installed(self, package: str) -> bool:
+        self._query("package_installed")
+        # like `pacman -Qg`, a group counts as installed when any of its packages is
+        return package in self.packages or any(
+            member in self.packages for member in self.package_groups.get(package, ())
+        )
+
+    def explicitly_installed_packages(self) -> Set[str]:
+        self._query("explicitly_installed_packages")
+        return {package for package, explicit in self.packages.items() if explicit}
+
+    def package_or_group_packages(self, package: str) -> Set[str]:
+        self._query("package_or_group_packages")
+        return set(self.package_groups.get(package, {package}))
+
+    def install_packages(self, packages: List[str], stream: Optional[util.OutputStream] = None):
+        if self._sync_flag() == "-Sy":
+            self._change("sync_databases")
+        self._change("install_packages")
+        for package in packages:
+            for member in self.package_groups.get(package, {package}):
+                self.packages[member] = True
+
+    def install_aur_packages(
+        self, packages: List[str], become: Optional[str], stream: Optional[util.OutputStream] = None
+    ):
+        self.install_packages(packages)
+
+    def _service(self, service: str) -> Dict[str, bool]:
+        return self.services.setdefault(service, {"started": False, "enabled": False})
+
+    def service_started(self, service: str) -> bool:
+        self._query("service_started")
+        return self._service(service)["started"]
+
+    def service_enabled(self, service: str) -> bool:
+        self._query("service_enabled")
+        return self._service(service)["enabled"]
+
+    def start_service(self, service: str):
+        self._change("start_service")
+        self._service(service)["started"] = True
+
+    def enable_service(self, service: str):
+        self._change("enable_service")
+        self._service(service)["enabled"] = True
+
+    def disable_service(self, service: str):
+        self._change("disable_service")
+        self._service(service)["enabled"] = False
+
+    def user_exists(self, user: str) -> bool:
+        self._query("user_exists")
+        return user in self.users
+
+    def create_user(self, user: str, system: bool, create_home: bool, password: Optional[str]):
+        self._change("create_user")
+        self.users[user] = {"groups": [user], "shell": "/bin/sh"}
+        if password:
+            self.users[user]["password"] = password
+        self.groups.add(user)
+
+    def user_groups(self, user: str) -> List[str]:
+        self._query("user_groups")
+        return list(self.users[user]["groups"])
+
+    def add_user_groups(self, user: str, groups: Iterable[str]):
+        self._change("add_user_groups")
+        user_groups = self.users[user]["groups"]
+        user_groups.extend(group for group in groups if group not in user_groups)
+
+    def user_shell(self, user: str) -> str:
+        self._query("user_shell")
+        return self.users[user]["shell"]
+
+    def set_user_shell(self, user: str, shell: str):
+        self._change("set_user_shell")
+        self.users[user]["shell"] = shell
+
+    def user_password_hash(self, user: str) -> Optional[str]:
+        self._query("user_password_hash")
+        return self.users[user].get("password") if user in self.users else None
+
+    def group_exists(self, group: str) -> bool:
+        self._query("group_exists")
+        return group in self.groups
+
+    def create_group(self, group: str):
+        self._change("create_group")
+        self.groups.add(group)
+
+    def git_clone(self, repo: str, dest: Path, depth: Optional[str], become: Optional[str]):
+        self._change("git_clone")
+        # the git task checks for the repository on the filesystem
+        (dest / ".git").mkdir(parents=True, exist_ok=True)
+        self.repos[dest] = {"remote": repo, "behind": 0}
+
+    def git_remote(self, dest: Path, become: Optional[str]) -> str:
+        self._query("git_remote")
+        return self.repos[dest]["remote"]
+
+    def git_fetch_dry_run(self, dest: Path, tags_flag: str, become: Optional[str]) -> str:
+        self._query("git_fetch_dry_run")
+        behind = self.repos[dest]["behind"]
+        return f"{behind} new commits" if behind else ""
+
+    def git_unpulled_commits(self, dest: Path, become: Optional[str]) -> str:
+        self._query("git_unpulled_commits")
+        return ""
+
+    def git_pull(self, dest: Path, tags_flag: str, become: Optional[str]):
+        self._change("git_pull")
+        self.repos[dest]["behind"] = 0
+
+    def file_owner(self, path: Path) -> Tuple[str, str]:
+        self._query("file_owner")
+        if path in self.owners:
+            return self.owners[path]
+        return super().file_owner(path)
+
+    def chown(self, path: Path, owner: Optional[str], group: Optional[str]):
+        self._change("chown")
+        current_owner, current_group = self.file_owner(path)
+        self.owners[path] = (owner or current_owner, group or current_group)
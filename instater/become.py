@@ -0,0 +1,167 @@
+"""Long-lived workers running commands as another user
+
+Running each `become` command through `sudo -u <user>` pays for sudo's PAM and
+session setup every time. Instead, one worker process per target user is
+started through sudo on first use, and commands are sent to it over a pipe
+(one JSON object per line, with output base64 encoded). When the target is
+the current user, the worker is started without sudo.
+
+Commands run with a `stream` have their output sent back in chunks as it is
+produced, followed by the exit code once the command exits.
+"""
+
+import atexit
+import base64
+import getpass
+import json
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from .exceptions import InstaterError
+
+# runs with the target user's permissions, so it cannot import instater (which may not be readable)
+_WORKER_SOURCE = """
+import base64, json, os, selectors, subprocess, sys
+
+def encode(data):
+    return base64.b64encode(data).decode("ascii")
+
+def stream(process):
+    with selectors.DefaultSelector() as selector:
+        selector.register(process.stdout, selectors.EVENT_READ, 1)
+        selector.register(process.stderr, selectors.EVENT_READ, 2)
+        while selector.get_map():
+            for key, _ in selector.select():
+                data = os.read(key.fileobj.fileno(), 65536)
+                if data:
+                    print(json.dumps({"fd": key.data, "data": encode(data)}), flush=True)
+                else:
+                    selector.unregister(key.fileobj)
+    return process.wait()
+
+print("ready", flush=True)
+for line in sys.stdin:
+    request = json.loads(line)
+    try:
+        process = subprocess.Popen(
+            request["command"],
+            cwd=request["directory"],
+            shell=request["shell"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except OSError as e:
+        print(json.dumps({"error": str(e)}), flush=True)
+        continue
+    if request["stream"]:
+        response = {"return_code": stream(process)}
+    else:
+        stdout, stderr = process.communicate()
+        response = {"return_code": process.returncode, "stdout": encode(stdout), "stderr": encode(stderr)}
+    print(json.dumps(response), flush=True)
+"""
+
+
+class BecomeWorker:
+    def __init__(self, user: str):
+        self.user = user
+        self._lock = threading.Lock()
+
+        command = [sys.executable, "-I", "-c", _WORKER_SOURCE]
+        if user != getpass.getuser():
+            command = ["sudo", "-u", user] + command
+
+        self._process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True, bufsize=1
+        )
+        # sudo may prompt for a password (on the terminal) before the worker starts
+        self.ready = self._process.stdout.readline() == "ready\n"  # type: ignore
+
+    def run(
+        self,
+        command: Union[str, List[str]],
+        directory: Optional[Union[str, Path]] = None,
+        on_output: Optional[Callable[[int, bytes], None]] = None,
+    ) -> Tuple[int, bytes, bytes]:
+        """Run `command`, returning its exit code and output
+
+        With `on_output`, output is passed to it in chunks (with 1 for stdout
+        and 2 for stderr) as it is produced, and is not returned.
+        """
+
+        request = {
+            "command": command,
+            "directory": str(directory) if directory is not None else None,
+            "shell": isinstance(command, str),
+            "stream": on_output is not None,
+        }
+
+        with self._lock:
+            try:
+                self._process.stdin.write(json.dumps(request) + "\n")  # type: ignore
+            except BrokenPipeError:
+                pass  # the worker exited, which reading its response reports
+
+            response = self._read_response()
+            while on_output is not None and "fd" in response:
+                on_output(response["fd"], base64.b64decode(response["data"]))
+                response = self._read_response()
+
+        if "error" in response:
+            raise InstaterError(f"Could not run '{command}' as user '{self.user}': {response['error']}")
+        if on_output is not None:
+            return response["return_code"], b"", b""
+
+        return response["return_code"], base64.b64decode(response["stdout"]), base64.b64decode(response["stderr"])
+
+    def _read_response(self) -> dict:
+        line = self._process.stdout.readline()  # type: ignore
+        if not line:
+            raise InstaterError(f"Worker running commands as user '{self.user}' exited unexpectedly")
+        return json.loads(line)
+
+    def close(self):
+        if self._process.poll() is None:
+            self._process.stdin.close()  # type: ignore
+            self._process.wait()
+
+
+_workers: Dict[str, Optional[BecomeWorker]] = {}
+_workers_lock = threading.Lock()
+
+
+def worker(user: str) -> Optional[BecomeWorker]:
+    """The worker for `user`, or None if one could not be started (e.g. python is not readable by the user)"""
+
+    with _workers_lock:
+        if user not in _workers:
+            started = BecomeWorker(user)
+            if not started.ready:
+                started.close()
+            _workers[user] = started if started.ready else None
+        return _workers[user]
+
+
+def _forget_workers():
+    # a forked child must not share the parent's workers, it starts its own on first use
+    global _workers_lock
+
+    _workers.clear()
+    _workers_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_workers)
+
+
+@atexit.register
+def close_workers():
+    with _workers_lock:
+        for started in _workers.values():
+            if started is not None:
+                started.close()
+        _workers.clear()
@@ -1,9 +1,12 @@
 import json
 from argparse import ArgumentParser
+from typing import Dict, List, Optional
 
 from rich.console import Console
 
-from instater import InstaterError, __version__, run_tasks
+from instater import InstaterError
+from instater.durability import DURABILITY_MODES
+from instater.output import OUTPUT_MODES
 
 
 def _parse_variables(vars: str) -> dict:
@@ -33,8 +36,40 @@ def _parse_variables(vars: str) -> dict:
     return parsed
 
 
+def _parse_targets(targets: Optional[List[str]]) -> Optional[Dict[str, Optional[dict]]]:
+    if targets is None:
+        return None
+
+    # a single JSON mapping of target roots to their variables, or a list of target roots
+    if len(targets) == 1 and targets[0].lstrip().startswith("{"):
+        try:
+            parsed = json.loads(targets[0])
+        except json.JSONDecodeError as e:
+            raise InstaterError(f"Invalid JSON targets from --targets: {e}")
+        if not isinstance(parsed, dict) or not all(isinstance(v, dict) or v is None for v in parsed.values()):
+            raise InstaterError("JSON targets from --targets must map each target root to a dictionary of variables")
+        return parsed
+
+    return {target: None for target in targets}
+
+
 def main():
     parser = ArgumentParser(description="An easy solution for system/dotfile configuration")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=("plan", "apply"),
+        help="`plan`: write the changes a run would make to a plan file (see -o), "
+        "`apply`: run the changes of a plan file",
+    )
+    parser.add_argument("plan_file", nargs="?", metavar="PLAN", help="With `apply`, the plan file to apply")
+    parser.add_argument(
+        "-o",
+        dest="plan_output",
+        default="plan.json",
+        metavar="PLAN",
+        help="With `plan`, the file to write the plan to (default: plan.json)",
+    )
     parser.add_argument("--setup-file", default="setup.yml", help="The setup file to execute")
     parser.add_argument("--tags", nargs="*", help="Run only a subset of tasks by their tag")
     parser.add_argument("--vars", help="Variables to override prompts or variable files")
@@ -53,28 +88,166 @@ def main():
         action="store_true",
         help="Include messages for each task explaining why the task was changed or skipped",
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Skip file tasks whose arguments, sources, and destinations are unchanged since the last run",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="After running, watch for file changes and re-run only the affected tasks",
+    )
+    parser.add_argument(
+        "--report",
+        metavar="FILE",
+        help="Write per-task timing, subprocess, and I/O statistics to a JSON Lines file",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Write a Chrome trace event timeline of the run (viewable in Perfetto or chrome://tracing)",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=".",
+        metavar="DIRECTORY",
+        help="Profile loading and running tasks, writing .pstats files to a directory (default: current directory)",
+    )
+    parser.add_argument(
+        "--output",
+        choices=OUTPUT_MODES,
+        default="rich",
+        help="Output format: colored text, plain text, or one JSON event per line (default: rich)",
+    )
+    parser.add_argument(
+        "--sync-max-age",
+        type=float,
+        metavar="SECONDS",
+        help="Do not refresh pacman sync databases newer than this (by default, they are refreshed once per run)",
+    )
+    parser.add_argument(
+        "--tail",
+        action="store_true",
+        help="Show the output of commands and package installs as they run (always logged to ~/.cache/instater/logs)",
+    )
+    parser.add_argument(
+        "--targets",
+        nargs="+",
+        metavar="ROOT",
+        help="Apply the setup to these target root directories instead of the current system, "
+        "or to the roots of a JSON mapping of roots to variables for each target",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        metavar="N",
+        help="Number of targets to run at a time (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--durability",
+        choices=DURABILITY_MODES,
+        default="none",
+        help="How written files are flushed to disk: not at all, fsync each file, "
+        "or syncfs each written filesystem once at the end of the run (default: none)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not reuse results of previous runs, such as rendered templates, stored in ~/.cache/instater",
+    )
     parser.add_argument("--quiet", "-q", action="store_true", help="Do not print skipped tasks")
     parser.add_argument("--version", action="store_true", help="Display the version of instater")
 
     args = parser.parse_args()
 
     if args.version:
+        from instater import __version__
+
         Console().print(f"Instater {__version__}")
         return
 
+    # imported after parsing arguments, so that `--version` and `--help` stay fast
+    from rich.traceback import install
+
+    from instater.backend import SystemBackend
+    from instater.main import apply_plan, run_tasks
+    from instater.watch import watch
+
+    install()
+
     tags = args.tags
+    backend = SystemBackend(sync_max_age=args.sync_max_age)
 
     try:
         variables = _parse_variables(args.vars)
-        run_tasks(
-            setup_file=args.setup_file,
-            override_variables=variables,
-            tags=tags,
-            dry_run=args.dry_run,
-            quiet=args.quiet,
-            explain=args.explain,
-            skip_tasks=args.skip_tasks,
-        )
+        targets = _parse_targets(args.targets)
+        if args.watch and targets is not None:
+            raise InstaterError("--watch cannot be used with --targets")
+        if args.command and (args.watch or targets is not None):
+            raise InstaterError(f"`{args.command}` cannot be used with --watch or --targets")
+        if (args.command == "apply") != (args.plan_file is not None):
+            raise InstaterError("A plan file must be given to `apply` (and only to `apply`)")
+
+        if args.command == "apply":
+            apply_plan(
+                args.plan_file,
+                dry_run=args.dry_run,
+                quiet=args.quiet,
+                explain=args.explain,
+                incremental=args.incremental,
+                report_file=args.report,
+                trace_file=args.trace,
+                profile_directory=args.profile,
+                output=args.output,
+                tail=args.tail,
+                use_cache=not args.no_cache,
+                durability=args.durability,
+                backend=backend,
+            )
+        elif args.watch:
+            try:
+                watch(
+                    setup_file=args.setup_file,
+                    override_variables=variables,
+                    tags=tags,
+                    dry_run=args.dry_run,
+                    quiet=args.quiet,
+                    explain=args.explain,
+                    incremental=args.incremental,
+                    output=args.output,
+                    tail=args.tail,
+                    use_cache=not args.no_cache,
+                    durability=args.durability,
+                    backend=backend,
+                )
+            except KeyboardInterrupt:
+                # watching only ends when interrupted
+                pass
+        else:
+            run_tasks(
+                setup_file=args.setup_file,
+                override_variables=variables,
+                tags=tags,
+                dry_run=args.dry_run,
+                quiet=args.quiet,
+                explain=args.explain,
+                skip_tasks=args.skip_tasks,
+                incremental=args.incremental,
+                report_file=args.report,
+                trace_file=args.trace,
+                profile_directory=args.profile,
+                output=args.output,
+                tail=args.tail,
+                targets=targets,
+                jobs=args.jobs,
+                plan_file=args.plan_output if args.command == "plan" else None,
+                use_cache=not args.no_cache,
+                durability=args.durability,
+                backend=backend,
+            )
     except InstaterError as e:
         console = Console()
         console.print(e, style="red")
@@ -1,14 +1,30 @@
 import os.path
+import re
 import time
 import typing
 from collections import Counter
 from pathlib import Path
-from typing import TYPE_CHECKING, Iterable, Optional
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Set, Union
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, Template, meta, nodes
 from rich.console import Console
+from rich.markup import escape
 
 from . import util
+from .backend import SystemBackend
+from .diff import diff_lines
+from .durability import Syncer, write_file
+from .fileindex import FileIndex
+from .output import OUTPUTS
+from .plan import Plan
+from .state import StateDatabase
+
+if TYPE_CHECKING:
+    from .tasks import Task
+
+# filters and functions whose output can differ each time a template is rendered
+_NONDETERMINISTIC_FILTERS = {"password_hash", "random"}
+_NONDETERMINISTIC_GLOBALS = {"shadow_hash", "lipsum"}
 
 
 def _filename(path: str) -> str:
@@ -33,52 +49,155 @@ class Context:
         dry_run: bool = False,
         quiet: bool = False,
         explain: bool = False,
+        incremental: bool = False,
+        state_file: Optional[Path] = None,
+        console: Optional[Console] = None,
+        backend: Optional[SystemBackend] = None,
+        output: str = "rich",
+        tail: bool = False,
+        log_directory: Optional[Path] = None,
+        use_cache: bool = True,
+        durability: str = "none",
+        prompted_variables: Optional[dict] = None,
     ):
         self.root_directory = root_directory
         self.tags = set(tags)
         self.dry_run = dry_run
         self.quiet = quiet
         self.explain = explain
+        self.incremental = incremental
+        self.state_file = state_file or util.cache_directory() / "state.sqlite3"
+        self._state: Optional[StateDatabase] = None
+        self.output_mode = output
+        # whether results of previous runs (e.g. rendered templates) stored in the state database are used
+        self.use_cache = use_cache
+        self.syncer = Syncer(durability)
+        self.tail = tail
+        self.log_directory = log_directory or util.cache_directory() / "logs"
+        # id of each task that has streamed output -> its log file, unique within the run
+        self._log_files: Dict[int, Path] = {}
 
         extra_vars["instater_dir"] = str(root_directory.resolve())
         self.variables = extra_vars
+        # values prompted for by an earlier run, which are not prompted for again (and never printed), unless
+        # they are overridden
+        self.prompted_variables: dict = {
+            name: value for name, value in (prompted_variables or {}).items() if name not in extra_vars
+        }
+        self.variables.update(self.prompted_variables)
 
         self.jinja_env = _jinja_environment(root_directory)
+        # template strings compiled by jinja_string, and parsed YAML files, by source
+        self._templates: Dict[str, Template] = {}
+        self.yaml_cache: Dict[Path, object] = {}
+        self.file_index = FileIndex(root_directory)
+        # when applying the setup to a target root (see `instater.targets`), the root that task paths are under
+        self.target_root: Optional[Path] = None
         self.tasks: list = []
+        # setup, include, and variable files read while loading tasks
+        self.loaded_files: List[Path] = []
         self.statuses: typing.Counter[str] = Counter()
+        # the plan being recorded (with `instater plan`) or applied (with `instater apply`)
+        self.plan: Optional[Plan] = None
 
         self.start = time.time()
 
-        self.console = Console()
+        self.console = console or Console()
+        self.backend = backend or SystemBackend()
+        self.jinja_env.globals["shadow_hash"] = self.backend.user_password_hash
+        self.output = OUTPUTS[output](self.console)
         self._unprinted_messages: list = []
         self._inside_task: bool = False
 
         if TYPE_CHECKING:
             self.print = self.console.print
 
-    def enter_task(self):
+    def for_target(self, target_root: Path, extra_vars: dict, console: Console) -> "Context":
+        """A context applying the same setup to `target_root`, sharing parsed files and compiled templates"""
+
+        target_key = util.fingerprint(str(target_root))[:16]
+        context = Context(
+            root_directory=self.root_directory,
+            extra_vars=extra_vars,
+            tags=self.tags,
+            dry_run=self.dry_run,
+            quiet=self.quiet,
+            explain=self.explain,
+            incremental=self.incremental,
+            # targets run concurrently, and each writes its own state
+            state_file=self.state_file.with_name(f"{self.state_file.stem}-{target_key}{self.state_file.suffix}"),
+            console=console,
+            backend=self.backend,
+            output=self.output_mode,
+            tail=self.tail,
+            log_directory=self.log_directory / target_key,
+            use_cache=self.use_cache,
+            durability=self.syncer.mode,
+        )
+        context.share_caches(self)
+        context.target_root = target_root
+        return context
+
+    def share_caches(self, other: "Context"):
+        """Reuse the parsed files, compiled templates, and file index of `other`, which has the same root directory"""
+        self.jinja_env = other.jinja_env
+        self._templates = other._templates
+        self.yaml_cache = other.yaml_cache
+        self.file_index = other.file_index
+
+    @property
+    def state(self) -> StateDatabase:
+        # opened lazily so that runs which do not need persistent state never touch it
+        if self._state is None:
+            self._state = StateDatabase(self.state_file)
+        return self._state
+
+    def close(self):
+        self.syncer.sync()
+        if self._state is not None:
+            self._state.close()
+            self._state = None
+
+    def _emit(self, write: Callable, *args, **kwargs):
+        # with quiet, messages of a task are only written (and formatted) once the task has changed
+        if self.quiet and self._inside_task:
+            self._unprinted_messages.append((write, args, kwargs))
+        else:
+            write(*args, **kwargs)
+
+    def enter_task(self, name: str):
         if self._inside_task:
             raise RuntimeError("Already inside a task")
 
         self._inside_task = True
+        self._emit(self.output.task_start, name)
 
-    def exit_task_changed(self):
-        for args, kwargs in self._unprinted_messages:
-            self.console.print(*args, **kwargs)
+    def exit_task(self, name: str, type: str, changed: bool, start: float):
+        self._emit(self.output.task_end, name, type, changed, self.elapsed(start))
 
-        self.exit_task_skipped()
+        if changed:
+            for write, args, kwargs in self._unprinted_messages:
+                write(*args, **kwargs)
 
-    def exit_task_skipped(self):
         self._inside_task = False
         self._unprinted_messages.clear()
 
     if not TYPE_CHECKING:
 
         def print(self, *args, **kwargs):
-            if self.quiet and self._inside_task:
-                self._unprinted_messages.append((args, kwargs))
-            else:
-                self.console.print(*args, **kwargs)
+            self._emit(self.output.print, *args, **kwargs)
+
+    def write_file(self, path: Path, data: Union[bytes, Path]):
+        """Atomically replace `path` with `data` (or the content of a source file), synced as `durability` requires"""
+        write_file(path, data, fsync=self.syncer.mode == "file")
+        self.syncer.written(path)
+
+    def glob(self, pattern: str) -> List[str]:
+        return self.file_index.glob(pattern)
+
+    def invalidate_file_index(self, path: Union[str, Path, None] = None):
+        # only writes that land inside of the root directory invalidate the index
+        self.file_index.invalidate(path)
 
     def jinja_object(
         self,
@@ -99,7 +218,10 @@ class Context:
             if extra_vars:
                 vars = {**vars, **extra_vars}
 
-            value = self.jinja_env.from_string(template).render(vars)
+            compiled = self._templates.get(template)
+            if compiled is None:
+                compiled = self._templates[template] = self.jinja_env.from_string(template)
+            value = compiled.render(vars)
 
             if convert_numbers:
                 try:
@@ -122,37 +244,134 @@ class Context:
             vars = {**vars, **extra_vars}
         return self.jinja_env.get_template(template_path).render(vars)
 
-    def duration(self, start: Optional[float] = None):
+    def template_dependencies(self, template: str) -> Optional[List[Path]]:
+        """Find all template files (recursively) included or imported by a template string
+
+        Returns None when they cannot all be found: when a template name is
+        only known when rendering (e.g. `{% include name ~ ".j2" %}`), or
+        when a referenced template does not exist (e.g. with `ignore missing`).
+        """
+
+        dependencies: List[Path] = []
+        pending = [template]
+        while pending:
+            ast = self.jinja_env.parse(pending.pop())
+            for name in meta.find_referenced_templates(ast):
+                path = self.root_directory / name if name else None
+                if path is None or not path.is_file():
+                    return None
+                if path in dependencies:
+                    continue
+
+                dependencies.append(path)
+                pending.append(path.read_text())
+
+        return dependencies
+
+    def template_variables(self, template: str) -> Optional[Set[str]]:
+        """Names of the variables referenced by a template string and the templates it includes or imports
+
+        Returns None when the included or imported templates are not all known.
+        """
+
+        dependencies = self.template_dependencies(template)
+        if dependencies is None:
+            return None
+
+        names: Set[str] = set()
+        for source in [template] + [path.read_text() for path in dependencies]:
+            names |= meta.find_undeclared_variables(self.jinja_env.parse(source))
+        return names
+
+    def template_render_key(self, template: str) -> Optional[str]:
+        """A hash of everything the output of rendering a template string depends on
+
+        That is the template, the templates it includes or imports, and the
+        values of the variables they reference. Returns None when the output
+        may differ between renders (e.g. with a randomly salted `password_hash`),
+        or when the included or imported templates are not all known.
+        """
+
+        dependencies = self.template_dependencies(template)
+        if dependencies is None:
+            return None
+
+        sources = [template] + [path.read_text() for path in dependencies]
+        names: Set[str] = set()
+        for source in sources:
+            ast = self.jinja_env.parse(source)
+            if any(node.name in _NONDETERMINISTIC_FILTERS for node in ast.find_all(nodes.Filter)):
+                return None
+            names |= meta.find_undeclared_variables(ast)
+
+        if names & _NONDETERMINISTIC_GLOBALS:
+            return None
+
+        values = [(name, name in self.variables, self.variables.get(name)) for name in sorted(names)]
+        return util.fingerprint(sources, values)
+
+    def _log_file(self, task: "Task") -> Path:
+        log_file = self._log_files.get(id(task))
+        if log_file is None:
+            # tasks with the same name are numbered, so that they do not overwrite each other's logs
+            name = re.sub(r"[^\w.-]+", "_", task.name)
+            used = set(self._log_files.values())
+            log_file = self.log_directory / f"{name}.log"
+            number = 1
+            while log_file in used:
+                number += 1
+                log_file = self.log_directory / f"{name}-{number}.log"
+            self._log_files[id(task)] = log_file
+
+        return log_file
+
+    def output_stream(self, task: "Task") -> util.OutputStream:
+        """Stream for the output of a task's long-running commands, logged to a file named after the task
+
+        The log file is replaced each time this is called, so it is called
+        once per run of the task, and shared by all of the task's commands.
+        """
+
+        log_file = self._log_file(task)
+        if log_file.exists():
+            log_file.unlink()
+
+        # tailed lines are written immediately, even with quiet, so that memory use stays bounded
+        return util.OutputStream(log_file, self.output.tail if self.tail else None)
+
+    def elapsed(self, start: Optional[float] = None) -> float:
         if start is None:
             start = self.start
 
-        duration = round(time.time() - start, 3)
-        return f"[white]({duration}s)[/white]"
+        return round(time.time() - start, 3)
 
     def print_summary(self):
-        skipped = self.statuses["skipped"]
-        changed = self.statuses["changed"]
-
-        self.print(f"Summary {self.duration()}:", style="bold")
-        self.print(f"  skipped: {skipped}", style="blue")
-        # if this used style="yellow", the integer count would be turned blue by rich
-        self.print(f"  [yellow]changed: {changed}[/yellow]")
+        self.output.summary(self.statuses["changed"], self.statuses["skipped"], self.elapsed())
 
     def explain_skip(self, message: str):
         if self.explain:
             self.print(message + "\n", style="blue")
 
     def explain_change(self, message: str):
+        if self.plan is not None:
+            self.plan.action(message)
+
         if self.explain:
             if self.dry_run:
-                message = "[dry_run] " + message
+                message = escape("[dry_run] ") + message
 
             self.print(message + "\n", style="yellow bold")
 
+    def plan_content(self, path: Path, data: Union[bytes, Path]):
+        """Record the content (or source file) to be written to `path` in the plan, if there is one"""
+        if self.plan is not None:
+            self.plan.content(path, data)
+
     def explain_change_diff(self, a: str, b: str, file_a: str, file_b: str):
         if self.explain:
-            diff = util.diff_lines(a, b, file_a, file_b)
+            markup = self.output.markup
+            diff = diff_lines(a, b, file_a, file_b, markup=markup)
             if self.dry_run:
-                diff = "[dry_run]\n" + diff
+                diff = (escape("[dry_run]") if markup else "[dry_run]") + "\n" + diff
 
-            self.print(diff + "\n")
+            self.print(diff + "\n", markup=markup)
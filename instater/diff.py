@@ -0,0 +1,175 @@
+"""GitHub-style colored diffs (as rich markup) of file contents for --explain
+
+Diffing is quadratic in the size of the changed region, so unchanged lines at
+the start and end of files are trimmed before diffing, lines longer than
+`max_intraline_length` are not diffed character by character, and changed
+regions above `max_lines` lines or `max_size` characters are summarized
+instead of diffed.
+"""
+
+import difflib
+import itertools
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+from rich.markup import escape
+
+MAX_LINES = 5000
+MAX_SIZE = 1024 * 1024
+MAX_INTRALINE_LENGTH = 1000
+
+
+def _styled(markup: str, style: Optional[str]) -> str:
+    if not style:
+        return markup
+    return f"[{style}]{markup}[/{style}]"
+
+
+def diff_strings(
+    a: str, b: str, equal_style="white", delete_style="red", insert_style="green", skip_insert=False, skip_delete=False
+) -> str:
+    result: List[str] = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(a=a, b=b).get_opcodes():
+        if tag == "equal":
+            result.append(_styled(escape(a[i1:i2]), equal_style))
+
+        if tag in {"delete", "replace"} and not skip_delete:
+            result.append(_styled(escape(a[i1:i2]), delete_style))
+
+        if tag in {"insert", "replace"} and not skip_insert:
+            result.append(_styled(escape(b[j1:j2]), insert_style))
+
+    return "".join(result)
+
+
+def _diff_line_pair(a: str, b: str, delete_style: str, insert_style: str) -> Tuple[str, str]:
+    """The deleted and inserted halves of a changed line, both from a single diff"""
+
+    deleted: List[str] = []
+    inserted: List[str] = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(a=a, b=b).get_opcodes():
+        if tag == "equal":
+            equal = escape(a[i1:i2])
+            deleted.append(equal)
+            inserted.append(equal)
+        else:
+            if i1 != i2:
+                deleted.append(_styled(escape(a[i1:i2]), delete_style))
+            if j1 != j2:
+                inserted.append(_styled(escape(b[j1:j2]), insert_style))
+
+    return "".join(deleted), "".join(inserted)
+
+
+# Note: from difflib
+def _format_range_unified(start, stop):
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return str(beginning)
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+
+def _common_prefix(a: Sequence[str], b: Sequence[str]) -> int:
+    count = 0
+    for a_line, b_line in zip(a, b):
+        if a_line != b_line:
+            break
+        count += 1
+    return count
+
+
+def _common_suffix(a: Sequence[str], b: Sequence[str], limit: int) -> int:
+    count = 0
+    while count < limit and a[-count - 1] == b[-count - 1]:
+        count += 1
+    return count
+
+
+def iter_diff_lines(
+    a: Sequence[str],
+    b: Sequence[str],
+    file_a: str = "",
+    file_b: str = "",
+    context_lines: int = 1,
+    max_lines: int = MAX_LINES,
+    max_size: int = MAX_SIZE,
+    max_intraline_length: int = MAX_INTRALINE_LENGTH,
+    equal_style: Optional[str] = "white",
+    delete_style: Optional[str] = "red",
+    insert_style: Optional[str] = "green",
+    replace_delete_style: str = "bold",
+    replace_insert_style: str = "bold",
+    markup: bool = True,
+) -> Iterator[str]:
+    """Lines of markup of a unified diff of `a` and `b`, produced hunk by hunk
+
+    With `markup=False`, lines are plain text without any styles.
+    """
+
+    quote: Callable[[str], str] = escape
+    if not markup:
+        quote = str
+        equal_style = delete_style = insert_style = None
+
+    prefix = _common_prefix(a, b)
+    suffix = _common_suffix(a, b, min(len(a), len(b)) - prefix)
+    if prefix == len(a) == len(b):
+        return
+
+    # keep the context lines of the trimmed regions, so hunks are the same as diffing everything
+    start = max(prefix - context_lines, 0)
+    a_stop = len(a) - max(suffix - context_lines, 0)
+    b_stop = len(b) - max(suffix - context_lines, 0)
+
+    yield quote(f"--- {file_a}")
+    yield quote(f"+++ {file_b}")
+
+    a_changed, b_changed = a[prefix : len(a) - suffix], b[prefix : len(b) - suffix]
+    changed_size = sum(map(len, a_changed)) + sum(map(len, b_changed))
+    if len(a_changed) + len(b_changed) > max_lines or changed_size > max_size:
+        a_range = _format_range_unified(prefix, len(a) - suffix)
+        b_range = _format_range_unified(prefix, len(b) - suffix)
+        yield f"@@ -{a_range} +{b_range} @@"
+        changed = max(len(a_changed), len(b_changed))
+        yield _styled(f"{changed} lines changed (too large to diff)", insert_style)
+        return
+
+    matcher = difflib.SequenceMatcher(a=a[start:a_stop], b=b[start:b_stop])
+    for group in matcher.get_grouped_opcodes(n=context_lines):
+        first, last = group[0], group[-1]
+        file1_range = _format_range_unified(start + first[1], start + last[2])
+        file2_range = _format_range_unified(start + first[3], start + last[4])
+        yield f"@@ -{file1_range} +{file2_range} @@"
+
+        for tag, i1, i2, j1, j2 in group:
+            a_lines = a[start + i1 : start + i2]
+            b_lines = b[start + j1 : start + j2]
+
+            if tag == "equal":
+                for line in a_lines:
+                    yield " " + _styled(quote(line), equal_style)
+            elif tag == "delete":
+                for line in a_lines:
+                    yield _styled(quote("-" + line), delete_style)
+            elif tag == "insert":
+                for line in b_lines:
+                    yield _styled(quote("+" + line), insert_style)
+            elif tag == "replace":
+                for a_line, b_line in itertools.zip_longest(a_lines, b_lines):
+                    if b_line is None:
+                        yield _styled(quote("-" + a_line), delete_style)
+                    elif a_line is None:
+                        yield _styled(quote("+" + b_line), insert_style)
+                    elif not markup or len(a_line) + len(b_line) > max_intraline_length:
+                        yield _styled(quote("-" + a_line), delete_style)
+                        yield _styled(quote("+" + b_line), insert_style)
+                    else:
+                        deleted, inserted = _diff_line_pair(a_line, b_line, replace_delete_style, replace_insert_style)
+                        yield _styled("-" + deleted, delete_style)
+                        yield _styled("+" + inserted, insert_style)
+
+
+def diff_lines(a: str, b: str, file_a: str = "", file_b: str = "", **options) -> str:
+    return "\n".join(iter_diff_lines(a.splitlines(), b.splitlines(), file_a, file_b, **options))
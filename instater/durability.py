@@ -0,0 +1,209 @@
+"""Atomic file writes, and how durably written files are synced to disk
+
+Files are written to a temporary file in the destination's directory, then
+renamed over the destination, so a crash never leaves a partially written
+file. The replacement keeps the owner, group, and extended attributes (such
+as ACLs) of the file it replaces. Files that cannot be replaced by a rename
+(hard links, bind mounted files, or files in directories that cannot be
+written to) are written in place instead.
+
+How written files are flushed to disk depends on the durability mode:
+
+- `none`: not flushed, left to the kernel (the default)
+- `file`: each file (and its directory) is fsynced as it is written
+- `filesystem`: each filesystem that was written to is synced once, with
+  `syncfs`, at the end of the run, which is much cheaper than an fsync per
+  file when writing many files
+"""
+
+import errno
+import os
+import secrets
+import shutil
+import stat
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+DURABILITY_MODES = ("none", "file", "filesystem")
+
+# errors creating or renaming the temporary file, after which an existing file is written in place instead:
+# a bind mounted file cannot be renamed over (EBUSY), and its directory may not be writable (EACCES or EPERM)
+_IN_PLACE_ERRNOS = (errno.EBUSY, errno.EACCES, errno.EPERM)
+
+
+def write_file(path: Path, data: Union[bytes, Path], fsync: bool = False):
+    """Atomically replace `path` with `data`, or with the content and permissions of a source file"""
+
+    # write through symlinks rather than replacing them
+    path = Path(os.path.realpath(path))
+
+    try:
+        existing = os.stat(path)
+    except FileNotFoundError:
+        existing = None
+
+    # a rename would detach the destination from its other hard links, so they are written in place
+    if existing is not None and existing.st_nlink > 1:
+        _write_in_place(path, data, fsync)
+        return
+
+    if not _write_replacing(path, data, existing, fsync):
+        _write_in_place(path, data, fsync)
+
+
+def _can_write_in_place(error: OSError, existing: Optional[os.stat_result]) -> bool:
+    return existing is not None and error.errno in _IN_PLACE_ERRNOS
+
+
+def _write_replacing(path: Path, data: Union[bytes, Path], existing: Optional[os.stat_result], fsync: bool) -> bool:
+    """Replace `path` with a temporary file, returning False (having changed nothing) if it must be written in place"""
+
+    temp_path = path.with_name(f".{path.name}.{secrets.token_hex(4)}.tmp")
+    try:
+        # created with the same mode as opening `path` for writing would (0o666 minus the umask)
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    except OSError as e:
+        if _can_write_in_place(e, existing):
+            return False
+        raise
+
+    try:
+        with os.fdopen(fd, "wb") as file:
+            _write_data(file, data)
+            if fsync:
+                file.flush()
+                os.fsync(file.fileno())
+
+        # keep the owner and attributes of the file being replaced, as writing in place would (changing the
+        # owner clears setuid bits and capabilities, so it comes first)
+        if existing is not None:
+            if (existing.st_uid, existing.st_gid) != (os.geteuid(), os.getegid()):
+                try:
+                    os.chown(temp_path, existing.st_uid, existing.st_gid)
+                except PermissionError:
+                    # without privileges to keep the owner, writing in place keeps it instead
+                    os.unlink(temp_path)
+                    return False
+            _copy_xattrs(path, temp_path)
+
+        if isinstance(data, Path):
+            shutil.copymode(data, temp_path)
+        elif existing is not None:
+            os.chmod(temp_path, stat.S_IMODE(existing.st_mode))
+
+        try:
+            os.replace(temp_path, path)
+        except OSError as e:
+            if not _can_write_in_place(e, existing):
+                raise
+            os.unlink(temp_path)
+            return False
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return True
+
+
+def _copy_xattrs(src: Path, dest: Path):
+    """Copy the extended attributes of `src` (including ACLs), where the platform and filesystem support them"""
+
+    if not hasattr(os, "listxattr"):
+        return
+
+    try:
+        names = os.listxattr(src)
+    except OSError:
+        return
+
+    for name in names:
+        try:
+            os.setxattr(dest, name, os.getxattr(src, name))
+        except OSError:
+            # e.g. attributes of a namespace that requires privileges to set
+            pass
+
+
+def _write_data(file, data: Union[bytes, Path]):
+    if isinstance(data, Path):
+        with data.open("rb") as source:
+            shutil.copyfileobj(source, file)
+    else:
+        file.write(data)
+
+
+def _write_in_place(path: Path, data: Union[bytes, Path], fsync: bool):
+    with path.open("wb") as file:
+        _write_data(file, data)
+        if fsync:
+            file.flush()
+            os.fsync(file.fileno())
+
+    if isinstance(data, Path):
+        shutil.copymode(data, path)
+
+
+def fsync_directory(path: Path):
+    """Flush the entries of a directory (e.g. a file renamed into it) to disk"""
+
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+_libc = None
+
+
+def syncfs(path: Path):
+    """Flush all writes to the filesystem containing `path` to disk"""
+
+    global _libc
+
+    # imported on first use, since most runs do not sync filesystems
+    import ctypes
+    import ctypes.util
+
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+    syncfs = getattr(_libc, "syncfs", None)
+    if syncfs is None:
+        # not available outside of linux
+        os.sync()
+        return
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if syncfs(fd) != 0:
+            raise OSError(ctypes.get_errno(), f"Unable to sync the filesystem of {path}")
+    finally:
+        os.close(fd)
+
+
+class Syncer:
+    """Flushes written paths to disk as the durability mode requires"""
+
+    def __init__(self, mode: str = "none"):
+        self.mode = mode
+        # device -> a path on the filesystem, to sync at the end of the run
+        self._filesystems: Dict[int, Path] = {}
+
+    def written(self, path: Path):
+        """Called after `path` was created or replaced"""
+
+        if self.mode == "file":
+            fsync_directory(Path(os.path.abspath(path)).parent)
+        elif self.mode == "filesystem":
+            device = os.lstat(path).st_dev
+            if device not in self._filesystems:
+                self._filesystems[device] = Path(os.path.abspath(path)).parent
+
+    def sync(self):
+        for path in self._filesystems.values():
+            syncfs(path)
+        self._filesystems.clear()
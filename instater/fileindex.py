@@ -0,0 +1,176 @@
+import os
+import re
+from fnmatch import translate
+from functools import lru_cache
+from glob import glob
+from pathlib import Path
+from typing import Iterator, List, Optional, Pattern, Set, Tuple, Union
+
+_MAGIC = re.compile(r"[*?[]")
+
+
+@lru_cache(maxsize=None)
+def _compile(segment: str) -> Pattern:
+    return re.compile(translate(segment))
+
+
+def _hidden(name: str) -> bool:
+    return name.startswith(".")
+
+
+class _Directory:
+    """A lazily scanned directory, each directory is read at most once"""
+
+    __slots__ = ("path", "_entries")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Optional[List[Tuple[str, Optional["_Directory"]]]] = None
+
+    @property
+    def entries(self) -> List[Tuple[str, Optional["_Directory"]]]:
+        if self._entries is None:
+            entries = []
+            try:
+                with os.scandir(self.path) as scanned:
+                    for entry in scanned:
+                        try:
+                            # is_dir follows symlinks, matching the behavior of glob
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        entries.append((entry.name, _Directory(entry.path) if is_dir else None))
+            except OSError:
+                pass
+
+            entries.sort(key=lambda item: item[0])
+            self._entries = entries
+
+        return self._entries
+
+    def child(self, name: str) -> Tuple[bool, Optional["_Directory"]]:
+        for entry_name, directory in self.entries:
+            if entry_name == name:
+                return True, directory
+        return False, None
+
+    def identity(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+
+class FileIndex:
+    """In-memory index of the instater root directory for expanding globs
+
+    The directory tree is scanned on demand with `os.scandir` and cached until
+    `invalidate` is called, so many globs over the same root only read each
+    directory once. Matching follows the semantics of `glob(recursive=True)`,
+    but results are always sorted.
+    """
+
+    def __init__(self, root_directory: Path):
+        self.root_directory = root_directory
+        self._root_prefix = os.path.abspath(root_directory) + os.sep
+        self._root: Optional[_Directory] = None
+
+    def invalidate(self, path: Union[str, Path, None] = None):
+        if path is None or (os.path.abspath(path) + os.sep).startswith(self._root_prefix):
+            self._root = None
+
+    def glob(self, pattern: str) -> List[str]:
+        relative = self._relative(pattern)
+        segments = relative.split("/") if relative is not None else None
+
+        # anything that is outside of the root, or that walks up the tree, is
+        # not covered by the index
+        if not segments or any(segment in (".", "..") for segment in segments):
+            if not pattern.startswith("/"):
+                pattern = str(self.root_directory) + "/" + pattern
+            return sorted(glob(pattern, recursive=True))
+
+        if self._root is None:
+            self._root = _Directory(str(self.root_directory))
+
+        # results are absolute for absolute patterns, as with glob, even when the root is relative
+        prefix = self._root_prefix if pattern.startswith("/") else str(self.root_directory) + "/"
+        # drop duplicate slashes, keeping a trailing one (which only matches directories)
+        segments = [segment for segment in segments[:-1] if segment] + segments[-1:]
+        return sorted({prefix + path for path in self._match(self._root, "", segments, set())})
+
+    def _relative(self, pattern: str) -> Optional[str]:
+        if not pattern.startswith("/"):
+            return pattern
+
+        if pattern.startswith(self._root_prefix):
+            return pattern[len(self._root_prefix) :]
+
+        return None
+
+    def _match(self, directory: _Directory, prefix: str, segments: List[str], seen: Set) -> Iterator[str]:
+        segment, rest = segments[0], segments[1:]
+
+        if segment == "":
+            # a trailing slash, the current path must be a directory
+            yield prefix
+            return
+
+        if segment == "**":
+            if not rest:
+                yield prefix
+                yield from self._walk(directory, prefix, seen)
+                return
+
+            yield from self._match(directory, prefix, rest, seen)
+            for path, subdirectory in self._walk_directories(directory, prefix, seen):
+                yield from self._match(subdirectory, path + "/", rest, seen)
+            return
+
+        if not _MAGIC.search(segment):
+            exists, child = directory.child(segment)
+            if exists:
+                yield from self._descend(prefix + segment, child, rest, seen)
+            return
+
+        regex = _compile(segment)
+        include_hidden = _hidden(segment)
+        for name, child in directory.entries:
+            if (include_hidden or not _hidden(name)) and regex.match(name):
+                yield from self._descend(prefix + name, child, rest, seen)
+
+    def _descend(self, path: str, directory: Optional[_Directory], rest: List[str], seen: Set) -> Iterator[str]:
+        if not rest:
+            yield path
+        elif directory is not None:
+            yield from self._match(directory, path + "/", rest, seen)
+
+    def _walk(self, directory: _Directory, prefix: str, seen: Set) -> Iterator[str]:
+        for name, subdirectory in directory.entries:
+            if _hidden(name):
+                continue
+
+            yield prefix + name
+            if subdirectory is not None:
+                yield from self._recurse(subdirectory, prefix + name + "/", seen, self._walk)
+
+    def _walk_directories(self, directory: _Directory, prefix: str, seen: Set) -> Iterator[Tuple[str, _Directory]]:
+        for name, subdirectory in directory.entries:
+            if subdirectory is None or _hidden(name):
+                continue
+
+            yield prefix + name, subdirectory
+            yield from self._recurse(subdirectory, prefix + name + "/", seen, self._walk_directories)
+
+    def _recurse(self, directory: _Directory, prefix: str, seen: Set, walk) -> Iterator:
+        # guard against symlink cycles within a single recursive walk
+        identity = directory.identity()
+        if identity in seen:
+            return
+
+        seen.add(identity)
+        try:
+            yield from walk(directory, prefix, seen)
+        finally:
+            seen.discard(identity)
@@ -0,0 +1,258 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from rich.markup import escape
+from rich.table import Table
+
+_observers: list = []
+
+
+def add_observer(observer):
+    _observers.append(observer)
+
+
+def remove_observer(observer):
+    _observers.remove(observer)
+
+
+@contextmanager
+def observing(*observers) -> Iterator[None]:
+    """Add observers for the duration of a block (ignoring any that are None)"""
+
+    observers = tuple(observer for observer in observers if observer is not None)
+    for observer in observers:
+        add_observer(observer)
+
+    try:
+        yield
+    finally:
+        for observer in observers:
+            remove_observer(observer)
+
+
+def _cpu_time() -> float:
+    # includes the time of finished subprocesses, where most of the work often happens
+    times = os.times()
+    return time.process_time() + times.children_user + times.children_system
+
+
+@contextmanager
+def span(category: str, name: str, **args) -> Iterator[dict]:
+    """Measure a block of work, notifying all observers when it begins and ends
+
+    The yielded `args` dictionary may be updated within the block to attach
+    results (such as a task status or an exit code) to the span.
+    """
+
+    if not _observers:
+        yield args
+        return
+
+    observers = list(_observers)
+    for observer in observers:
+        observer.begin(category, name, args)
+
+    start = time.perf_counter()
+    cpu_start = _cpu_time()
+    try:
+        yield args
+    finally:
+        wall = time.perf_counter() - start
+        cpu = _cpu_time() - cpu_start
+        for observer in observers:
+            observer.end(category, name, args, start, wall, cpu)
+
+
+def count(name: str, amount: int):
+    for observer in _observers:
+        observer.count(name, amount)
+
+
+# the thread that replayed events were recorded in (see `replay`)
+_replayed_thread: Optional[Tuple[int, int, str]] = None
+
+
+def _current_thread() -> Tuple[int, int, str]:
+    """The process id, thread id, and thread name that a span ending now belongs to"""
+
+    if _replayed_thread is not None:
+        return _replayed_thread
+
+    thread = threading.current_thread()
+    return os.getpid(), thread.ident or 0, thread.name
+
+
+class Recorder:
+    """Records the notifications meant for observers, to replay them in another process"""
+
+    def __init__(self):
+        self.events: List[tuple] = []
+
+    def begin(self, category: str, name: str, args: dict):
+        self.events.append(("begin", (category, name, dict(args)), None))
+
+    def end(self, category: str, name: str, args: dict, start: float, wall: float, cpu: float):
+        self.events.append(("end", (category, name, dict(args), start, wall, cpu), _current_thread()))
+
+    def count(self, name: str, amount: int):
+        self.events.append(("count", (name, amount), None))
+
+
+@contextmanager
+def recording() -> Iterator[Optional[Recorder]]:
+    """Record notifications in place of the current observers, such as those inherited by a forked worker
+
+    Yields None (recording nothing) when there are no observers.
+    """
+
+    if not _observers:
+        yield None
+        return
+
+    observers = list(_observers)
+    recorder = Recorder()
+    _observers[:] = [recorder]
+    try:
+        yield recorder
+    finally:
+        _observers[:] = observers
+
+
+def replay(events: List[tuple]):
+    """Notify the current observers of the events recorded by a `Recorder`, in order"""
+
+    global _replayed_thread
+
+    for method, args, thread in events:
+        _replayed_thread = thread
+        try:
+            for observer in _observers:
+                getattr(observer, method)(*args)
+        finally:
+            _replayed_thread = None
+
+
+class RunReport:
+    """Collects per-task timing, subprocess, and I/O statistics of a run"""
+
+    def __init__(self):
+        self.tasks: List[dict] = []
+        self.commands: List[dict] = []
+        self._current: Optional[dict] = None
+
+    def begin(self, category: str, name: str, args: dict):
+        if category == "task":
+            self._current = {
+                "event": "task",
+                "task": name,
+                "type": args.get("type"),
+                "status": None,
+                "wall": 0.0,
+                "cpu": 0.0,
+                "commands": 0,
+                "command_time": 0.0,
+                "bytes_read": 0,
+                "bytes_written": 0,
+            }
+
+    def end(self, category: str, name: str, args: dict, start: float, wall: float, cpu: float):
+        current = self._current
+        if category == "task" and current is not None:
+            current.update(status=args.get("status"), wall=wall, cpu=cpu)
+            self.tasks.append(current)
+            self._current = None
+        elif category == "shell":
+            self.commands.append(
+                {
+                    "event": "command",
+                    "command": name,
+                    "task": current["task"] if current else None,
+                    "return_code": args.get("return_code"),
+                    "wall": wall,
+                }
+            )
+            if current is not None:
+                current["commands"] += 1
+                current["command_time"] += wall
+
+    def count(self, name: str, amount: int):
+        if self._current is not None and name in self._current:
+            self._current[name] += amount
+
+    def write(self, path: Path):
+        with path.open("w") as f:
+            for record in self.tasks + self.commands:
+                f.write(json.dumps(record) + "\n")
+
+    def print_slowest(self, context, limit: int = 10):
+        tasks = Table("Slowest tasks", "Wall", "CPU", "Commands", "Read", "Written")
+        for record in sorted(self.tasks, key=lambda record: record["wall"], reverse=True)[:limit]:
+            tasks.add_row(
+                escape(record["task"]),
+                f"{record['wall']:.3f}s",
+                f"{record['cpu']:.3f}s",
+                f"{record['commands']} ({record['command_time']:.3f}s)",
+                str(record["bytes_read"]),
+                str(record["bytes_written"]),
+            )
+
+        commands = Table("Slowest commands", "Task", "Wall", "Exit code")
+        for record in sorted(self.commands, key=lambda record: record["wall"], reverse=True)[:limit]:
+            task = escape(record["task"]) if record["task"] else None
+            commands.add_row(escape(record["command"]), task, f"{record['wall']:.3f}s", str(record["return_code"]))
+
+        context.print()
+        context.print(tasks)
+        if self.commands:
+            context.print(commands)
+
+
+class Tracer:
+    """Records every span as a Chrome trace event, viewable in Perfetto or chrome://tracing
+
+    Spans of worker processes are included when they are replayed into the
+    tracer (see `recording` and `replay`).
+    """
+
+    def __init__(self):
+        self.events: List[dict] = []
+        self._threads: Dict[Tuple[int, int], str] = {}
+
+    def begin(self, category: str, name: str, args: dict):
+        pass
+
+    def end(self, category: str, name: str, args: dict, start: float, wall: float, cpu: float):
+        pid, tid, thread_name = _current_thread()
+        self._threads[(pid, tid)] = thread_name
+
+        # perf_counter is monotonic system wide (on linux), so spans from
+        # concurrent threads and worker processes line up on the same timeline
+        self.events.append(
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": wall * 1e6,
+                "pid": pid,
+                "tid": tid,
+                "args": {**args, "cpu": cpu},
+            }
+        )
+
+    def count(self, name: str, amount: int):
+        pass
+
+    def write(self, path: Path):
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for (pid, tid), name in self._threads.items()
+        ]
+
+        with path.open("w") as f:
+            json.dump({"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}, f, default=str)
@@ -1,15 +1,17 @@
+import copy
 import getpass
-import shutil
-from glob import glob
 from pathlib import Path
-from typing import Iterable, List, Optional, Union
+from typing import Iterable, List, Mapping, Optional, Tuple, Union
 
 import yaml  # type: ignore
 
-from . import util
+from . import instrument, util
+from .backend import SystemBackend
 from .context import Context
 from .exceptions import InstaterError
-from .tasks import TASKS, pacman
+from .plan import Plan
+from .profiling import Profiler, profile_phase
+from .tasks import TASKS, Task
 
 
 def _print_start(context: Context, setup_file: Path):
@@ -18,8 +20,10 @@ def _print_start(context: Context, setup_file: Path):
         colored_tags = ", ".join(f"[bold]{tag}[/bold]" for tag in context.tags)
         context.print("Only executing specified tags:", colored_tags, style="blue")
 
-    if context.variables:
-        formatted_vars = " ".join(f"{key}={value!r}" for key, value in context.variables.items())
+    # prompted values (possibly private) are never printed
+    overridden = {key: value for key, value in context.variables.items() if key not in context.prompted_variables}
+    if overridden:
+        formatted_vars = " ".join(f"{key}={value!r}" for key, value in overridden.items())
         context.print("Overridden variables:", formatted_vars, style="blue")
 
     context.print()
@@ -76,7 +80,17 @@ def _prompt_variables(prompt_vars, context: Context):
         private = prompt_var.get("private")
         confirm = prompt_var.get("confirm")
         allow_empty = prompt_var.get("allow_empty")
-        context.variables[name] = _do_prompt(prompt, private, confirm, allow_empty)
+        context.variables[name] = context.prompted_variables[name] = _do_prompt(prompt, private, confirm, allow_empty)
+
+
+def _load_yaml(path: Path, context: Context):
+    if path not in context.yaml_cache:
+        with instrument.span("yaml", str(path)), path.open() as f:
+            context.yaml_cache[path] = yaml.safe_load(f)
+
+    context.loaded_files.append(path)
+    # loading tasks modifies the data (e.g. popping tags), so the cached data is copied
+    return copy.deepcopy(context.yaml_cache[path])
 
 
 def _file_variables(files, context: Context):
@@ -88,11 +102,11 @@ def _file_variables(files, context: Context):
 
     for file in files:
         file = context.root_directory / context.jinja_string(file)
-        with file.open() as f:
-            raw_vars = yaml.safe_load(f)
+        raw_vars = _load_yaml(file, context)
 
-        for var, value in raw_vars.items():
-            context.variables[var] = context.jinja_object(value, convert_numbers=True)
+        with instrument.span("variables", str(file)):
+            for var, value in raw_vars.items():
+                context.variables[var] = context.jinja_object(value, convert_numbers=True)
 
 
 def _extract_with(context: Context, task_args: dict) -> List[dict]:
@@ -102,10 +116,7 @@ def _extract_with(context: Context, task_args: dict) -> List[dict]:
         raise InstaterError("Must provide at most one `with_*` looping attribute")
 
     if fileglob:
-        if not fileglob.startswith("/"):
-            fileglob = str(context.root_directory) + "/" + fileglob
-
-        return [{"item": path} for path in glob(fileglob, recursive=True)]
+        return [{"item": path} for path in context.glob(fileglob)]
 
     return [{}]
 
@@ -179,28 +190,30 @@ def _include(context: Context, parent_tags: List[str], include: str, tags: Union
     if not include_file.exists():
         raise InstaterError(f"Included file does not exist: {include_file}")
 
-    with include_file.open() as f:
-        tasks = yaml.safe_load(f)
+    with instrument.span("include", include):
+        tasks = _load_yaml(include_file, context)
 
-    tags = tags or []
-    if isinstance(tags, str):
-        tags = [tags]
+        tags = tags or []
+        if isinstance(tags, str):
+            tags = [tags]
 
-    tags.extend(parent_tags)
+        tags.extend(parent_tags)
 
-    _load_tasks(tasks, context, tags)
+        _load_tasks(tasks, context, tags)
 
 
 def _alert_pacman_manually_installed(bootstrapped_packages: Optional[List[str]], context: Context):
+    from .tasks.pacman import Pacman
+
     ignore_packages = set(bootstrapped_packages or ())
     packages = set()
 
     for task in context.tasks:
-        if isinstance(task, pacman.Pacman):
+        if isinstance(task, Pacman):
             for package in task.packages:
-                packages.update(pacman.get_package_or_group_packages(package))
+                packages.update(context.backend.package_or_group_packages(package))
 
-    explicitly_installed_packages = pacman.get_explicitly_installed_packages()
+    explicitly_installed_packages = context.backend.explicitly_installed_packages()
     manually_installed = explicitly_installed_packages - packages - ignore_packages
 
     if manually_installed:
@@ -213,52 +226,164 @@ def _alert_pacman_manually_installed(bootstrapped_packages: Optional[List[str]],
             context.print("  - " + package, style="bold")
 
 
-def run_tasks(
-    setup_file,
-    override_variables: Optional[dict] = None,
-    tags: Optional[Iterable[str]] = None,
-    dry_run: bool = False,
-    quiet: bool = False,
-    explain: bool = False,
-    skip_tasks: bool = False,
-):
-    setup_file = Path(setup_file)
+def _load_context(
+    setup_file: Path,
+    override_variables: Optional[dict],
+    tags: Optional[Iterable[str]],
+    load_tasks: bool = True,
+    **options,
+) -> Tuple[Context, dict]:
     context = Context(
         root_directory=setup_file.parent,
         extra_vars=override_variables or {},
         tags=tags or (),
-        dry_run=dry_run,
-        quiet=quiet,
-        explain=explain,
+        **options,
     )
 
     if not setup_file.exists():
         raise InstaterError(f"Setup file does not exist: {setup_file}")
 
     _print_start(context, setup_file)
+    if not load_tasks:
+        return context, _read_setup(setup_file, context)
+
+    return context, _load_setup(setup_file, context)
 
-    with setup_file.open() as f:
-        setup_data = yaml.safe_load(f)
 
+def _read_setup(setup_file: Path, context: Context) -> dict:
+    setup_data = _load_yaml(setup_file, context)
     if isinstance(setup_data, list):
         if len(setup_data) > 1:
             raise InstaterError(f"Cannot specify multiple root list items in {setup_file}")
         setup_data = setup_data[0]
 
     _prompt_variables(setup_data.get("vars_prompt"), context)
-    _file_variables(setup_data.get("vars_files"), context)
-    _load_tasks(setup_data.get("tasks"), context)
+    return setup_data
 
-    if not skip_tasks:
-        with context.console.status("Running tasks...", spinner="dots"):
-            for task in context.tasks:
+
+def _load_setup(setup_file: Path, context: Context) -> dict:
+    with instrument.span("phase", "load"):
+        setup_data = _read_setup(setup_file, context)
+        _file_variables(setup_data.get("vars_files"), context)
+        _load_tasks(setup_data.get("tasks"), context)
+
+    return setup_data
+
+
+def _run_loaded_tasks(context: Context, tasks: List[Task]):
+    try:
+        with instrument.span("phase", "run"), context.output.status("Running tasks..."):
+            for task in tasks:
                 task.run_task(context)
+    finally:
+        context.close()
+
+
+def run_tasks(
+    setup_file,
+    override_variables: Optional[dict] = None,
+    tags: Optional[Iterable[str]] = None,
+    dry_run: bool = False,
+    quiet: bool = False,
+    explain: bool = False,
+    skip_tasks: bool = False,
+    incremental: bool = False,
+    state_file: Union[str, Path, None] = None,
+    report_file: Optional[Path] = None,
+    trace_file: Optional[Path] = None,
+    profile_directory: Optional[Path] = None,
+    backend: Optional[SystemBackend] = None,
+    output: str = "rich",
+    tail: bool = False,
+    targets: Optional[Mapping[str, Optional[dict]]] = None,
+    jobs: Optional[int] = None,
+    plan_file: Optional[Path] = None,
+    plan: Optional[Plan] = None,
+    use_cache: bool = True,
+    durability: str = "none",
+):
+    """Run the tasks of `setup_file`
+
+    With `targets` (a mapping of target root directories to variables for that
+    target), the setup is applied to each target root instead of to the
+    current system, running up to `jobs` targets at a time.
+
+    With `plan_file`, the tasks are run as a dry run, and the changes they would
+    make are written as a plan to be applied later with `apply_plan`.
+    """
+
+    if targets is not None and (plan_file is not None or plan is not None):
+        raise InstaterError("Plans cannot be used with targets")
+
+    setup_file = Path(setup_file)
+    # copied before the context adds its own variables
+    plan_variables = dict(override_variables or {})
+    report = instrument.RunReport() if report_file else None
+    tracer = instrument.Tracer() if trace_file else None
+    profiler = Profiler(Path(profile_directory)) if profile_directory else None
+
+    with instrument.observing(report, tracer):
+        with profile_phase(profiler, "load"):
+            context, setup_data = _load_context(
+                setup_file,
+                override_variables,
+                tags,
+                dry_run=dry_run or plan_file is not None,
+                quiet=quiet,
+                explain=explain,
+                incremental=incremental,
+                state_file=Path(state_file) if state_file else None,
+                backend=backend,
+                output=output,
+                tail=tail,
+                use_cache=use_cache,
+                durability=durability,
+                # with targets, tasks are loaded with the variables of each target
+                load_tasks=targets is None,
+            )
+
+        if plan is not None:
+            plan.check(context)
+            context.plan = plan
+        elif plan_file is not None:
+            context.plan = Plan(setup_file, plan_variables, tags or ())
+
+        if not skip_tasks:
+            with profile_phase(profiler, "run"):
+                if targets is not None:
+                    from .targets import run_targets
+
+                    run_targets(context, setup_file, targets, jobs)
+                else:
+                    _run_loaded_tasks(context, context.tasks)
+
+    if plan_file is not None:
+        context.plan.write(Path(plan_file))  # type: ignore
+        context.print(f"Plan written to {plan_file}", style="green bold")
 
     context.print_summary()
 
-    # Don't run this check when a subset of tags were passed in, since not all tasks are loaded
-    if not tags and shutil.which("pacman"):
-        with context.console.status("Checking for untracked pacman packages...", spinner="dots"):
+    if profiler is not None:
+        profiler.print_hot_spots(context)
+
+    if tracer is not None:
+        tracer.write(Path(trace_file))  # type: ignore
+
+    if report is not None:
+        report.write(Path(report_file))  # type: ignore
+        report.print_slowest(context)
+
+    # Don't run this check when a subset of tags were passed in, since not all tasks are loaded,
+    # or with targets, since packages are only installed on the current system
+    if not tags and targets is None and context.backend.has_pacman():
+        with context.output.status("Checking for untracked pacman packages..."):
             _alert_pacman_manually_installed(setup_data.get("pacman_bootstrapped_packages"), context)
 
     return context
+
+
+def apply_plan(plan_file, **options):
+    """Run the changes of a plan written by `run_tasks(plan_file=...)`, if the plan is not stale"""
+
+    plan = Plan.read(Path(plan_file))
+    return run_tasks(plan.setup_file, dict(plan.variables), plan.tags, plan=plan, **options)
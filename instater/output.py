@@ -0,0 +1,154 @@
+"""Writers of instater's progress output
+
+`RichOutput` renders markup, colors, and spinners through a rich `Console`.
+`PlainOutput` and `JsonOutput` are lightweight writers for non-interactive
+environments (CI logs, cron, systemd units): they write directly to a file,
+only strip markup from messages that contain any, and never show spinners.
+"""
+
+import json
+import time
+from contextlib import nullcontext
+from typing import IO, Dict, List, Optional, Type
+
+from rich.console import Console
+from rich.markup import escape, render
+
+OUTPUT_MODES = ("rich", "plain", "json")
+
+
+def _is_renderable(obj) -> bool:
+    return hasattr(obj, "__rich_console__") or hasattr(obj, "__rich__")
+
+
+def _plain(objects: tuple, markup: bool = True, sep: str = " ") -> str:
+    text = sep.join(str(obj) for obj in objects)
+    if markup and "[" in text:
+        return render(text).plain
+    return text
+
+
+class RichOutput:
+    markup = True
+
+    def __init__(self, console: Console):
+        self.console = console
+
+    def print(self, *objects, **kwargs):
+        self.console.print(*objects, **kwargs)
+
+    def status(self, message: str):
+        return self.console.status(message, spinner="dots")
+
+    def task_start(self, name: str):
+        self.console.print(escape(f"TASK [{name}]"), style="black bold on blue", justify="left")
+
+    def task_end(self, name: str, type: str, changed: bool, duration: float):
+        if changed:
+            self.console.print(f"changed [white]({duration}s)[/white]", style="yellow bold")
+        else:
+            self.console.print(f"skipped [white]({duration}s)[/white]", style="blue")
+        self.console.print()
+
+    def tail(self, line: str):
+        self.console.print(line, style="dim", markup=False, highlight=False)
+
+    def target(self, root: str, text: str, error: Optional[str]):
+        self.console.print(escape(f"TARGET [{root}]"), style="black bold on magenta", justify="left")
+        self.console.file.write(text)
+        if error is not None:
+            self.console.print(error, style="red")
+        self.console.print()
+
+    def summary(self, changed: int, skipped: int, duration: float):
+        self.console.print(f"Summary [white]({duration}s)[/white]:", style="bold")
+        self.console.print(f"  skipped: {skipped}", style="blue")
+        # if this used style="yellow", the integer count would be turned blue by rich
+        self.console.print(f"  [yellow]changed: {changed}[/yellow]")
+
+
+class PlainOutput:
+    """Uncolored text, without rich rendering"""
+
+    markup = False
+
+    def __init__(self, console: Console):
+        self.file: IO[str] = console.file
+        # only used for renderables such as tables, which have no plain text form
+        self._console = Console(file=self.file, no_color=True, highlight=False, emoji=False)
+
+    def print(self, *objects, sep: str = " ", end: str = "\n", markup: bool = True, **kwargs):
+        if any(_is_renderable(obj) for obj in objects):
+            self._console.print(*objects, sep=sep, end=end, markup=markup)
+        else:
+            self.file.write(_plain(objects, markup, sep) + end)
+
+    def status(self, message: str):
+        return nullcontext()
+
+    def task_start(self, name: str):
+        self.file.write(f"TASK [{name}]\n")
+
+    def task_end(self, name: str, type: str, changed: bool, duration: float):
+        self.file.write(f"{'changed' if changed else 'skipped'} ({duration}s)\n\n")
+
+    def tail(self, line: str):
+        self.file.write(line + "\n")
+
+    def target(self, root: str, text: str, error: Optional[str]):
+        self.file.write(f"TARGET [{root}]\n{text}")
+        if error is not None:
+            self.file.write(error + "\n")
+        self.file.write("\n")
+
+    def summary(self, changed: int, skipped: int, duration: float):
+        self.file.write(f"Summary ({duration}s):\n  skipped: {skipped}\n  changed: {changed}\n")
+
+
+class JsonOutput:
+    """One JSON object per line: an event per task, with messages printed by the task included"""
+
+    markup = False
+
+    def __init__(self, console: Console):
+        self.file: IO[str] = console.file
+        self._messages: Optional[List[str]] = None
+
+    def _event(self, event: str, **fields):
+        self.file.write(json.dumps({"event": event, "time": time.time(), **fields}) + "\n")
+
+    def print(self, *objects, sep: str = " ", markup: bool = True, **kwargs):
+        # renderables such as tables are summaries meant for people, the same data is in --report
+        if not objects or any(_is_renderable(obj) for obj in objects):
+            return
+
+        message = _plain(objects, markup, sep)
+        if self._messages is not None:
+            self._messages.append(message)
+        else:
+            self._event("message", message=message)
+
+    def status(self, message: str):
+        return nullcontext()
+
+    def task_start(self, name: str):
+        self._messages = []
+
+    def task_end(self, name: str, type: str, changed: bool, duration: float):
+        status = "changed" if changed else "skipped"
+        messages, self._messages = self._messages, None
+        self._event("task", name=name, type=type, status=status, duration=duration, messages=messages)
+
+    def tail(self, line: str):
+        self._event("output", line=line)
+
+    def target(self, root: str, text: str, error: Optional[str]):
+        # the events of the target's tasks follow the target event
+        self._event("target", root=root, status="failed" if error is not None else "ok", error=error)
+        self.file.write(text)
+
+    def summary(self, changed: int, skipped: int, duration: float):
+        self._event("summary", changed=changed, skipped=skipped, duration=duration)
+
+
+OUTPUTS: Dict[str, Type] = {"rich": RichOutput, "plain": PlainOutput, "json": JsonOutput}
@@ -0,0 +1,132 @@
+"""Reader of the pacman local database (`/var/lib/pacman/local`)
+
+Each installed package has a directory containing a `desc` file, made of
+`%SECTION%` headers followed by one value per line, for example:
+
+    %NAME%
+    bash
+
+    %GROUPS%
+    base
+
+    %REASON%
+    1
+
+A `%REASON%` of 1 means the package was installed as a dependency, and a
+missing reason (or 0) means it was explicitly installed.
+
+Parsing every `desc` file takes tens of milliseconds, so the result is cached
+in memory and in a JSON file shared across runs, both invalidated when the
+modification time of the database directory changes (which pacman updates
+whenever it adds or removes a package), or that of its parent directory.
+Some changes rewrite `desc` files in place (e.g. `pacman -D --asdeps`), but
+every pacman operation that writes to the database creates and removes the
+`db.lck` lock file in the parent directory, updating its modification time.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+DEFAULT_PATH = Path("/var/lib/pacman/local")
+
+
+class LocalDatabase:
+    def __init__(self, packages: Dict[str, bool], groups: Dict[str, List[str]], provides: Dict[str, List[str]]):
+        # package name -> whether it was explicitly installed
+        self.packages = packages
+        # group name -> installed packages in the group
+        self.groups = groups
+        # virtual package name (e.g. "sh") -> installed packages providing it
+        self.provides = provides
+
+    def installed(self, name: str) -> bool:
+        """Whether `name` is an installed package, provided by one, or a group with an installed package"""
+        return name in self.packages or name in self.provides or name in self.groups
+
+    def explicitly_installed(self) -> Set[str]:
+        return {name for name, explicit in self.packages.items() if explicit}
+
+    def package_or_group_packages(self, name: str) -> Set[str]:
+        return set(self.groups.get(name, [name]))
+
+    def to_json(self) -> dict:
+        return {"packages": self.packages, "groups": self.groups, "provides": self.provides}
+
+
+def _parse_desc(text: str) -> Dict[str, List[str]]:
+    sections: Dict[str, List[str]] = {}
+    values: List[str] = []
+    for line in text.splitlines():
+        if line.startswith("%") and line.endswith("%"):
+            values = sections.setdefault(line[1:-1], [])
+        elif line:
+            values.append(line)
+    return sections
+
+
+def parse(path: Path) -> LocalDatabase:
+    packages: Dict[str, bool] = {}
+    groups: Dict[str, List[str]] = {}
+    provides: Dict[str, List[str]] = {}
+
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+
+            try:
+                with open(os.path.join(entry.path, "desc"), encoding="utf-8") as file:
+                    desc = _parse_desc(file.read())
+            except FileNotFoundError:
+                continue
+
+            name = desc["NAME"][0]
+            packages[name] = desc.get("REASON", ["0"])[0] == "0"
+            for group in desc.get("GROUPS", []):
+                groups.setdefault(group, []).append(name)
+            for provided in desc.get("PROVIDES", []):
+                # strip version constraints, e.g. "sh=5.2"
+                provides.setdefault(provided.split("=", 1)[0], []).append(name)
+
+    return LocalDatabase(packages, groups, provides)
+
+
+_memory_cache: Dict[Path, tuple] = {}
+
+
+def _modification_times(path: Path) -> List[int]:
+    return [path.stat().st_mtime_ns, path.parent.stat().st_mtime_ns]
+
+
+def read(path: Path = DEFAULT_PATH, cache_file: Optional[Path] = None) -> LocalDatabase:
+    """The parsed database at `path`, from the in-memory or `cache_file` cache if the database is unchanged"""
+
+    mtime = _modification_times(path)
+
+    cached = _memory_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    database = None
+    if cache_file is not None and cache_file.exists():
+        try:
+            data = json.loads(cache_file.read_text())
+            if data["path"] == str(path) and data["mtime"] == mtime:
+                database = LocalDatabase(**data["database"])
+        except (ValueError, KeyError, TypeError):
+            # a corrupt or outdated cache is replaced below
+            pass
+
+    if database is None:
+        database = parse(path)
+        if cache_file is not None:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            data = {"path": str(path), "mtime": mtime, "database": database.to_json()}
+            temp_file = cache_file.with_name(cache_file.name + ".tmp")
+            temp_file.write_text(json.dumps(data))
+            temp_file.replace(cache_file)
+
+    _memory_cache[path] = (mtime, database)
+    return database
@@ -0,0 +1,130 @@
+"""Execution plans, written by `instater plan` and run by `instater apply`
+
+A plan is recorded during a dry run. For each task it holds the rendered
+arguments (and their fingerprint), the observed state of the files the task
+reads and writes (see `Task.incremental_paths`), whether the task would
+change anything, the changes it explained, and the hashes of file contents
+it would write.
+
+Applying a plan reloads the setup with the same variables and tags, and
+checks that it is not stale: every task must have the same fingerprint and
+observed file state as when it was planned. Only the tasks that were planned
+to change are run, the others are skipped without checking system state
+again. While running, contents that differ from the planned hashes are
+rejected rather than written.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, List, Optional, Union
+
+from rich.markup import render
+
+from .exceptions import InstaterError
+from .state import hash_file
+
+if TYPE_CHECKING:
+    from .context import Context
+    from .tasks import Task
+
+PLAN_VERSION = 1
+
+
+class Plan:
+    def __init__(self, setup_file: Path, variables: dict, tags: Iterable[str], tasks: Optional[List[dict]] = None):
+        self.setup_file = setup_file
+        self.variables = variables
+        self.tags = list(tags)
+        # a plan read from a file is being applied, otherwise tasks are recorded as they run
+        self.applying = tasks is not None
+        self.tasks: List[dict] = tasks if tasks is not None else []
+        self._current: Optional[dict] = None
+        self._index = 0
+
+    def start_task(self, task: "Task", context: "Context"):
+        if self.applying:
+            self._current = self.tasks[self._index]
+            self._index += 1
+            return
+
+        self._current = {
+            "name": task.name,
+            "type": type(task).__name__,
+            "fingerprint": task.fingerprint(context),
+            "arguments": json.loads(json.dumps(vars(task), default=str)),
+            "state": task._incremental_state(context),
+            "changed": None,
+            "actions": [],
+            "contents": {},
+        }
+        self.tasks.append(self._current)
+
+    def end_task(self, changed: bool):
+        if not self.applying:
+            self._current["changed"] = changed  # type: ignore
+        self._current = None
+
+    def planned_change(self) -> bool:
+        return self._current is not None and bool(self._current["changed"])
+
+    def action(self, message: str):
+        if self._current is not None and not self.applying:
+            self._current["actions"].append(render(message).plain)
+
+    def content(self, path: Path, data: Union[bytes, Path]):
+        """Record (or when applying, check) the content that will be written to `path`"""
+
+        if self._current is None:
+            return
+
+        digest = hash_file(data) if isinstance(data, Path) else hashlib.sha256(data).hexdigest()
+        key = os.path.abspath(path)
+        if not self.applying:
+            self._current["contents"][key] = digest
+        elif self._current["contents"].get(key, digest) != digest:
+            raise InstaterError(f"Plan is stale: the content to write to {path} differs from the plan")
+
+    def check(self, context: "Context"):
+        """Raise an error if the loaded tasks or the files they use changed since the plan was made"""
+
+        if len(context.tasks) != len(self.tasks):
+            raise InstaterError(
+                f"Plan is stale: the setup has {len(context.tasks)} tasks, the plan has {len(self.tasks)}"
+            )
+
+        for task, planned in zip(context.tasks, self.tasks):
+            if task.fingerprint(context) != planned["fingerprint"]:
+                raise InstaterError(f"Plan is stale: the arguments of task '{task.name}' changed")
+            if task._incremental_state(context) != planned["state"]:
+                raise InstaterError(f"Plan is stale: files used by task '{task.name}' changed")
+
+    def to_json(self) -> dict:
+        return {
+            "version": PLAN_VERSION,
+            "setup_file": str(self.setup_file.absolute()),
+            "variables": self.variables,
+            "tags": self.tags,
+            "tasks": self.tasks,
+        }
+
+    def write(self, path: Path):
+        # plans contain rendered variables and file contents, which may be secret
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        # an existing file keeps its mode when opened
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, "w") as file:
+            file.write(json.dumps(self.to_json(), indent=2) + "\n")
+
+    @classmethod
+    def read(cls, path: Path) -> "Plan":
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError) as e:
+            raise InstaterError(f"Could not read plan {path}: {e}")
+
+        if not isinstance(data, dict) or data.get("version") != PLAN_VERSION:
+            raise InstaterError(f"Unsupported plan {path}, run `instater plan` again")
+
+        return cls(Path(data["setup_file"]), data["variables"], data["tags"], data["tasks"])
@@ -0,0 +1,112 @@
+"""A persistent /bin/sh coprocess for running read-only state checks
+
+Backends check system state with many short commands (`getent`, `systemctl
+is-active`, `pacman -Qi`, etc). Rather than spawning each from python with a
+new set of pipes, the commands are written to one long-lived shell, and the
+end of each command's output is marked by a sentinel line (followed by the
+exit code on stdout).
+"""
+
+import atexit
+import os
+import secrets
+import selectors
+import shlex
+import subprocess
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from .exceptions import InstaterError
+
+
+class ProbeShell:
+    def __init__(self):
+        self.sentinel = f"__instater_probe_{secrets.token_hex(8)}__".encode("ascii")
+        self._process = subprocess.Popen(
+            ["/bin/sh"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        self._lock = threading.Lock()
+
+    def run(self, command: List[str], directory: Optional[Union[str, Path]] = None) -> Tuple[int, bytes, bytes]:
+        script = " ".join(shlex.quote(arg) for arg in command) + " </dev/null"
+        if directory is not None:
+            # a subshell, so that the directory of the shell itself is unchanged
+            script = f"(cd {shlex.quote(str(directory))} && {script})"
+
+        sentinel = self.sentinel.decode("ascii")
+        script += f"\nprintf '\\n{sentinel} %d\\n' $?\nprintf '\\n{sentinel}\\n' >&2\n"
+
+        with self._lock:
+            try:
+                self._process.stdin.write(script.encode("utf-8"))  # type: ignore
+                self._process.stdin.flush()  # type: ignore
+                stdout, stderr = self._read_outputs()
+            except (BrokenPipeError, EOFError):
+                self.close()
+                raise InstaterError(f"Probe shell exited unexpectedly while running '{script.splitlines()[0]}'")
+
+        # output is followed by "\n<sentinel> <exit code>\n" on stdout, and "\n<sentinel>\n" on stderr
+        stdout, _, status = stdout[:-1].rpartition(b"\n" + self.sentinel + b" ")
+        return int(status), stdout, stderr[: -len(self.sentinel) - 2]
+
+    def _read_outputs(self) -> Tuple[bytes, bytes]:
+        stdout_fd = self._process.stdout.fileno()  # type: ignore
+        stderr_fd = self._process.stderr.fileno()  # type: ignore
+        outputs = {stdout_fd: bytearray(), stderr_fd: bytearray()}
+
+        with selectors.DefaultSelector() as selector:
+            for fd in outputs:
+                selector.register(fd, selectors.EVENT_READ)
+
+            while selector.get_map():
+                for key, _ in selector.select():
+                    data = os.read(key.fd, 65536)
+                    if not data:
+                        raise EOFError()
+
+                    output = outputs[key.fd]
+                    output += data
+                    if output.endswith(b"\n") and self.sentinel in output[-len(self.sentinel) - 16 :]:
+                        selector.unregister(key.fd)
+
+        return bytes(outputs[stdout_fd]), bytes(outputs[stderr_fd])
+
+    def close(self):
+        if self._process.poll() is None:
+            self._process.stdin.close()  # type: ignore
+            self._process.wait()
+
+
+_shell: Optional[ProbeShell] = None
+_shell_lock = threading.Lock()
+
+
+def probe_shell() -> ProbeShell:
+    global _shell
+
+    with _shell_lock:
+        if _shell is None or _shell._process.poll() is not None:
+            _shell = ProbeShell()
+        return _shell
+
+
+def _forget_probe_shell():
+    # a forked child must not share the parent's shell, it starts its own on first use
+    global _shell, _shell_lock
+
+    _shell = None
+    _shell_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_probe_shell)
+
+
+@atexit.register
+def close_probe_shell():
+    global _shell
+
+    with _shell_lock:
+        if _shell is not None:
+            _shell.close()
+            _shell = None
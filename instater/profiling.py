@@ -0,0 +1,49 @@
+import cProfile
+import io
+import pstats
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import ContextManager, Iterator, List, Optional
+
+
+class Profiler:
+    """Profiles each phase of a run in a separate cProfile session
+
+    Each phase is written to `instater-<phase>.pstats` within `directory`,
+    which can be loaded with `pstats` or tools such as snakeviz.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.files: List[Path] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory / f"instater-{name}.pstats"
+            profile.dump_stats(str(path))
+            self.files.append(path)
+
+    def print_hot_spots(self, context, limit: int = 15):
+        for path in self.files:
+            output = io.StringIO()
+            pstats.Stats(str(path), stream=output).sort_stats("cumulative").print_stats(limit)
+
+            context.print()
+            context.print(f"Profile written to {path}", style="bold")
+            # skip the header, which only repeats the file name
+            context.print(
+                output.getvalue().split("\n", 2)[-1].strip("\n"), markup=False, highlight=False, soft_wrap=True
+            )
+
+
+def profile_phase(profiler: Optional[Profiler], name: str) -> ContextManager:
+    if profiler is None:
+        return nullcontext()
+    return profiler.phase(name)
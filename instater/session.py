@@ -0,0 +1,92 @@
+"""Repeated runs of one setup from a long-lived python process
+
+`run_tasks` starts from scratch on every call. A `Session` keeps state that
+is expensive to rebuild between its runs:
+
+- the parsed YAML of the setup, include, and variable files
+- the jinja environment and compiled template strings
+- the index of the instater directory used by `with_fileglob`
+- the backend, with its snapshots of system state (such as the parsed pacman
+  database), and the persistent shells and workers used to query the system
+- values of prompted variables, so prompts are only shown by the first run
+
+Each run still gets its own `Context`, so variables, registered results, and
+statuses do not leak from one run into the next. Cached files are not checked
+for changes: call `invalidate` after changing files in the instater directory.
+"""
+
+import os
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+from .backend import SystemBackend
+from .context import Context
+from .exceptions import InstaterError
+from .main import _load_setup, _print_start, _run_loaded_tasks
+
+
+class Session:
+    def __init__(
+        self,
+        setup_file: Union[str, Path],
+        variables: Optional[dict] = None,
+        backend: Optional[SystemBackend] = None,
+        **options,
+    ):
+        """`options` are passed to each run's `Context` (e.g. `dry_run`, `quiet`, or `output`)"""
+
+        self.setup_file = Path(setup_file)
+        self.variables = dict(variables or {})
+        # kept apart from `variables`, so that (possibly private) prompted values are never printed
+        self.prompted_variables: dict = {}
+        self.backend = backend or SystemBackend()
+        self.options = options
+        # the context of the first run since the last full invalidation, whose caches later runs share
+        self._cache_context: Optional[Context] = None
+
+    def run(self, tags: Optional[Iterable[str]] = None, variables: Optional[dict] = None, **options) -> Context:
+        """Run the tasks matching `tags` (or all tasks), with `variables` overriding those of the session"""
+
+        if not self.setup_file.exists():
+            raise InstaterError(f"Setup file does not exist: {self.setup_file}")
+
+        context = Context(
+            root_directory=self.setup_file.parent,
+            extra_vars={**self.variables, **(variables or {})},
+            tags=tags or (),
+            backend=self.backend,
+            prompted_variables=self.prompted_variables,
+            **{**self.options, **options},
+        )
+        if self._cache_context is None:
+            self._cache_context = context
+        else:
+            context.share_caches(self._cache_context)
+
+        _print_start(context, self.setup_file)
+        _load_setup(self.setup_file, context)
+        self.prompted_variables.update(context.prompted_variables)
+
+        _run_loaded_tasks(context, context.tasks)
+        context.print_summary()
+        return context
+
+    def invalidate(self, path: Union[str, Path, None] = None):
+        """Forget cached state of a changed file or directory, or all cached state if no path is given"""
+
+        if path is None:
+            self._cache_context = None
+            self.backend.invalidate()
+            return
+
+        if self._cache_context is None:
+            return
+
+        changed = os.path.abspath(path)
+        yaml_cache = self._cache_context.yaml_cache
+        for cached in list(yaml_cache):
+            cached_path = os.path.abspath(cached)
+            if cached_path == changed or cached_path.startswith(changed + os.sep):
+                del yaml_cache[cached]
+
+        self._cache_context.invalidate_file_index(path)
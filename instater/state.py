@@ -0,0 +1,121 @@
+import hashlib
+import os
+import sqlite3
+from pathlib import Path
+from typing import Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (fingerprint TEXT PRIMARY KEY, state TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, stat TEXT NOT NULL, hash TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS renders (key TEXT PRIMARY KEY, hash TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS validations (command TEXT NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (command, hash));
+"""
+
+# seconds to wait for another run's write to finish
+_LOCK_TIMEOUT = 1.0
+
+
+def stat_tuple(path: Path) -> Optional[Tuple[int, ...]]:
+    try:
+        stat = os.lstat(path)
+    except OSError:
+        return None
+    return (stat.st_mode, stat.st_uid, stat.st_gid, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StateDatabase:
+    """SQLite database of state that persists between instater runs
+
+    The state is only a cache, and concurrent runs (even of unrelated setups)
+    share it. Each write is committed on its own, in write-ahead log mode, so
+    runs never hold the database locked for long. When it stays locked (or
+    cannot be opened) anyway, reads miss and writes are dropped.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.connection: Optional[sqlite3.Connection] = None
+
+        try:
+            connection = sqlite3.connect(str(path), timeout=_LOCK_TIMEOUT, isolation_level=None)
+        except sqlite3.OperationalError:
+            return
+
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            # with a write-ahead log, commits are durable once checkpointed rather than fsynced each time
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+        except sqlite3.OperationalError:
+            connection.close()
+            return
+        self.connection = connection
+
+    def _get(self, query: str, *args) -> Optional[tuple]:
+        if self.connection is None:
+            return None
+        try:
+            return self.connection.execute(query, args).fetchone()
+        except sqlite3.OperationalError:
+            return None
+
+    def _set(self, query: str, *args):
+        if self.connection is None:
+            return
+        try:
+            self.connection.execute(query, args)
+        except sqlite3.OperationalError:
+            pass
+
+    def task_state(self, fingerprint: str) -> Optional[str]:
+        row = self._get("SELECT state FROM tasks WHERE fingerprint = ?", fingerprint)
+        return row[0] if row else None
+
+    def set_task_state(self, fingerprint: str, state: str):
+        self._set("REPLACE INTO tasks (fingerprint, state) VALUES (?, ?)", fingerprint, state)
+
+    def file_hash(self, path: Path) -> Optional[str]:
+        """Content hash of a file, only re-read when the stat of the file changed"""
+
+        stat = stat_tuple(path)
+        if stat is None:
+            return None
+
+        key = str(path.absolute())
+        stat_str = repr(stat)
+        row = self._get("SELECT stat, hash FROM files WHERE path = ?", key)
+        if row and row[0] == stat_str:
+            return row[1]
+
+        file_hash = hash_file(path)
+        self._set("REPLACE INTO files (path, stat, hash) VALUES (?, ?, ?)", key, stat_str, file_hash)
+        return file_hash
+
+    def rendered_hash(self, key: str) -> Optional[str]:
+        """Content hash of the file last written from a template render (see `Context.template_render_key`)"""
+        row = self._get("SELECT hash FROM renders WHERE key = ?", key)
+        return row[0] if row else None
+
+    def set_rendered_hash(self, key: str, file_hash: str):
+        self._set("REPLACE INTO renders (key, hash) VALUES (?, ?)", key, file_hash)
+
+    def validated(self, command: str, content_hash: str) -> bool:
+        """Whether content with `content_hash` passed the `validate` command of a copy before"""
+        return self._get("SELECT 1 FROM validations WHERE command = ? AND hash = ?", command, content_hash) is not None
+
+    def set_validated(self, command: str, content_hash: str):
+        self._set("REPLACE INTO validations (command, hash) VALUES (?, ?)", command, content_hash)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
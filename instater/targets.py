@@ -0,0 +1,107 @@
+"""Applying one setup to many target roots (e.g. chroots or container images)
+
+The parent process reads the setup and asks for prompted variables once, then
+loads the tasks of the first target, which parses the YAML files, compiles the
+templates, and checks that every task can be rebased onto a target root before
+anything runs. Each target then runs in a forked worker process with its own
+`Context`: the parsed files and compiled templates are inherited from the
+parent, so the worker only re-renders the task arguments with the target's
+variables before rebasing and running the tasks.
+
+The output of a target is buffered in the worker and printed by the parent
+when the target finishes, so the output of concurrent targets is not mixed.
+Likewise, the spans of a target (see `instrument`) are recorded in the worker
+and replayed into the parent's report and tracer. Each target has its own
+state database, so that concurrent workers do not contend for its writes.
+"""
+
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from rich.console import Console
+
+from . import instrument
+from .context import Context
+from .exceptions import InstaterError
+from .main import _load_setup, _run_loaded_tasks
+
+# the context and setup file of the parent process, inherited by the forked workers
+_parent: Optional[Tuple[Context, Path]] = None
+
+
+def _worker_console(console: Console) -> Console:
+    # buffered, but rendered with the colors and width of the parent's terminal (and without spinners)
+    return Console(file=io.StringIO(), color_system=console.color_system, width=console.width)  # type: ignore
+
+
+def _target_context(parent: Context, root: str, variables: dict, console: Console) -> Context:
+    # variables given to run_tasks and prompted for are shared by all targets
+    return parent.for_target(Path(root), {**parent.variables, **variables, "instater_target": root}, console)
+
+
+def _load_target(context: Context, setup_file: Path):
+    _load_setup(setup_file, context)
+    for task in context.tasks:
+        task.rebase(context.target_root, context)  # type: ignore
+
+
+def _run_target(root: str, variables: dict) -> Tuple[str, Dict[str, int], Optional[str], List[tuple]]:
+    """The output, task statuses, error (if any), and recorded spans of running the setup on the target `root`"""
+
+    parent, setup_file = _parent  # type: ignore
+    console = _worker_console(parent.console)
+    output: io.StringIO = console.file  # type: ignore
+    context = _target_context(parent, root, variables, console)
+
+    error = None
+    with instrument.recording() as recorder:
+        try:
+            _load_target(context, setup_file)
+            _run_loaded_tasks(context, context.tasks)
+        except InstaterError as e:
+            error = str(e)
+
+    return output.getvalue(), dict(context.statuses), error, recorder.events if recorder else []
+
+
+def run_targets(context: Context, setup_file: Path, targets: Mapping[str, Optional[dict]], jobs: Optional[int] = None):
+    """Run the setup read into `context` on each target root, with the variables of the target"""
+
+    global _parent
+
+    if not targets:
+        return
+
+    # fails before any target runs if a task cannot be rebased, and fills the caches the workers inherit
+    root, variables = next(iter(targets.items()))
+    _load_target(_target_context(context, root, variables or {}, Console(file=io.StringIO())), setup_file)
+
+    _parent = (context, setup_file)
+
+    failed: List[str] = []
+    try:
+        with ProcessPoolExecutor(
+            max_workers=min(jobs or os.cpu_count() or 1, len(targets)),
+            mp_context=multiprocessing.get_context("fork"),
+        ) as executor:
+            futures = {executor.submit(_run_target, root, variables or {}): root for root, variables in targets.items()}
+            for future in as_completed(futures):
+                root = futures[future]
+                text, statuses, error, events = future.result()
+
+                instrument.replay(events)
+                context.output.target(root, text, error)
+                context.statuses.update(statuses)
+                if error is not None:
+                    failed.append(root)
+    finally:
+        _parent = None
+
+    if failed:
+        raise InstaterError(
+            f"Failed to apply the setup to {len(failed)} of {len(targets)} targets: {', '.join(failed)}"
+        )
@@ -1,8 +1,5 @@
-# isort: off
 from ._task import TASKS, Task
 
-# isort: on
-
-from . import command, copy, debug, file, git, group, pacman, service, user  # noqa: F401
+# task modules are imported by TASKS when a task is first used in a setup
 
 __all__ = ["TASKS", "Task"]
@@ -1,11 +1,61 @@
+import importlib
+import os
 import time
-from typing import Dict, Optional, Type
+from pathlib import Path
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple, Type
 
+from .. import instrument
 from ..context import Context
 from ..exceptions import InstaterError
-from ..util import snake_case
+from ..state import stat_tuple
+from ..util import fingerprint, snake_case
 
-TASKS: Dict[str, Type["Task"]] = {}
+# task name -> module defining the task, imported when the task is first used
+_TASK_MODULES = {
+    "command": "command",
+    "copy": "copy",
+    "template": "copy",
+    "debug": "debug",
+    "file": "file",
+    "directory": "file",
+    "symlink": "file",
+    "hard_link": "file",
+    "git": "git",
+    "group": "group",
+    "pacman": "pacman",
+    "aur": "pacman",
+    "service": "service",
+    "user": "user",
+}
+
+
+class TaskRegistry(Mapping[str, Type["Task"]]):
+    """Task classes by name, importing the module of a built-in task on first lookup"""
+
+    def __init__(self, modules: Dict[str, str]):
+        self._modules = modules
+        self._classes: Dict[str, Type["Task"]] = {}
+
+    def register(self, name: str, task_class: Type["Task"]):
+        self._classes[name] = task_class
+
+    def __getitem__(self, name: str) -> Type["Task"]:
+        if name not in self._classes and name in self._modules:
+            importlib.import_module(f".{self._modules[name]}", __package__)
+        return self._classes[name]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._modules
+        yield from (name for name in self._classes if name not in self._modules)
+
+    def __len__(self) -> int:
+        return len(self._modules.keys() | self._classes.keys())
+
+    def __contains__(self, name) -> bool:
+        return name in self._modules or name in self._classes
+
+
+TASKS = TaskRegistry(_TASK_MODULES)
 
 
 class Task:
@@ -20,31 +70,37 @@ class Task:
         self.register = register
 
     def __init_subclass__(cls):
-        TASKS[snake_case(cls.__name__)] = cls
+        TASKS.register(snake_case(cls.__name__), cls)
 
     def run_task(self, context: Context) -> bool:
-        context.enter_task()
-        context.print(f"TASK [{self.name}]", style="black bold on blue", justify="left")
+        context.enter_task(self.name)
 
         start = time.time()
+        if context.plan is not None:
+            context.plan.start_task(self, context)
+
+        with instrument.span("task", self.name, type=snake_case(type(self).__name__)) as span:
+            if context.plan is not None and context.plan.applying and not context.plan.planned_change():
+                context.explain_skip("No changes were planned for this task")
+                changed = False
+            elif self.when and not self._evaluate_when(context, self.when):
+                context.explain_skip(f"when condition failed: {self.when}")
+                changed = False
+            elif context.incremental and self._unchanged_since_last_run(context):
+                context.explain_skip("Task arguments, sources, and destinations are unchanged since the last run")
+                changed = False
+            else:
+                changed = self.run_action(context)
+                if context.incremental and not context.dry_run:
+                    self._record_run(context)
+
+            span["status"] = "changed" if changed else "skipped"
 
-        if self.when and context.jinja_string("{{ (" + self.when + ") | bool }}") == "False":
-            context.explain_skip(f"when condition failed: {self.when}")
-            changed = False
-        else:
-            changed = self.run_action(context)
-
-        duration = context.duration(start)
-        if changed:
-            context.statuses["changed"] += 1
-            context.print(f"changed {duration}", style="yellow bold")
-            context.print()
-            context.exit_task_changed()
-        else:
-            context.statuses["skipped"] += 1
-            context.print(f"skipped {duration}", style="blue")
-            context.print()
-            context.exit_task_skipped()
+        if context.plan is not None:
+            context.plan.end_task(changed)
+
+        context.statuses["changed" if changed else "skipped"] += 1
+        context.exit_task(self.name, snake_case(type(self).__name__), changed, start)
 
         if self.register:
             if self.register in context.variables:
@@ -53,5 +109,52 @@ class Task:
 
         return changed
 
+    def _evaluate_when(self, context: Context, when: str) -> bool:
+        with instrument.span("when", when):
+            return context.jinja_string("{{ (" + when + ") | bool }}") != "False"
+
     def run_action(self, context: Context) -> bool:
         raise NotImplementedError
+
+    def rebase(self, root: Path, context: Context):
+        """Change the paths this task writes to be under `root`, to apply the setup to a target root"""
+        raise InstaterError(
+            f"Task '{self.name}' ({snake_case(type(self).__name__)}) cannot be applied to a target root"
+        )
+
+    def incremental_paths(self, context: Context) -> Optional[Tuple[List[Path], List[Path]]]:
+        """The source files and destination paths this task reads and writes
+
+        Returns None if the task cannot be skipped by `--incremental` (it
+        depends on state other than files, such as installed packages)
+        """
+        return None
+
+    def watch_paths(self, context: Context) -> List[Path]:
+        """Files or directories whose modification should re-run this task in `--watch` mode"""
+        paths = self.incremental_paths(context)
+        return paths[0] if paths else []
+
+    def fingerprint(self, context: Context) -> str:
+        return fingerprint(type(self).__name__, vars(self))
+
+    def _incremental_state(self, context: Context) -> Optional[str]:
+        paths = self.incremental_paths(context)
+        if paths is None:
+            return None
+
+        sources, destinations = paths
+        # absolute, since a plan is applied from the absolute path of its setup file
+        return fingerprint(
+            [(os.path.abspath(source), context.state.file_hash(source)) for source in sources],
+            [(os.path.abspath(destination), stat_tuple(destination)) for destination in destinations],
+        )
+
+    def _unchanged_since_last_run(self, context: Context) -> bool:
+        state = self._incremental_state(context)
+        return state is not None and context.state.task_state(self.fingerprint(context)) == state
+
+    def _record_run(self, context: Context):
+        state = self._incremental_state(context)
+        if state is not None:
+            context.state.set_task_state(self.fingerprint(context), state)
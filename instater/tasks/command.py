@@ -1,9 +1,30 @@
+import glob
+import os
+from pathlib import Path
 from typing import List, Optional, Union
 
 from .. import util
 from ..context import Context
 from . import Task
 
+Patterns = Union[str, List[str], None]
+
+
+def _mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        # a broken symlink, or a path removed since it was globbed
+        return None
+
+
+def _patterns(patterns: Patterns) -> List[str]:
+    if patterns is None:
+        return []
+    if isinstance(patterns, str):
+        return [patterns]
+    return list(patterns)
+
 
 class Command(Task):
     def __init__(
@@ -13,6 +34,10 @@ class Command(Task):
         condition_code: int = 0,
         become: Optional[str] = None,
         directory: Optional[str] = None,
+        creates: Patterns = None,
+        removes: Patterns = None,
+        inputs: Patterns = None,
+        outputs: Patterns = None,
         **kwargs,
     ):
         super().__init__(**kwargs)
@@ -25,8 +50,53 @@ class Command(Task):
         self.condition_code = int(condition_code)
         self.become = become
         self.directory = directory
+        self.creates = _patterns(creates)
+        self.removes = _patterns(removes)
+        self.inputs = _patterns(inputs)
+        self.outputs = _patterns(outputs)
+
+    def _glob(self, patterns: List[str]) -> List[str]:
+        """Paths matching any of `patterns`, relative to the command's directory"""
+
+        matches: List[str] = []
+        for pattern in patterns:
+            matches.extend(glob.glob(os.path.join(self.directory or "", os.path.expanduser(pattern)), recursive=True))
+        return matches
+
+    def _skip_reason(self) -> Optional[str]:
+        """Why the command does not need to run, checked with stat calls rather than a condition command"""
+
+        if self.creates and self._glob(self.creates):
+            return f"Paths created by the command already exist: {', '.join(self.creates)}"
+
+        if self.removes and not self._glob(self.removes):
+            return f"Paths removed by the command do not exist: {', '.join(self.removes)}"
+
+        if self.outputs:
+            # make-style: up to date when every output exists, and none is older than an input
+            outputs = [self._glob([pattern]) for pattern in self.outputs]
+            output_mtimes = [_mtime(path) for paths in outputs for path in paths]
+            existing_mtimes = [mtime for mtime in output_mtimes if mtime is not None]
+            if not all(outputs) or len(existing_mtimes) < len(output_mtimes):
+                return None
+
+            oldest_output = min(existing_mtimes)
+            input_mtimes = [_mtime(path) for path in self._glob(self.inputs)]
+            # inputs that no longer exist cannot be newer than the outputs
+            if all(mtime is None or mtime <= oldest_output for mtime in input_mtimes):
+                return "Outputs of the command are newer than its inputs"
+
+        return None
+
+    def watch_paths(self, context: Context) -> List[Path]:
+        return [Path(os.path.abspath(path)) for path in self._glob(self.inputs)]
 
     def run_action(self, context: Context) -> bool:
+        skip_reason = self._skip_reason()
+        if skip_reason:
+            context.explain_skip(skip_reason)
+            return False
+
         if self.condition:
             result = util.shell(self.condition, self.directory, valid_return_codes=None)
             if result.return_code != self.condition_code:
@@ -36,6 +106,8 @@ class Command(Task):
                 )
                 return False
 
+        # one log for all of the task's commands
+        stream = None if context.dry_run else context.output_stream(self)
         for command in self.commands:
             explain_message = f"Running command {command}"
             if self.directory:
@@ -45,7 +117,11 @@ class Command(Task):
             context.explain_change(explain_message)
 
             if not context.dry_run:
-                result = util.shell(command, self.directory, become=self.become)
+                result = util.shell(command, self.directory, become=self.become, stream=stream)
                 context.explain_change(f"  -> {result.stdout}")
 
+        if not context.dry_run:
+            # arbitrary commands may write anywhere, including the root directory
+            context.invalidate_file_index()
+
         return True
@@ -1,11 +1,11 @@
+import hashlib
 import shlex
-import shutil
 from pathlib import Path
 from tempfile import NamedTemporaryFile
-from typing import Optional, Union
+from typing import List, Optional, Set, Tuple, Union
 from urllib.request import urlopen
 
-from .. import util
+from .. import instrument, util
 from ..context import Context
 from ..exceptions import InstaterError
 from . import Task
@@ -13,7 +13,24 @@ from . import Task
 
 def _read(path: Path) -> bytes:
     with path.open("rb") as file:
-        return file.read()
+        data = file.read()
+
+    instrument.count("bytes_read", len(data))
+    return data
+
+
+def _write(path: Path, data: bytes, context: Context):
+    context.write_file(path, data)
+
+    instrument.count("bytes_written", len(data))
+
+
+def _copy(src: Path, dest: Path, context: Context):
+    context.write_file(dest, src)
+
+    size = dest.stat().st_size
+    instrument.count("bytes_read", size)
+    instrument.count("bytes_written", size)
 
 
 class Copy(Task):
@@ -52,52 +69,68 @@ class Copy(Task):
     def _update_metadata(self, file: Path, context: Context) -> bool:
         return util.update_file_metadata(file, self.owner, self.group, self.mode, context)
 
-    def _validate(self, path: Path):
+    def _validate(self, data: Union[Path, bytes], context: Context):
+        """Validate the content of a source file, or data about to be written, before writing it"""
+
         if not self.validate:
             return
 
-        # util.shell will raise an error on exit codes > 0
-        util.shell(shlex.split(self.validate % path))
+        # validators (e.g. `visudo -cf %s`) are slow, so content that passed validation is not validated again
+        if isinstance(data, Path):
+            content_hash = context.state.file_hash(data)
+        else:
+            content_hash = hashlib.sha256(data).hexdigest()
+        if context.use_cache and context.state.validated(self.validate, content_hash):  # type: ignore
+            return
 
-    def _read_for_diff(self, path: Path):
-        if not path.exists():
-            return ""
+        # util.shell will raise an error on exit codes > 0
+        if isinstance(data, Path):
+            util.shell(shlex.split(self.validate % data))
+        else:
+            with NamedTemporaryFile() as temp_file:
+                temp_file.write(data)
+                temp_file.flush()
+                util.shell(shlex.split(self.validate % temp_file.name))
 
-        try:
-            return _read(path).decode("utf-8")
-        except UnicodeDecodeError:
-            return None
+        context.state.set_validated(self.validate, content_hash)  # type: ignore
 
-    def _explain_diff(self, src: Union[Path, str], dest: Path, context: Context, src_file=None):
-        # extra condition so we only read the file content if necessary
+    def _explain_diff(self, src_data: bytes, dest_data: bytes, src_name: str, dest: Path, context: Context):
+        # extra condition so we only decode the file content if necessary
         if context.explain:
-            src_content = self._read_for_diff(src) if isinstance(src, Path) else src
-            dest_content = self._read_for_diff(dest)
-
-            if src_content is None or dest_content is None:
-                context.explain_change(f"Binary files differ: {src} and {dest}")
+            try:
+                src_content = src_data.decode("utf-8")
+                dest_content = dest_data.decode("utf-8")
+            except UnicodeDecodeError:
+                context.explain_change(f"Binary files differ: {src_name} and {dest}")
             else:
-                context.explain_change_diff(dest_content, src_content, str(dest), src_file or str(src))
+                context.explain_change_diff(dest_content, src_content, str(dest), src_name)
 
     def _update_file_direct(self, src: Path, dest: Path, context: Context) -> bool:
         updated = False
 
-        self._validate(src)
-
         if not dest.exists():
+            self._validate(src, context)
             context.explain_change(f"Destination file does not exist: {dest}")
-            self._explain_diff(src, dest, context)
+            context.plan_content(dest, src)
+            if context.explain:
+                self._explain_diff(_read(src), b"", str(src), dest, context)
             if not context.dry_run:
                 dest.parent.mkdir(parents=True, exist_ok=True)
-                shutil.copy(src, dest)
+                _copy(src, dest, context)
+                context.invalidate_file_index(dest)
 
             updated = True
-        elif not src.samefile(dest) and _read(src) != _read(dest):
-            context.explain_change(f"Source file ({src}) differs from destination file ({dest})")
-            self._explain_diff(src, dest, context)
-            if not context.dry_run:
-                shutil.copy(src, dest)
-            updated = True
+        elif not src.samefile(dest):
+            src_data, dest_data = _read(src), _read(dest)
+            if src_data != dest_data:
+                self._validate(src, context)
+                context.explain_change(f"Source file ({src}) differs from destination file ({dest})")
+                context.plan_content(dest, src_data)
+                self._explain_diff(src_data, dest_data, str(src), dest, context)
+                if not context.dry_run:
+                    _copy(src, dest, context)
+                    context.invalidate_file_index(dest)
+                updated = True
 
         updated |= self._update_metadata(dest, context)
         return updated
@@ -108,24 +141,25 @@ class Copy(Task):
         if content is not None and not content.endswith("\n"):
             content += "\n"
 
-        if self.validate:
-            with NamedTemporaryFile() as temp_file:
-                temp_file.write(content.encode("utf-8"))
-                temp_file.flush()
-                self._validate(Path(temp_file.name))
+        data = content.encode("utf-8")
 
-        if not dest.exists():
-            self._explain_diff(content, dest, context, src_file="Template")
+        dest_data = _read(dest) if dest.exists() else None
+        if dest_data is None:
+            self._validate(data, context)
+            context.plan_content(dest, data)
+            self._explain_diff(data, b"", "Template", dest, context)
             if not context.dry_run:
                 dest.parent.mkdir(parents=True, exist_ok=True)
-                with dest.open("w") as f:
-                    f.write(content)
+                _write(dest, data, context)
+                context.invalidate_file_index(dest)
             updated = True
-        elif content.encode("utf-8") != _read(dest):
-            self._explain_diff(content, dest, context, src_file="Template")
+        elif data != dest_data:
+            self._validate(data, context)
+            context.plan_content(dest, data)
+            self._explain_diff(data, dest_data, "Template", dest, context)
             if not context.dry_run:
-                with dest.open("w") as f:
-                    f.write(content)
+                _write(dest, data, context)
+                context.invalidate_file_index(dest)
             updated = True
 
         updated |= self._update_metadata(dest, context)
@@ -133,9 +167,21 @@ class Copy(Task):
 
     def _update_file_template(self, src: Path, dest: Path, context: Context) -> bool:
         with src.open() as f:
-            content = context.jinja_string(f.read())
+            template = f.read()
+
+        # when the template and its variables are unchanged, and the destination still has the content written
+        # from it, rendering would produce the same content
+        key = context.template_render_key(template) if context.use_cache else None
+        if key is not None:
+            rendered_hash = context.state.rendered_hash(key)
+            if rendered_hash is not None and rendered_hash == context.state.file_hash(dest):
+                return self._update_metadata(dest, context)
 
-        return self._update_file_content(content, dest, context)
+        updated = self._update_file_content(context.jinja_string(template), dest, context)
+
+        if key is not None and not context.dry_run:
+            context.state.set_rendered_hash(key, context.state.file_hash(dest))  # type: ignore
+        return updated
 
     def _update_file(self, src: Path, dest: Path, context: Context):
         if self.is_template:
@@ -148,31 +194,135 @@ class Copy(Task):
 
         return updated
 
-    def _update_dir(self, context: Context) -> bool:
+    def _update_dir(self, src: Path, dest: Path, context: Context) -> bool:
         updated = False
-        src: Path = self.src  # type: ignore
 
         for path in src.glob("**/*"):
             if path.is_file():
-                dest_path = self.dest / path.relative_to(src)
+                dest_path = dest / path.relative_to(src)
+                if context.target_root is not None:
+                    dest_path = util.resolve_in_root(dest_path, context.target_root)
                 if self._update_file(path, dest_path, context):
                     updated = True
 
         return updated
 
-    def run_action(self, context: Context) -> bool:
+    def _dest(self, context: Context) -> Path:
+        if self.dest.is_absolute():
+            return self.dest
+        return context.root_directory / self.dest
+
+    def _paths(self, context: Context) -> Tuple[Optional[Path], Path]:
         src = self.src
         if src and not src.is_absolute():
             src = context.root_directory / src
 
+        dest = self._dest(context)
+        if context.target_root is not None:
+            # symlinks in the target (e.g. /etc/resolv.conf -> /run/...) point within it, not to the host
+            dest = util.resolve_in_root(dest, context.target_root)
+
+        return src, dest
+
+    def rebase(self, root: Path, context: Context):
+        self.dest = util.rebase(self._dest(context), root)
+
+    def incremental_paths(self, context: Context) -> Optional[Tuple[List[Path], List[Path]]]:
+        # content from a url may change without any local changes
+        if self.url:
+            return None
+
+        src, dest = self._paths(context)
+        if not src:
+            content: str = self.content  # type: ignore
+            if not self.is_template:
+                return [], [dest]
+
+            dependencies = context.template_dependencies(content)
+            # the output depends on templates chosen while rendering
+            return None if dependencies is None else (dependencies, [dest])
+
+        if src.is_file():
+            sources = [src]
+            destinations = [dest]
+        else:
+            sources = [path for path in src.glob("**/*") if path.is_file()]
+            destinations = [dest / path.relative_to(src) for path in sources]
+
+        if self.is_template:
+            for source in list(sources):
+                dependencies = context.template_dependencies(source.read_text())
+                if dependencies is None:
+                    return None
+                sources.extend(dependencies)
+
+        return sources, destinations
+
+    def watch_paths(self, context: Context) -> List[Path]:
+        paths = super().watch_paths(context)
+
+        # directories are watched too, so that added files are picked up
+        src, _ = self._paths(context)
+        if src and src.is_dir():
+            paths.append(src)
+            paths.extend(path for path in src.glob("**/*") if path.is_dir())
+        elif src and src not in paths:
+            # a template whose included templates are not all known
+            paths.append(src)
+
+        return paths
+
+    def _templates(self, context: Context) -> Optional[List[str]]:
+        """The template strings rendered by this task, or None if they are only known when running"""
+
+        if self.url:
+            return None
+
+        src, _ = self._paths(context)
+        if not src:
+            return [self.content]  # type: ignore
+        if src.is_file():
+            return [src.read_text()]
+        return [path.read_text() for path in sorted(src.glob("**/*")) if path.is_file()]
+
+    def _template_variables(self, context: Context) -> dict:
+        """The variables the templates may reference, other than results registered by tasks
+
+        Registered results are only set while tasks run, so they are left out to
+        give the same fingerprint before running (e.g. when checking a plan).
+        """
+
+        names: Optional[Set[str]] = None
+        templates = self._templates(context)
+        if templates is not None:
+            names = set()
+            for template in templates:
+                referenced = context.template_variables(template)
+                if referenced is None:
+                    names = None
+                    break
+                names |= referenced
+
+        registered = {task.register for task in context.tasks if task.register}
+        return {
+            name: value
+            for name, value in context.variables.items()
+            if (names is None or name in names) and name not in registered
+        }
+
+    def fingerprint(self, context: Context) -> str:
+        fingerprint = super().fingerprint(context)
+        if self.is_template:
+            fingerprint = util.fingerprint(fingerprint, self._template_variables(context))
+        return fingerprint
+
+    def run_action(self, context: Context) -> bool:
+        src, dest = self._paths(context)
+
         content = self.content
         if self.url:
             content = urlopen(self.url).read().decode("utf-8")
 
-        dest = self.dest
-        if not self.dest.is_absolute():
-            dest = context.root_directory / dest
-
         if src and not src.exists():
             raise InstaterError(f"Source to copy does not exist: {src}")
 
@@ -195,7 +345,7 @@ class Copy(Task):
             if dest.exists() and not dest.is_dir():
                 raise InstaterError(f"Destination is a file, expected directory: {dest}")
 
-            return self._update_dir(context)
+            return self._update_dir(src, dest, context)  # type: ignore
 
 
 class Template(Copy):
@@ -1,3 +1,5 @@
+from pathlib import Path
+
 from ..context import Context
 from . import Task
 
@@ -8,6 +10,9 @@ class Debug(Task):
 
         self.debug = debug
 
+    def rebase(self, root: Path, context: Context):
+        pass
+
     def run_action(self, context: Context) -> bool:
         context.print(self.debug, style="white bold")
         return False
@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from typing import Optional, Union
+from typing import List, Optional, Tuple, Union
 
 from instater.exceptions import InstaterError
 
@@ -46,52 +46,75 @@ class File(Task):
         if target is not None and not self.symlink and not self.hard_link:
             raise InstaterError("Argument `target` may only be used with symlink or hard_link files")
 
-    def _create_file(self):
-        self.path.parent.mkdir(parents=True, exist_ok=True)
-        self.path.touch()
+    def _create_file(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
 
-    def _create_directory(self):
-        self.path.mkdir(parents=True, exist_ok=True)
+    def _create_directory(self, path: Path):
+        path.mkdir(parents=True, exist_ok=True)
 
-    def _create_symlink(self):
+    def _create_symlink(self, path: Path):
         target: Path = self.target  # type: ignore
-        os.symlink(target, self.path)
+        os.symlink(target, path)
 
-    def _create_hard_link(self):
+    def _create_hard_link(self, path: Path, context: Context):
         target: Path = self.target  # type: ignore
-        os.link(target, self.path)
+        if context.target_root is not None:
+            target = util.resolve_in_root(target, context.target_root)
+        os.link(target, path)
+
+    def _path(self, context: Context) -> Path:
+        if context.target_root is None:
+            return self.path
+
+        # symlinks in the target point within it, not to the host. A link being managed is not followed itself
+        if self.symlink or self.hard_link:
+            return util.resolve_in_root(self.path.parent, context.target_root) / self.path.name
+        return util.resolve_in_root(self.path, context.target_root)
+
+    def rebase(self, root: Path, context: Context):
+        self.path = util.rebase(self.path, root)
+        # symlinks are resolved inside the target (e.g. when it is a chroot), hard links are not
+        if self.hard_link:
+            self.target = util.rebase(self.target, root)  # type: ignore
+
+    def incremental_paths(self, context: Context) -> Optional[Tuple[List[Path], List[Path]]]:
+        return [], [self.path]
 
     def run_action(self, context: Context):
         updated = False
+        path = self._path(context)
 
-        if not self.path.exists():
-            context.explain_change(f"Path does not exist: {self.path}")
+        if not path.exists():
+            context.explain_change(f"Path does not exist: {path}")
             if not context.dry_run:
                 if self.directory:
-                    self._create_directory()
+                    self._create_directory(path)
                 elif self.symlink:
-                    self._create_symlink()
+                    self._create_symlink(path)
                 elif self.hard_link:
-                    self._create_hard_link()
+                    self._create_hard_link(path, context)
                 else:
-                    self._create_file()
+                    self._create_file(path)
+                context.syncer.written(path)
+                context.invalidate_file_index(path)
             updated = True
         elif self.symlink:
-            if not self.path.is_symlink():
-                raise InstaterError(f"Path exists but is not a symlink: {self.path}")
+            if not path.is_symlink():
+                raise InstaterError(f"Path exists but is not a symlink: {path}")
         elif self.directory:
-            if not self.path.is_dir():
-                raise InstaterError(f"Path exists but is not a directory: {self.path}")
+            if not path.is_dir():
+                raise InstaterError(f"Path exists but is not a directory: {path}")
         elif self.hard_link:
             pass
         else:
-            if not self.path.is_file():
-                raise InstaterError(f"Path exists but is not a file: {self.path}")
+            if not path.is_file():
+                raise InstaterError(f"Path exists but is not a file: {path}")
 
-        updated |= util.update_file_metadata(self.path, self.owner, self.group, self.mode, context)
+        updated |= util.update_file_metadata(path, self.owner, self.group, self.mode, context)
 
         if not updated:
-            context.explain_skip(f"Path {self.path} already is in the correct state")
+            context.explain_skip(f"Path {path} already is in the correct state")
 
         return updated
 
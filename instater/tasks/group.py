@@ -1,4 +1,3 @@
-from .. import util
 from ..context import Context
 from . import Task
 
@@ -9,17 +8,13 @@ class Group(Task):
 
         self.group = group
 
-    def _group_exists(self) -> bool:
-        result = util.shell(["getent", "group", self.group], valid_return_codes=(0, 2))
-        return result.return_code == 0
-
     def run_action(self, context: Context) -> bool:
-        if self._group_exists():
+        if context.backend.group_exists(self.group):
             context.explain_skip(f"Group '{self.group}' already exists")
             return False
 
         context.explain_change(f"Group '{self.group}' does not yet exist")
         if not context.dry_run:
-            util.shell(["groupadd", self.group])
+            context.backend.create_group(self.group)
 
         return True
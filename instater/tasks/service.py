@@ -11,32 +11,25 @@ class Service(Task):
         self.started = util.boolean(started)
         self.enabled = util.boolean(enabled)
 
-    def _is_started(self) -> bool:
-        result = util.shell(["systemctl", "is-active", self.service], valid_return_codes=(0, 3))
-        return result.stdout == "active"
-
-    def _is_enabled(self) -> bool:
-        result = util.shell(["systemctl", "is-enabled", self.service], valid_return_codes=(0, 1))
-        return result.stdout == "enabled"
-
     def run_action(self, context: Context) -> bool:
         updated = False
+        backend = context.backend
 
-        if self.started and not self._is_started():
+        if self.started and not backend.service_started(self.service):
             context.explain_change(f"Service {self.service} is not started")
             if not context.dry_run:
-                util.shell(["systemctl", "start", self.service])
+                backend.start_service(self.service)
             updated = True
 
-        if self.enabled and not self._is_enabled():
+        if self.enabled and not backend.service_enabled(self.service):
             context.explain_change(f"Service {self.service} is not enabled")
             if not context.dry_run:
-                util.shell(["systemctl", "enable", self.service])
+                backend.enable_service(self.service)
             updated = True
-        elif not self.enabled and self._is_enabled():
+        elif not self.enabled and backend.service_enabled(self.service):
             context.explain_change(f"Service {self.service} is not disabled")
             if not context.dry_run:
-                util.shell(["systemctl", "disable", self.service])
+                backend.disable_service(self.service)
             updated = True
 
         if not updated:
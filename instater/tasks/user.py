@@ -5,46 +5,6 @@ from ..context import Context
 from . import Task
 
 
-def _user_exists(user: str) -> bool:
-    result = util.shell(["getent", "passwd", user], valid_return_codes=(0, 2))
-    return result.return_code == 0
-
-
-def _create_user(user: str, system: bool, create_home: bool, password: Optional[str]):
-    command = ["useradd", user]
-
-    if system:
-        command.append("--system")
-
-    if create_home:
-        command.append("--create-home")
-
-    if password:
-        command.append("--password")
-        command.append(password)
-
-    util.shell(command)
-
-
-def _list_groups(user: str) -> List[str]:
-    result = util.shell(["groups", user])
-    return result.stdout.split(" ")
-
-
-def _add_groups(user: str, groups: Iterable[str]):
-    group_str = ",".join(groups)
-    util.shell(["usermod", "-a", "-G", group_str, user])
-
-
-def _get_shell(user: str) -> str:
-    result = util.shell(["getent", "passwd", user])
-    return result.stdout.split(":")[-1]
-
-
-def _set_shell(user: str, shell: str):
-    util.shell(["usermod", "-s", shell, user])
-
-
 class User(Task):
     def __init__(
         self,
@@ -70,30 +30,34 @@ class User(Task):
 
     def run_action(self, context: Context) -> bool:
         updated = False
+        backend = context.backend
 
-        user_exists = _user_exists(self.user)
+        user_exists = backend.user_exists(self.user)
         if not user_exists:
             context.explain_change(f"User '{self.user}' does not exist")
             if not context.dry_run:
-                _create_user(self.user, self.system, self.create_home, self.password)
+                backend.create_user(self.user, self.system, self.create_home, self.password)
             updated = True
             missing_groups: Iterable[str] = self.groups
         else:
-            all_groups = _list_groups(self.user)
+            all_groups = backend.user_groups(self.user)
             missing_groups = set(self.groups) - set(all_groups)
 
         if missing_groups:
             missing_groups_str = ", ".join(missing_groups)
             context.explain_change(f"User '{self.user}' does not have the following groups: {missing_groups_str}")
             if not context.dry_run:
-                _add_groups(self.user, self.groups)
+                backend.add_user_groups(self.user, self.groups)
             updated = True
 
-        actual_shell = _get_shell(self.user)
-        if self.shell is not None and self.shell != actual_shell:
-            context.explain_change(f"User '{self.user}' has the shell {actual_shell}, should be {self.shell}")
-            _set_shell(self.user, self.shell)
-            updated = True
+        # with dry_run, a user that does not exist yet has no shell to compare against
+        if self.shell is not None and (user_exists or not context.dry_run):
+            actual_shell = backend.user_shell(self.user)
+            if self.shell != actual_shell:
+                context.explain_change(f"User '{self.user}' has the shell {actual_shell}, should be {self.shell}")
+                if not context.dry_run:
+                    backend.set_user_shell(self.user, self.shell)
+                updated = True
 
         # TODO: detect if password needs to change?
 
@@ -1,14 +1,17 @@
-import difflib
-import itertools
+import hashlib
+import json
+import os
 import re
-import shutil
+import selectors
 import subprocess
+from collections import deque
 from pathlib import Path
-from typing import Iterable, List, Optional, Union
-
-from passlib.hash import sha512_crypt  # type: ignore
+from typing import BinaryIO, Callable, Deque, Dict, Iterable, List, Optional, Tuple, Union
 
+from . import become as become_workers
+from . import instrument
 from .exceptions import InstaterError
+from .probe import probe_shell
 
 Bool = Union[str, bool, int, None]
 
@@ -20,141 +23,175 @@ class ShellResult:
         self.stderr = stderr
 
 
+class OutputStream:
+    """Destination of the output of a long-running command, read as it is produced
+
+    All output is appended to `log_file` and passed line by line to `on_line`
+    (e.g. to show it live), and only the last `max_lines` lines of stdout and
+    stderr are kept in memory for the `ShellResult`.
+    """
+
+    def __init__(
+        self,
+        log_file: Optional[Path] = None,
+        on_line: Optional[Callable[[str], None]] = None,
+        max_lines: int = 200,
+    ):
+        self.log_file = log_file
+        self.on_line = on_line
+        self.max_lines = max_lines
+
+
+# longer partial lines (e.g. progress bars redrawn with carriage returns) are split
+_MAX_LINE_LENGTH = 64 * 1024
+
+
+class _StreamSplitter:
+    """Splits output chunks into lines for an `OutputStream`, keeping the last lines of stdout (1) and stderr (2)"""
+
+    def __init__(self, stream: OutputStream):
+        self.stream = stream
+        self.tails: Dict[int, Deque[bytes]] = {fd: deque(maxlen=stream.max_lines) for fd in (1, 2)}
+        self.partial_lines = {1: b"", 2: b""}
+        self._log: Optional[BinaryIO] = None
+
+    def __enter__(self) -> "_StreamSplitter":
+        if self.stream.log_file is not None:
+            self.stream.log_file.parent.mkdir(parents=True, exist_ok=True)
+            self._log = self.stream.log_file.open("ab")
+        return self
+
+    def __exit__(self, *args):
+        if self._log is not None:
+            self._log.close()
+
+    def write(self, fd: int, data: bytes):
+        """Add a chunk of output, or flush the last partial line of `fd` once `data` is empty"""
+
+        if data:
+            if self._log is not None:
+                self._log.write(data)
+            *lines, self.partial_lines[fd] = (self.partial_lines[fd] + data).split(b"\n")
+            if len(self.partial_lines[fd]) > _MAX_LINE_LENGTH:
+                lines.append(self.partial_lines[fd])
+                self.partial_lines[fd] = b""
+        else:
+            lines = [self.partial_lines[fd]] if self.partial_lines[fd] else []
+            self.partial_lines[fd] = b""
+
+        self.tails[fd].extend(lines)
+        if self.stream.on_line is not None:
+            for line in lines:
+                self.stream.on_line(line.decode("utf-8", errors="replace").rstrip("\r"))
+
+    def output(self) -> Tuple[bytes, bytes]:
+        return b"\n".join(self.tails[1]), b"\n".join(self.tails[2])
+
+
+def _run_streaming(
+    command: Union[str, List[str]], directory: Optional[Union[str, Path]], stream: OutputStream
+) -> Tuple[int, bytes, bytes]:
+    process = subprocess.Popen(
+        command, cwd=directory, shell=isinstance(command, str), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+
+    with _StreamSplitter(stream) as splitter, selectors.DefaultSelector() as selector:
+        selector.register(process.stdout, selectors.EVENT_READ, 1)  # type: ignore
+        selector.register(process.stderr, selectors.EVENT_READ, 2)  # type: ignore
+
+        while selector.get_map():
+            for key, _ in selector.select():
+                data = os.read(key.fileobj.fileno(), 65536)  # type: ignore
+                if not data:
+                    selector.unregister(key.fileobj)
+                splitter.write(key.data, data)
+
+    return_code = process.wait()
+    return (return_code, *splitter.output())
+
+
+def _run_streaming_as(
+    worker: become_workers.BecomeWorker,
+    command: Union[str, List[str]],
+    directory: Optional[Union[str, Path]],
+    stream: OutputStream,
+) -> Tuple[int, bytes, bytes]:
+    with _StreamSplitter(stream) as splitter:
+        return_code, _, _ = worker.run(command, directory, on_output=splitter.write)
+        splitter.write(1, b"")
+        splitter.write(2, b"")
+
+    return (return_code, *splitter.output())
+
+
 def shell(
     command: Union[str, List[str]],
     directory: Optional[Union[str, Path]] = None,
     become: Optional[str] = None,
     valid_return_codes: Optional[Iterable[int]] = (0,),
+    stream: Optional[OutputStream] = None,
 ) -> ShellResult:
-    if become:
+    """Run a command, raising an InstaterError if its exit code is not one of `valid_return_codes`
+
+    With a `stream`, output is read as it is produced rather than all at once
+    when the command exits (see `OutputStream`).
+    """
+
+    # commands run as another user go through a persistent worker, falling back to sudo for each command
+    become_worker = become_workers.worker(become) if become else None
+    if become and become_worker is None:
         if isinstance(command, str):
             command = f"sudo -u {become} {command}"
         else:
             command = ["sudo", "-u", become] + command
 
     shell = isinstance(command, str)
-    result = subprocess.run(command, cwd=directory, shell=shell, capture_output=True)
-    if valid_return_codes and result.returncode not in valid_return_codes:
-        error = result.stderr.decode("utf-8")
-        raise InstaterError(f"Unexpected error from '{command}' (exit code {result.returncode}):\n\n{error}")
-
-    return ShellResult(result.returncode, result.stdout.decode("utf-8").strip(), result.stderr.decode("utf-8").strip())
-
-
-def _styled(s: str, style: str):
-    if not style:
-        return s
-    return f"[{style}]{s}[/{style}]"
-
-
-def diff_strings(
-    a: str, b: str, equal_style="white", delete_style="red", insert_style="green", skip_insert=False, skip_delete=False
-):
-    result = ""
-    codes = difflib.SequenceMatcher(a=a, b=b).get_opcodes()
-    for tag, i1, i2, j1, j2 in codes:
-        a_str = a[i1:i2]
-        b_str = b[j1:j2]
-
-        if tag == "equal":
-            result += _styled(a_str, equal_style)
-
-        if tag in {"delete", "replace"}:
-            if not skip_delete:
-                result += _styled(a_str, delete_style)
-
-        if tag in {"insert", "replace"}:
-            if not skip_insert:
-                result += _styled(b_str, insert_style)
-    return result
-
-
-# Note: from difflib
-def _format_range_unified(start, stop):
-    beginning = start + 1
-    length = stop - start
-    if length == 1:
-        return str(beginning)
-    if not length:
-        beginning -= 1
-    return f"{beginning},{length}"
-
-
-# This is a fairly unreadable function that produces a GitHub-style colored
-# diff between two files (with exact changes on lines highlighted)
-def _do_diff_lines(
-    a: List[str],
-    b: List[str],
-    file_a: str = "",
-    file_b: str = "",
-    context_lines: int = 1,
-    equal_style="white",
-    delete_style="red",
-    insert_style="green",
-    replace_delete_style="bold",
-    replace_insert_style="bold",
-):
-    started = False
-    for group in difflib.SequenceMatcher(a=a, b=b).get_grouped_opcodes(n=context_lines):
-        if not started:
-            started = True
-            yield f"--- {file_a}"
-            yield f"+++ {file_b}"
-
-        first, last = group[0], group[-1]
-        file1_range = _format_range_unified(first[1], last[2])
-        file2_range = _format_range_unified(first[3], last[4])
-        yield f"@@ -{file1_range} +{file2_range} @@"
-
-        for tag, i1, i2, j1, j2 in group:
-            a_lines = a[i1:i2]
-            b_lines = b[j1:j2]
-
-            if tag == "equal":
-                for line in a_lines:
-                    yield " " + _styled(line, equal_style)
-                continue
-            elif tag == "delete":
-                for line in a_lines:
-                    yield _styled("-" + line, delete_style)
-            elif tag == "insert":
-                for line in b_lines:
-                    yield _styled("+" + line, insert_style)
-            elif tag == "replace":
-                for a_line, b_line in itertools.zip_longest(a_lines, b_lines):
-                    if b_line is None:
-                        yield _styled("-" + a_line, delete_style)
-                    elif a_line is None:
-                        yield _styled("+" + b_line, insert_style)
-                    else:
-                        yield _styled(
-                            "-"
-                            + diff_strings(
-                                a_line,
-                                b_line,
-                                equal_style=None,
-                                delete_style=replace_delete_style,
-                                insert_style=None,
-                                skip_insert=True,
-                            ),
-                            delete_style,
-                        )
-                        yield _styled(
-                            "+"
-                            + diff_strings(
-                                a_line,
-                                b_line,
-                                equal_style=None,
-                                delete_style=None,
-                                insert_style=replace_insert_style,
-                                skip_delete=True,
-                            ),
-                            insert_style,
-                        )
-
-
-def diff_lines(a: str, b: str, file_a: str = "", file_b: str = ""):
-    return "\n".join(_do_diff_lines(a.splitlines(), b.splitlines(), file_a, file_b))
+    command_str: str = command if shell else " ".join(command)  # type: ignore
+    if become_worker is not None:
+        command_str = f"(as {become}) {command_str}"
+
+    with instrument.span("shell", command_str) as span:
+        if become_worker is not None and stream is not None:
+            return_code, stdout, stderr = _run_streaming_as(become_worker, command, directory, stream)
+        elif become_worker is not None:
+            return_code, stdout, stderr = become_worker.run(command, directory)
+        elif stream is not None:
+            return_code, stdout, stderr = _run_streaming(command, directory, stream)
+        else:
+            result = subprocess.run(command, cwd=directory, shell=shell, capture_output=True)
+            return_code, stdout, stderr = result.returncode, result.stdout, result.stderr
+        span["return_code"] = return_code
+
+    if valid_return_codes and return_code not in valid_return_codes:
+        error = stderr.decode("utf-8", errors="replace")
+        if stream is not None and stream.log_file is not None:
+            error += f"\n\nFull output written to {stream.log_file}"
+        raise InstaterError(f"Unexpected error from '{command_str}' (exit code {return_code}):\n\n{error}")
+
+    return ShellResult(return_code, stdout.decode("utf-8").strip(), stderr.decode("utf-8").strip())
+
+
+def probe(
+    command: List[str],
+    directory: Optional[Union[str, Path]] = None,
+    become: Optional[str] = None,
+    valid_return_codes: Optional[Iterable[int]] = (0,),
+) -> ShellResult:
+    """Like `shell`, for read-only checks of system state, run through a persistent shell"""
+
+    if become:
+        return shell(command, directory, become, valid_return_codes)
+
+    command_str = " ".join(command)
+    with instrument.span("shell", command_str, probe=True) as span:
+        return_code, stdout, stderr = probe_shell().run(command, directory)
+        span["return_code"] = return_code
+
+    if valid_return_codes and return_code not in valid_return_codes:
+        error = stderr.decode("utf-8")
+        raise InstaterError(f"Unexpected error from '{command_str}' (exit code {return_code}):\n\n{error}")
+
+    return ShellResult(return_code, stdout.decode("utf-8").strip(), stderr.decode("utf-8").strip())
 
 
 def update_file_metadata(
@@ -171,17 +208,19 @@ def update_file_metadata(
         return True
 
     chown = False
-    if owner and path.owner() != owner:
-        context.explain_change(f"Owner of file {path} should be '{owner}', found '{path.owner()}'")
-        chown = True
+    if owner or group:
+        current_owner, current_group = context.backend.file_owner(path)
+        if owner and current_owner != owner:
+            context.explain_change(f"Owner of file {path} should be '{owner}', found '{current_owner}'")
+            chown = True
 
-    if group and path.group() != group:
-        context.explain_change(f"Group of file {path} should be '{group}', found '{path.group()}'")
-        chown = True
+        if group and current_group != group:
+            context.explain_change(f"Group of file {path} should be '{group}', found '{current_group}'")
+            chown = True
 
     if chown:
         if not context.dry_run:
-            shutil.chown(path, user=owner, group=group)  # type: ignore
+            context.backend.chown(path, owner, group)
         updated = True
 
     current_mode = path.stat().st_mode & 0o777
@@ -199,11 +238,92 @@ def boolean(input: Bool) -> bool:
     return bool(input) and str(input).lower() not in ("no", "false", "0")
 
 
-def password_hash(password: str, hashtype: str = "sha512") -> str:
+# (password, salt) -> hash, and (password, existing hash) -> whether it matches, for the
+# lifetime of the process, since each sha512_crypt hash or verification takes hundreds of milliseconds
+_password_hashes: Dict[Tuple[str, Optional[str]], str] = {}
+_password_matches: Dict[Tuple[str, str], bool] = {}
+
+
+def password_hash(
+    password: str, hashtype: str = "sha512", salt: Optional[str] = None, existing: Optional[str] = None
+) -> str:
+    """Hash a password for /etc/shadow, reusing `existing` if it is already a hash of `password`
+
+    Without a `salt`, a random salt is chosen once per password and run.
+    """
+
     if hashtype != "sha512":
         raise InstaterError(f"password_hash hashtype must be sha512, found '{hashtype}'")
 
-    return sha512_crypt.hash(password)
+    # passlib is slow to import, and only needed by setups that hash passwords
+    from passlib.hash import sha512_crypt  # type: ignore
+
+    if existing and sha512_crypt.identify(existing):
+        key = (password, existing)
+        if key not in _password_matches:
+            _password_matches[key] = sha512_crypt.verify(password, existing)
+        if _password_matches[key]:
+            return existing
+
+    if (password, salt) not in _password_hashes:
+        try:
+            hasher = sha512_crypt.using(salt=salt) if salt else sha512_crypt
+        except ValueError as e:
+            raise InstaterError(f"Invalid password_hash salt '{salt}': {e}")
+        _password_hashes[(password, salt)] = hasher.hash(password)
+
+    return _password_hashes[(password, salt)]
+
+
+def cache_directory() -> Path:
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "instater"
+
+
+def rebase(path: Path, root: Path) -> Path:
+    """The absolute `path` moved under `root`, e.g. /etc/hosts under /srv/image is /srv/image/etc/hosts"""
+    path = Path(os.path.abspath(path))
+    return root / path.relative_to(path.anchor)
+
+
+def resolve_in_root(path: Path, root: Path) -> Path:
+    """Resolve the symlinks of `path` (under `root`) as if `root` were the root directory, as in a chroot
+
+    Absolute symlink targets are taken relative to `root`, and `..` never leaves
+    it, so the resolved path is always under `root`.
+    """
+
+    root = Path(os.path.abspath(root))
+    parts = list(Path(os.path.abspath(path)).relative_to(root).parts)
+    resolved = root
+    links = 0
+    while parts:
+        part = parts.pop(0)
+        if part == "..":
+            if resolved != root:
+                resolved = resolved.parent
+            continue
+
+        candidate = resolved / part
+        if not candidate.is_symlink():
+            resolved = candidate
+            continue
+
+        links += 1
+        if links > 40:
+            raise InstaterError(f"Too many levels of symbolic links: {path}")
+
+        target = Path(os.readlink(candidate))
+        if target.is_absolute():
+            resolved = root
+            target = target.relative_to(target.anchor)
+        parts = list(target.parts) + parts
+
+    return resolved
+
+
+def fingerprint(*objects) -> str:
+    serialized = json.dumps(objects, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
 
 
 _SNAKE_CASE = re.compile(r"(?<!^)(?=[A-Z])")
@@ -0,0 +1,191 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from .context import Context
+from .exceptions import InstaterError
+from .main import _load_context, _run_loaded_tasks
+from .state import stat_tuple
+from .tasks import Task
+
+# from <sys/inotify.h>
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_WATCH_MASK = _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_EVENT = struct.Struct("iIII")
+
+# time to wait for more events after a change, since editors often write several times
+_DEBOUNCE = 0.05
+
+
+def _absolute(path: Path) -> Path:
+    return Path(os.path.abspath(path))
+
+
+class _PollingWatcher:
+    def __init__(self, paths: Iterable[Path], interval: float):
+        self.interval = interval
+        self._stats = {path: stat_tuple(path) for path in paths}
+
+    def wait(self) -> Set[Path]:
+        while True:
+            time.sleep(self.interval)
+
+            changed = set()
+            for path, previous in self._stats.items():
+                current = stat_tuple(path)
+                if current != previous:
+                    self._stats[path] = current
+                    changed.add(path)
+
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+
+class _InotifyWatcher:
+    def __init__(self, libc, paths: Iterable[Path]):
+        self._fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "Unable to initialize inotify")
+
+        # watch the parent directory of each file, since many editors replace
+        # files rather than writing to them in place
+        directories = set()
+        for path in paths:
+            directories.add(path.parent)
+            if path.is_dir():
+                directories.add(path)
+
+        self._directories: Dict[int, Path] = {}
+        for directory in directories:
+            descriptor = libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+            if descriptor >= 0:
+                self._directories[descriptor] = directory
+
+    def _read_events(self, changed: Set[Path]):
+        data = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            descriptor, _, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            directory = self._directories.get(descriptor)
+            if directory is not None:
+                changed.add(directory / os.fsdecode(name) if name else directory)
+
+    def wait(self) -> Set[Path]:
+        changed: Set[Path] = set()
+        timeout: Optional[float] = None
+        while True:
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+            if not readable:
+                return changed
+
+            self._read_events(changed)
+            timeout = _DEBOUNCE
+
+    def close(self):
+        os.close(self._fd)
+
+
+def _watcher(paths: List[Path], interval: float):
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        return _InotifyWatcher(libc, paths)
+    except (OSError, AttributeError):
+        # inotify is only available on Linux
+        return _PollingWatcher(paths, interval)
+
+
+def _index_tasks(context: Context) -> Dict[Path, List[Task]]:
+    index: Dict[Path, List[Task]] = {}
+    for task in context.tasks:
+        for path in task.watch_paths(context):
+            index.setdefault(_absolute(path), []).append(task)
+    return index
+
+
+def _affected_tasks(context: Context, index: Dict[Path, List[Task]], changed: Set[Path]) -> List[Task]:
+    affected: Set[int] = set()
+    for path in changed:
+        # a directory in the index covers any file that is added within it
+        for candidate in (path, *path.parents):
+            affected.update(id(task) for task in index.get(candidate, ()))
+
+    return [task for task in context.tasks if id(task) in affected]
+
+
+def _rerun(context: Context, tasks: List[Task]):
+    for task in tasks:
+        # the previous run of this task already registered its result
+        if task.register:
+            context.variables.pop(task.register, None)
+
+    context.statuses.clear()
+    context.start = time.time()
+    _run_loaded_tasks(context, tasks)
+    context.print_summary()
+
+
+def watch(
+    setup_file,
+    override_variables: Optional[dict] = None,
+    tags: Optional[Iterable[str]] = None,
+    interval: float = 0.5,
+    **options,
+):
+    """Run all tasks, then re-run only the tasks affected by each file change
+
+    Changes to the setup file, included task files, or variable files reload
+    the setup, re-running only tasks whose arguments changed. `options` are
+    passed through to `Context`.
+    """
+
+    setup_file = Path(setup_file)
+    override_variables = override_variables or {}
+
+    context, _ = _load_context(setup_file, dict(override_variables), tags, **options)
+    fingerprints = {task.fingerprint(context) for task in context.tasks}
+    _rerun(context, context.tasks)
+
+    while True:
+        index = _index_tasks(context)
+        reload_files = {_absolute(path) for path in context.loaded_files}
+
+        watcher = _watcher([*index, *reload_files], interval)
+        context.print("Watching for changes...", style="green bold")
+        try:
+            changed = watcher.wait()
+        finally:
+            watcher.close()
+
+        try:
+            if changed & reload_files:
+                prompted_variables = context.prompted_variables
+                context, _ = _load_context(
+                    setup_file, dict(override_variables), tags, prompted_variables=prompted_variables, **options
+                )
+
+                previous_fingerprints = fingerprints
+                fingerprints = {task.fingerprint(context) for task in context.tasks}
+                tasks = [task for task in context.tasks if task.fingerprint(context) not in previous_fingerprints]
+            else:
+                tasks = _affected_tasks(context, index, changed)
+
+            if tasks:
+                _rerun(context, tasks)
+        except InstaterError as e:
+            context.print(e, style="red")
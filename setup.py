@@ -37,7 +37,7 @@ setup(
     author="Naya Verdier",
     url="https://github.com/nayaverdier/instater",
     license="MIT",
-    packages=find_packages(exclude=("tests",)),
+    packages=find_packages(exclude=("tests", "tests.*", "benchmarks", "benchmarks.*")),
     entry_points={"console_scripts": ["instater = instater.cli:main"]},
     install_requires=[
         "Jinja2~=3.0",
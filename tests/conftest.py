@@ -0,0 +1,14 @@
+import pytest
+import yaml
+
+
+@pytest.fixture
+def write_setup(tmp_path):
+    """Writes `tasks` to a setup file in `tmp_path`, returning its path"""
+
+    def write(tasks):
+        setup_file = tmp_path / "setup.yml"
+        setup_file.write_text(yaml.safe_dump({"tasks": tasks}))
+        return setup_file
+
+    return write
@@ -0,0 +1,60 @@
+from instater import util
+from instater.backend import SimulatedBackend, SystemBackend
+from instater.main import run_tasks
+
+
+def test_simulated_backend_applies_system_tasks(tmp_path, write_setup):
+    backend = SimulatedBackend(package_groups={"base": ["bash", "coreutils"]}, users=["existing"])
+    setup_file = write_setup(
+        [
+            {"name": "Packages", "pacman": {"packages": ["base", "git"]}},
+            {"name": "Service", "service": {"service": "sshd", "started": True, "enabled": True}},
+            {"name": "Group", "group": {"group": "wheel"}},
+            {"name": "User", "user": {"user": "alice", "groups": ["wheel"], "shell": "/bin/zsh"}},
+            {"name": "Repository", "git": {"repo": "https://example.com/repo.git", "dest": f"{tmp_path}/repo"}},
+        ],
+    )
+
+    run_tasks(setup_file, {}, (), quiet=True, backend=backend)
+
+    assert {"bash", "coreutils", "git"} <= backend.explicitly_installed_packages()
+    assert backend.services["sshd"] == {"started": True, "enabled": True}
+    assert backend.users["alice"] == {"groups": ["alice", "wheel"], "shell": "/bin/zsh"}
+    assert backend.repos[tmp_path / "repo"]["remote"] == "https://example.com/repo.git"
+
+    # a second run finds everything in the correct state, and only queries the backend
+    backend.calls.clear()
+    run_tasks(setup_file, {}, (), quiet=True, backend=backend)
+    assert not [
+        call for call in backend.calls if call.startswith(("install", "create", "start", "enable", "set", "add"))
+    ]
+    assert backend.calls["git_fetch_dry_run"] == 1
+
+
+def test_simulated_backend_dry_run_does_not_change_state(write_setup):
+    backend = SimulatedBackend()
+    setup_file = write_setup([{"name": "User", "user": {"user": "alice", "shell": "/bin/zsh"}}])
+
+    run_tasks(setup_file, {}, (), dry_run=True, quiet=True, backend=backend)
+
+    assert backend.users == {}
+
+
+def test_sync_databases_are_refreshed_once(tmp_path, monkeypatch):
+    commands = []
+    monkeypatch.setattr(util, "shell", lambda command, **kwargs: commands.append(command[:2]))
+
+    backend = SystemBackend(pacman_sync_path=tmp_path)
+    backend.install_packages(["git"])
+    backend.install_packages(["vim"])
+    assert commands == [["pacman", "-Sy"], ["pacman", "-S"]]
+
+
+def test_recent_sync_databases_are_not_refreshed(tmp_path, monkeypatch):
+    commands = []
+    monkeypatch.setattr(util, "shell", lambda command, **kwargs: commands.append(command[:2]))
+    (tmp_path / "core.db").touch()
+
+    SystemBackend(pacman_sync_path=tmp_path, sync_max_age=3600).install_packages(["git"])
+    SystemBackend(pacman_sync_path=tmp_path, sync_max_age=0).install_packages(["git"])
+    assert commands == [["pacman", "-S"], ["pacman", "-Sy"]]
@@ -0,0 +1,50 @@
+import getpass
+from typing import List
+
+import pytest
+
+from instater import become, util
+from instater.exceptions import InstaterError
+
+
+@pytest.fixture
+def user():
+    yield getpass.getuser()
+    become.close_workers()
+
+
+def test_commands_share_one_worker(user):
+    first = util.shell("echo $PPID", become=user)
+    second = util.shell(["sh", "-c", "echo $PPID"], become=user)
+
+    assert first.stdout == second.stdout
+    worker = become.worker(user)
+    assert worker is not None
+    assert worker._process.pid == int(first.stdout)
+
+
+def test_worker_results(user, tmp_path):
+    result = util.shell("pwd; echo error >&2; exit 3", directory=tmp_path, become=user, valid_return_codes=None)
+    assert (result.return_code, result.stdout, result.stderr) == (3, str(tmp_path), "error")
+
+    with pytest.raises(InstaterError, match="exit code 3"):
+        util.shell(["sh", "-c", "exit 3"], become=user)
+
+    with pytest.raises(InstaterError, match="Could not run"):
+        util.shell(["command-that-does-not-exist"], become=user)
+
+
+def test_streamed_commands_run_through_the_worker(user, tmp_path):
+    lines: List[str] = []
+    log_file = tmp_path / "logs" / "task.log"
+    stream = util.OutputStream(log_file, lines.append, max_lines=2)
+
+    result = util.shell("echo $PPID; seq 1 3; echo error >&2; printf 'no newline'", become=user, stream=stream)
+
+    worker = become.worker(user)
+    assert worker is not None
+    assert lines[0] == str(worker._process.pid)
+    # stdout and stderr are read separately, so only the order within each is kept
+    assert sorted(lines[1:]) == ["1", "2", "3", "error", "no newline"]
+    assert (result.stdout, result.stderr) == ("3\nno newline", "error")
+    assert sorted(log_file.read_text().splitlines()) == sorted(lines)
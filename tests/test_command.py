@@ -0,0 +1,67 @@
+import os
+
+import pytest
+import yaml
+
+from instater.main import run_tasks
+
+
+@pytest.fixture(autouse=True)
+def cache_directory(tmp_path, monkeypatch):
+    # command output is logged to the cache directory
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+
+def _run(tmp_path, **arguments):
+    task = {"command": {"command": "echo ran >> log", "directory": str(tmp_path), **arguments}}
+    (tmp_path / "setup.yml").write_text(yaml.safe_dump({"tasks": [task]}))
+    run_tasks(tmp_path / "setup.yml", {}, quiet=True, output="plain")
+    return len((tmp_path / "log").read_text().splitlines()) if (tmp_path / "log").exists() else 0
+
+
+def test_creates_and_removes(tmp_path):
+    assert _run(tmp_path, creates="built/*") == 1
+
+    (tmp_path / "built").mkdir()
+    (tmp_path / "built/file").touch()
+    assert _run(tmp_path, creates="built/*") == 1
+
+    assert _run(tmp_path, removes="missing") == 1
+    assert _run(tmp_path, removes=["missing", "built/file"]) == 2
+
+
+def test_outputs_newer_than_inputs_are_up_to_date(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src/a.c").touch()
+    (tmp_path / "src/b.c").touch()
+    arguments = {"inputs": "src/**/*.c", "outputs": ["out.so", "out.h"]}
+
+    # a missing output
+    (tmp_path / "out.so").touch()
+    assert _run(tmp_path, **arguments) == 1
+
+    (tmp_path / "out.h").touch()
+    os.utime(tmp_path / "src/a.c", ns=(0, 1))
+    os.utime(tmp_path / "src/b.c", ns=(0, 1))
+    assert _run(tmp_path, **arguments) == 1
+
+    # an input modified after the oldest output
+    os.utime(tmp_path / "out.h", ns=(0, 2))
+    os.utime(tmp_path / "src/b.c", ns=(0, 3))
+    assert _run(tmp_path, **arguments) == 2
+
+
+def test_missing_paths_are_not_up_to_date(tmp_path):
+    (tmp_path / "input").touch()
+    (tmp_path / "out").symlink_to(tmp_path / "missing")
+    arguments = {"inputs": ["input", "broken"], "outputs": "out"}
+
+    # a broken symlink output is missing
+    assert _run(tmp_path, **arguments) == 1
+
+    (tmp_path / "out").unlink()
+    (tmp_path / "out").touch()
+    os.utime(tmp_path / "input", ns=(0, 1))
+    # a broken symlink input cannot be newer than the outputs
+    (tmp_path / "broken").symlink_to(tmp_path / "missing")
+    assert _run(tmp_path, **arguments) == 1
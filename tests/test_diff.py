@@ -0,0 +1,41 @@
+import difflib
+
+from instater.diff import diff_lines, iter_diff_lines
+
+
+def _hunk_headers(diff: str):
+    return [line for line in diff.splitlines() if line.startswith("@@")]
+
+
+def test_hunks_match_difflib():
+    a = [f"line {index}" for index in range(100)]
+    b = list(a)
+    b[10] = "changed"
+    b[50:52] = []
+    b.insert(90, "inserted")
+
+    expected = [line.strip() for line in difflib.unified_diff(a, b, n=1) if line.startswith("@@")]
+    assert _hunk_headers("\n".join(iter_diff_lines(a, b))) == expected
+
+
+def test_equal_content_has_no_diff():
+    assert diff_lines("a\nb\n", "a\nb\n") == ""
+
+
+def test_content_is_escaped():
+    diff = diff_lines("[section]\nkey = 1\n", "[section]\nkey = 2\n")
+    assert "\\[section]" in diff
+
+
+def test_long_lines_are_not_diffed_within_the_line():
+    diff = diff_lines("x" * 100 + "a", "x" * 100 + "b", max_intraline_length=100)
+    assert "[bold]" not in diff
+    assert diff_lines("a", "b", max_intraline_length=100).count("[bold]") == 2
+
+
+def test_large_changes_are_summarized():
+    a = "\n".join(f"line {index}" for index in range(1000))
+    b = "\n".join(["header"] + [f"changed {index}" for index in range(100)] + a.splitlines()[100:])
+    diff = diff_lines(a, b, max_lines=50)
+    assert _hunk_headers(diff) == ["@@ -1,100 +1,101 @@"]
+    assert "101 lines changed" in diff
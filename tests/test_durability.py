@@ -0,0 +1,166 @@
+import errno
+import os
+
+import pytest
+import yaml
+
+from instater import durability
+from instater.durability import Syncer, write_file
+from instater.main import run_tasks
+
+
+def test_write_replaces_files_atomically_keeping_their_mode(tmp_path):
+    path = tmp_path / "file"
+    path.write_text("old")
+    path.chmod(0o640)
+    inode = path.stat().st_ino
+
+    write_file(path, b"new")
+
+    assert path.read_text() == "new"
+    assert path.stat().st_mode & 0o777 == 0o640
+    assert path.stat().st_ino != inode
+    assert os.listdir(tmp_path) == ["file"]
+
+
+def test_write_follows_symlinks_and_keeps_hard_links(tmp_path):
+    target = tmp_path / "target"
+    target.write_text("old")
+    (tmp_path / "symlink").symlink_to(target)
+    os.link(target, tmp_path / "hard_link")
+
+    write_file(tmp_path / "symlink", b"new")
+
+    assert (tmp_path / "symlink").is_symlink()
+    assert (tmp_path / "hard_link").read_text() == "new"
+
+
+def test_copying_a_source_file_copies_its_mode(tmp_path):
+    src = tmp_path / "script"
+    src.write_text("#!/bin/sh\n")
+    src.chmod(0o755)
+
+    write_file(tmp_path / "dest", src, fsync=True)
+
+    assert (tmp_path / "dest").read_text() == "#!/bin/sh\n"
+    assert (tmp_path / "dest").stat().st_mode & 0o777 == 0o755
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="changing the owner of files requires root")
+@pytest.mark.parametrize("source", [False, True])
+def test_replacing_keeps_the_owner(tmp_path, source):
+    path = tmp_path / "file"
+    path.write_text("old")
+    os.chown(path, 1234, 5678)
+    src = tmp_path / "src"
+    src.write_text("new")
+
+    write_file(path, src if source else b"new")
+
+    assert path.read_text() == "new"
+    assert (path.stat().st_uid, path.stat().st_gid) == (1234, 5678)
+
+
+def test_files_of_other_owners_are_written_in_place_without_privileges(tmp_path, monkeypatch):
+    path = tmp_path / "file"
+    path.write_text("old")
+    inode = path.stat().st_ino
+
+    def chown(*args):
+        raise PermissionError(errno.EPERM, os.strerror(errno.EPERM))
+
+    # as for a group-writable file of another user
+    monkeypatch.setattr(durability.os, "geteuid", lambda: path.stat().st_uid + 1)
+    monkeypatch.setattr(durability.os, "chown", chown)
+    write_file(path, b"new")
+
+    assert path.read_text() == "new"
+    assert path.stat().st_ino == inode
+    assert os.listdir(tmp_path) == ["file"]
+
+
+def test_replacing_keeps_extended_attributes(tmp_path):
+    path = tmp_path / "file"
+    path.write_text("old")
+    try:
+        os.setxattr(path, "user.instater", b"value")
+    except (AttributeError, OSError):
+        pytest.skip("extended attributes are not supported")
+
+    write_file(path, b"new")
+
+    assert path.read_text() == "new"
+    assert os.getxattr(path, "user.instater") == b"value"
+
+
+@pytest.mark.parametrize("error", [errno.EBUSY, errno.EACCES, errno.EPERM])
+def test_files_that_cannot_be_renamed_over_are_written_in_place(tmp_path, monkeypatch, error):
+    path = tmp_path / "file"
+    path.write_text("old")
+    inode = path.stat().st_ino
+
+    def replace(src, dest):
+        raise OSError(error, os.strerror(error))
+
+    monkeypatch.setattr(durability.os, "replace", replace)
+    write_file(path, b"new")
+
+    assert path.read_text() == "new"
+    assert path.stat().st_ino == inode
+    assert os.listdir(tmp_path) == ["file"]
+
+    # new files have nothing to write in place
+    with pytest.raises(OSError):
+        write_file(tmp_path / "new", b"new")
+    assert os.listdir(tmp_path) == ["file"]
+
+
+def test_files_in_unwritable_directories_are_written_in_place(tmp_path, monkeypatch):
+    path = tmp_path / "file"
+    path.write_text("old")
+    os_open = os.open
+
+    def open_(file, flags, *args, **kwargs):
+        if flags & os.O_EXCL:
+            raise PermissionError(errno.EACCES, os.strerror(errno.EACCES))
+        return os_open(file, flags, *args, **kwargs)
+
+    monkeypatch.setattr(durability.os, "open", open_)
+    write_file(path, b"new")
+
+    assert path.read_text() == "new"
+
+
+def test_failed_writes_leave_the_destination_unchanged(tmp_path):
+    path = tmp_path / "file"
+    path.write_text("old")
+
+    with pytest.raises(FileNotFoundError):
+        write_file(path, tmp_path / "missing")
+
+    assert path.read_text() == "old"
+    assert os.listdir(tmp_path) == ["file"]
+
+
+@pytest.mark.parametrize("durability", ["file", "filesystem"])
+def test_runs_sync_written_files(tmp_path, monkeypatch, durability):
+    synced = []
+    sync = Syncer.sync
+
+    def recording_sync(self):
+        synced.append(dict(self._filesystems))
+        sync(self)
+
+    monkeypatch.setattr(Syncer, "sync", recording_sync)
+
+    tasks = [
+        {"copy": {"content": "data", "dest": str(tmp_path / "one")}},
+        {"copy": {"content": "data", "dest": str(tmp_path / "two")}},
+        {"directory": {"path": str(tmp_path / "directory")}},
+    ]
+    (tmp_path / "setup.yml").write_text(yaml.safe_dump({"tasks": tasks}))
+    run_tasks(tmp_path / "setup.yml", {}, quiet=True, output="plain", durability=durability)
+
+    assert (tmp_path / "one").read_text() == "data\n"
+    # each filesystem is synced once, at the end of the run
+    assert synced == [{tmp_path.stat().st_dev: tmp_path} if durability == "filesystem" else {}]
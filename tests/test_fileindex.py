@@ -0,0 +1,68 @@
+from glob import glob
+from pathlib import Path
+
+import pytest
+
+from instater.fileindex import FileIndex
+
+PATTERNS = [
+    "*.yml",
+    "**",
+    "**/",
+    "**/*.txt",
+    "**/.*",
+    ".hidden/*/*",
+    "a/",
+    "a/*",
+    "a/**",
+    "a/**/*.yml",
+    "a/?.txt",
+    "a/b/[0-9].txt",
+    "*/b/*",
+    "missing/*",
+    "linked/*",
+    "linked/**",
+]
+
+
+@pytest.fixture
+def root(tmp_path):
+    for path in ["a/1.txt", "a/.2.txt", "a/b/3.txt", "a/b/c/4.yml", ".hidden/x/5.txt", "6.yml"]:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).touch()
+
+    (tmp_path / "linked").symlink_to(tmp_path / "a")
+    return tmp_path
+
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_glob_matches_stdlib(root, pattern):
+    index = FileIndex(root)
+    assert index.glob(pattern) == sorted(glob(f"{root}/{pattern}", recursive=True))
+
+
+def test_glob_absolute(root):
+    index = FileIndex(root)
+    assert index.glob(f"{root}/a/*") == sorted(glob(f"{root}/a/*"))
+    assert index.glob(f"{root}/../*") == sorted(glob(f"{root}/../*"))
+
+
+def test_glob_absolute_with_relative_root(root, monkeypatch):
+    monkeypatch.chdir(root.parent)
+    index = FileIndex(Path(root.name))
+
+    assert index.glob(f"{root}/a/*") == sorted(glob(f"{root}/a/*"))
+    assert index.glob(f"{root}/a/*")[0].startswith(f"{root}/")
+    assert index.glob("a/*") == sorted(glob(f"{root.name}/a/*"))
+
+
+def test_invalidate(root):
+    index = FileIndex(root)
+    assert index.glob("*.yml") == [f"{root}/6.yml"]
+
+    (root / "7.yml").touch()
+    index.invalidate("/somewhere/else")
+    assert index.glob("*.yml") == [f"{root}/6.yml"]
+
+    index.invalidate(root / "7.yml")
+    assert index.glob("*.yml") == [f"{root}/6.yml", f"{root}/7.yml"]
@@ -1,10 +1,41 @@
+import subprocess
+import sys
+from typing import List
+
+
 def test_module_import():
     import instater
 
-    assert instater.__all__ == ["InstaterError", "__version__", "run_tasks"]
+    assert instater.__all__ == ["InstaterError", "Session", "__version__", "run_tasks"]
 
 
 def test_direct_import():
     from instater import InstaterError  # noqa: F401
+    from instater import Session  # noqa: F401
     from instater import __version__  # noqa: F401
     from instater import run_tasks  # noqa: F401
+
+
+def _imported_modules(code: str) -> List[str]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True
+    )
+    # lines are formatted as "import time: <self us> | <cumulative us> | <indented module name>"
+    return [line.split("|")[-1].strip() for line in result.stderr.splitlines() if line.startswith("import time:")]
+
+
+def test_cli_import_is_lazy():
+    modules = _imported_modules("import instater.cli")
+
+    for module in ["instater.main", "instater.tasks", "jinja2", "yaml", "passlib", "rich.traceback"]:
+        assert module not in modules
+
+
+def test_task_modules_are_imported_when_used():
+    code = "import sys; from instater.tasks import TASKS; TASKS['template']; print(' '.join(sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    modules = result.stdout.split()
+
+    assert "instater.tasks.copy" in modules
+    assert "instater.tasks.pacman" not in modules
+    assert "passlib" not in modules
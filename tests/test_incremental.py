@@ -0,0 +1,81 @@
+import sqlite3
+
+import yaml
+
+from instater import state as state_module
+from instater.main import run_tasks
+from instater.state import StateDatabase
+
+
+def _run(tmp_path):
+    task = {"copy": {"src": "source", "dest": str(tmp_path / "dest")}}
+    (tmp_path / "setup.yml").write_text(yaml.safe_dump({"tasks": [task]}))
+    # a str state file, as given by python callers
+    context = run_tasks(
+        tmp_path / "setup.yml", {}, quiet=True, output="plain", incremental=True, state_file=str(tmp_path / "state.db")
+    )
+    return context.statuses
+
+
+def test_state_database_persists_task_states_and_file_hashes(tmp_path):
+    (tmp_path / "file").write_text("content")
+
+    state = StateDatabase(tmp_path / "state.db")
+    state.set_task_state("task", "state")
+    file_hash = state.file_hash(tmp_path / "file")
+    state.close()
+
+    state = StateDatabase(tmp_path / "state.db")
+    assert state.task_state("task") == "state"
+    assert state.task_state("other") is None
+    assert state.file_hash(tmp_path / "file") == file_hash
+    assert state.file_hash(tmp_path / "missing") is None
+    state.close()
+
+
+def test_concurrent_runs_share_the_state_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(state_module, "_LOCK_TIMEOUT", 0.05)
+    first = StateDatabase(tmp_path / "state.db")
+    second = StateDatabase(tmp_path / "state.db")
+
+    # each write is committed, so the other run sees it and is not locked out
+    first.set_task_state("first", "state")
+    second.set_task_state("second", "state")
+    assert first.task_state("second") == "state"
+    assert second.task_state("first") == "state"
+
+    # while another process holds the write lock, writes are dropped rather than failing
+    locking = sqlite3.connect(str(tmp_path / "state.db"), isolation_level=None)
+    locking.execute("BEGIN IMMEDIATE")
+    second.set_rendered_hash("key", "hash")
+    assert second.rendered_hash("key") is None
+    assert second.task_state("first") == "state"
+    locking.close()
+
+    first.close()
+    second.close()
+
+
+def test_unchanged_tasks_are_skipped(tmp_path):
+    (tmp_path / "source").write_text("one\n")
+
+    assert _run(tmp_path)["changed"] == 1
+    assert _run(tmp_path)["changed"] == 0
+
+
+def test_modified_source_reruns(tmp_path):
+    (tmp_path / "source").write_text("one\n")
+    _run(tmp_path)
+
+    (tmp_path / "source").write_text("two\n")
+    assert _run(tmp_path)["changed"] == 1
+    assert (tmp_path / "dest").read_text() == "two\n"
+
+
+def test_modified_destination_reruns(tmp_path):
+    (tmp_path / "source").write_text("one\n")
+    _run(tmp_path)
+
+    (tmp_path / "dest").write_text("edited\n")
+    assert _run(tmp_path)["changed"] == 1
+    assert (tmp_path / "dest").read_text() == "one\n"
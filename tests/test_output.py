@@ -0,0 +1,43 @@
+import json
+
+import yaml
+
+from instater.main import run_tasks
+
+
+def _run(tmp_path, capsys, **options):
+    setup_file = tmp_path / "setup.yml"
+    tasks = [
+        {"name": "copy [file]", "copy": {"content": "[section]\n", "dest": f"{tmp_path}/dest"}},
+        {"name": "skipped", "debug": "hello", "when": "false"},
+    ]
+    setup_file.write_text(yaml.safe_dump({"tasks": tasks}))
+
+    run_tasks(setup_file, {}, (), explain=True, **options)
+    return capsys.readouterr().out
+
+
+def test_json_output_has_one_event_per_task(tmp_path, capsys):
+    events = [json.loads(line) for line in _run(tmp_path, capsys, output="json").splitlines()]
+    tasks = [event for event in events if event["event"] == "task"]
+
+    assert [(task["name"], task["type"], task["status"]) for task in tasks] == [
+        ("copy [file]", "copy", "changed"),
+        ("skipped", "debug", "skipped"),
+    ]
+    assert "+[section]" in tasks[0]["messages"][-1]
+    assert events[-1]["event"] == "summary"
+    assert (events[-1]["changed"], events[-1]["skipped"]) == (1, 1)
+
+
+def test_plain_output_is_not_markup(tmp_path, capsys):
+    output = _run(tmp_path, capsys, output="plain", quiet=True)
+
+    assert "TASK [copy [file]]" in output
+    assert "+[section]" in output
+    assert "TASK [skipped]" not in output
+    assert "\x1b[" not in output
+
+
+def test_rich_output_escapes_task_names(tmp_path, capsys):
+    assert "TASK [copy [file]]" in _run(tmp_path, capsys)
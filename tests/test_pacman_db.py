@@ -0,0 +1,73 @@
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+from instater import pacman_db
+from instater.backend import SystemBackend
+
+FIXTURE = Path(__file__).parent / "fixtures" / "pacman" / "local"
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    # the database is within a pacman directory, as the cache depends on its modification time too
+    path = tmp_path / "pacman" / "local"
+    shutil.copytree(FIXTURE, path)
+    return path
+
+
+def test_parse():
+    database = pacman_db.parse(FIXTURE)
+
+    assert database.packages == {"bash": True, "coreutils": False, "gcc": True, "make": False}
+    assert database.explicitly_installed() == {"bash", "gcc"}
+    assert database.package_or_group_packages("base-devel") == {"gcc", "make"}
+    assert database.package_or_group_packages("bash") == {"bash"}
+    assert database.installed("sh") and database.installed("gcc-multilib") and database.installed("base-devel")
+    assert not database.installed("zsh")
+
+
+def test_backend_reads_database(database_path, tmp_path):
+    backend = SystemBackend(pacman_db_path=database_path, pacman_cache_file=tmp_path / "cache.json")
+
+    assert backend.package_installed("make")
+    assert not backend.package_installed("zsh")
+    assert backend.explicitly_installed_packages() == {"bash", "gcc"}
+    assert backend.package_or_group_packages("base-devel") == {"gcc", "make"}
+
+
+def test_cache_is_invalidated_by_database_changes(database_path, tmp_path, monkeypatch):
+    cache_file = tmp_path / "cache.json"
+    assert "zsh" not in pacman_db.read(database_path, cache_file).packages
+
+    # a new process reads the cache file rather than parsing again
+    pacman_db._memory_cache.clear()
+    monkeypatch.setattr(pacman_db, "parse", None)
+    assert pacman_db.read(database_path, cache_file).packages["bash"]
+    monkeypatch.undo()
+
+    (database_path / "zsh-5.9-5").mkdir()
+    (database_path / "zsh-5.9-5" / "desc").write_text("%NAME%\nzsh\n\n%REASON%\n0\n")
+    # in case the filesystem's timestamps are too coarse to have changed
+    stat = database_path.stat()
+    os.utime(database_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert pacman_db.read(database_path, cache_file).packages["zsh"]
+
+
+def test_cache_is_invalidated_by_desc_files_written_in_place(database_path, tmp_path):
+    cache_file = tmp_path / "cache.json"
+    assert not pacman_db.read(database_path, cache_file).packages["make"]
+
+    desc = database_path / "make-4.4.1-2" / "desc"
+    desc.write_text(desc.read_text().replace("%REASON%\n1\n", ""))
+    # the desc file alone is not checked, since stat'ing every desc file would be slow
+    assert not pacman_db.read(database_path, cache_file).packages["make"]
+
+    # as pacman does while it changes the database
+    (database_path.parent / "db.lck").touch()
+    (database_path.parent / "db.lck").unlink()
+    stat = database_path.parent.stat()
+    os.utime(database_path.parent, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert pacman_db.read(database_path, cache_file).packages["make"]
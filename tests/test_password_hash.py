@@ -0,0 +1,28 @@
+import pytest
+
+from instater import util
+from instater.exceptions import InstaterError
+
+
+def test_salted_hash_is_stable():
+    first = util.password_hash("secret", salt="abcdefgh")
+    util._password_hashes.clear()
+
+    assert util.password_hash("secret", salt="abcdefgh") == first
+    assert first.startswith("$6$")
+
+
+def test_unsalted_hash_is_computed_once_per_run():
+    assert util.password_hash("secret") == util.password_hash("secret")
+
+
+def test_existing_hash_is_reused_when_it_matches():
+    existing = util.password_hash("secret", salt="existing")
+
+    assert util.password_hash("secret", existing=existing) == existing
+    assert util.password_hash("other", salt="existing", existing=existing) != existing
+
+
+def test_invalid_salt():
+    with pytest.raises(InstaterError):
+        util.password_hash("secret", salt="not a valid salt!")
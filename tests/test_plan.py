@@ -0,0 +1,99 @@
+import json
+import stat
+import sys
+
+import pytest
+
+from instater import InstaterError, cli
+from instater.main import apply_plan, run_tasks
+
+
+def _plan(tmp_path, setup_file, variables=None):
+    plan_file = tmp_path / "plan.json"
+    run_tasks(setup_file, variables, quiet=True, output="plain", state_file=tmp_path / "state.db", plan_file=plan_file)
+    return plan_file
+
+
+def test_plan_records_changes_without_making_them(tmp_path, write_setup):
+    (tmp_path / "unchanged").write_text("same\n")
+    setup_file = write_setup(
+        [
+            {"name": "New", "copy": {"content": "{{ value }}", "dest": str(tmp_path / "new")}},
+            {"name": "Unchanged", "copy": {"content": "same", "dest": str(tmp_path / "unchanged")}},
+        ],
+    )
+
+    plan = json.loads(_plan(tmp_path, setup_file, {"value": "planned"}).read_text())
+
+    assert not (tmp_path / "new").exists()
+    assert plan["variables"] == {"value": "planned"}
+    new, unchanged = plan["tasks"]
+    assert new["changed"] and not unchanged["changed"]
+    assert new["arguments"]["content"] == "planned"
+    assert list(new["contents"]) == [str(tmp_path / "new")]
+
+
+def test_apply_runs_planned_changes(tmp_path, write_setup):
+    setup_file = write_setup([{"copy": {"content": "{{ value }}", "dest": str(tmp_path / "new")}}])
+    plan_file = _plan(tmp_path, setup_file, {"value": "planned"})
+
+    context = apply_plan(plan_file, quiet=True, output="plain", state_file=tmp_path / "state.db")
+
+    assert (tmp_path / "new").read_text() == "planned\n"
+    assert context.statuses["changed"] == 1
+
+
+def test_apply_rejects_stale_plans(tmp_path, write_setup):
+    dest = tmp_path / "file"
+    setup_file = write_setup([{"copy": {"content": "content", "dest": str(dest)}}])
+    plan_file = _plan(tmp_path, setup_file)
+
+    dest.write_text("written after planning\n")
+    with pytest.raises(InstaterError, match="stale"):
+        apply_plan(plan_file, quiet=True, output="plain", state_file=tmp_path / "state.db")
+    assert dest.read_text() == "written after planning\n"
+
+    setup_file = write_setup([{"copy": {"content": "other content", "dest": str(dest)}}])
+    with pytest.raises(InstaterError, match="stale"):
+        apply_plan(plan_file, quiet=True, output="plain", state_file=tmp_path / "state.db")
+
+
+def test_plans_are_only_readable_by_their_owner(tmp_path, write_setup):
+    setup_file = write_setup([{"copy": {"content": "{{ password }}", "dest": str(tmp_path / "secret")}}])
+    (tmp_path / "plan.json").write_text("")
+    (tmp_path / "plan.json").chmod(0o644)
+
+    plan_file = _plan(tmp_path, setup_file, {"password": "hunter2"})
+
+    assert stat.S_IMODE(plan_file.stat().st_mode) == 0o600
+
+
+def test_plans_of_relative_setup_files_can_be_applied(tmp_path, monkeypatch, capsys, write_setup):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "config.j2").write_text("{{ value }}")
+    write_setup([{"template": {"src": "config.j2", "dest": "config"}}])
+
+    monkeypatch.setattr(sys, "argv", ["instater", "plan", "--vars", "value=planned", "--quiet"])
+    cli.main()
+    assert not (tmp_path / "config").exists()
+
+    monkeypatch.setattr(sys, "argv", ["instater", "apply", "plan.json", "--quiet"])
+    cli.main()
+
+    assert "stale" not in capsys.readouterr().out
+    assert (tmp_path / "config").read_text() == "planned\n"
+
+
+def test_plans_of_templates_after_registered_tasks_can_be_applied(tmp_path, write_setup):
+    setup_file = write_setup(
+        [
+            {"copy": {"content": "first", "dest": str(tmp_path / "first")}, "register": "first"},
+            {"template": {"content": "{{ value }}", "dest": str(tmp_path / "second")}},
+        ],
+    )
+    plan_file = _plan(tmp_path, setup_file, {"value": "planned"})
+
+    apply_plan(plan_file, quiet=True, output="plain", state_file=tmp_path / "state.db")
+
+    assert (tmp_path / "second").read_text() == "planned\n"
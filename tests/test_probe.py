@@ -0,0 +1,38 @@
+import pytest
+
+from instater import util
+from instater.exceptions import InstaterError
+
+COMMANDS = [
+    ["echo", "hello world"],
+    ["printf", "no trailing newline"],
+    ["sh", "-c", "echo out; echo err >&2; exit 3"],
+    ["sh", "-c", "printf 'a%.0s' $(seq 100000); printf 'b%.0s' $(seq 100000) >&2"],
+    ["printf", "%s|", "quoted 'arg'", '"double"', "$HOME", "a;b"],
+    ["cat"],
+    ["pwd"],
+]
+
+
+@pytest.mark.parametrize("command", COMMANDS)
+def test_probe_matches_shell(command, tmp_path):
+    expected = util.shell(command, directory=tmp_path, valid_return_codes=None)
+    result = util.probe(command, directory=tmp_path, valid_return_codes=None)
+
+    assert (result.return_code, result.stdout, result.stderr) == (
+        expected.return_code,
+        expected.stdout,
+        expected.stderr,
+    )
+
+
+def test_probes_share_one_shell():
+    first = util.probe(["sh", "-c", "echo $PPID"])
+    assert util.probe(["sh", "-c", "echo $PPID"]).stdout == first.stdout
+
+
+def test_probe_return_codes():
+    with pytest.raises(InstaterError, match="exit code 1"):
+        util.probe(["false"])
+
+    assert util.probe(["false"], valid_return_codes=(0, 1)).return_code == 1
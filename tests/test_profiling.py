@@ -0,0 +1,23 @@
+import pstats
+
+import yaml
+
+from instater.main import run_tasks
+
+
+def _functions(path):
+    return {function for _, _, function in pstats.Stats(str(path)).stats}  # type: ignore
+
+
+def test_each_phase_is_profiled(tmp_path, capsys):
+    (tmp_path / "setup.yml").write_text(
+        yaml.safe_dump({"tasks": [{"copy": {"content": "content", "dest": str(tmp_path / "dest")}}]})
+    )
+    profile_directory = tmp_path / "profiles"
+
+    run_tasks(tmp_path / "setup.yml", {}, quiet=True, output="plain", profile_directory=profile_directory)
+
+    assert sorted(path.name for path in profile_directory.iterdir()) == ["instater-load.pstats", "instater-run.pstats"]
+    assert "_load_tasks" in _functions(profile_directory / "instater-load.pstats")
+    assert "run_task" in _functions(profile_directory / "instater-run.pstats")
+    assert f"Profile written to {profile_directory / 'instater-run.pstats'}" in capsys.readouterr().out
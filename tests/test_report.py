@@ -0,0 +1,43 @@
+import json
+
+import yaml
+
+from instater.main import run_tasks
+
+
+def test_report_records_tasks_and_commands(tmp_path, capsys, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    (tmp_path / "source").write_text("twelve bytes")
+    tasks = [
+        {"name": "Copy", "copy": {"src": "source", "dest": str(tmp_path / "dest")}},
+        {"name": "Commands", "command": ["true", "sleep 0.05"]},
+        {"name": "Skipped", "debug": "hello", "when": "false"},
+    ]
+    (tmp_path / "setup.yml").write_text(yaml.safe_dump({"tasks": tasks}))
+    report_file = tmp_path / "report.jsonl"
+
+    run_tasks(tmp_path / "setup.yml", {}, quiet=True, output="plain", report_file=report_file)
+
+    records = [json.loads(line) for line in report_file.read_text().splitlines()]
+    copy, commands, skipped = [record for record in records if record["event"] == "task"]
+
+    assert (copy["task"], copy["type"], copy["status"]) == ("Copy", "copy", "changed")
+    assert (copy["bytes_read"], copy["bytes_written"]) == (12, 12)
+    assert copy["commands"] == 0
+
+    assert (commands["type"], commands["status"], commands["commands"]) == ("command", "changed", 2)
+    assert commands["wall"] >= commands["command_time"] >= 0.05
+    assert commands["cpu"] >= 0
+
+    assert (skipped["status"], skipped["commands"], skipped["bytes_written"]) == ("skipped", 0, 0)
+
+    command_records = [record for record in records if record["event"] == "command"]
+    assert [(record["command"], record["task"], record["return_code"]) for record in command_records] == [
+        ("true", "Commands", 0),
+        ("sleep 0.05", "Commands", 0),
+    ]
+
+    summary = capsys.readouterr().out.split("Slowest tasks", 1)[1]
+    assert "Slowest commands" in summary
+    # the slowest task is listed first
+    assert summary.index("Commands") < summary.index("Copy")
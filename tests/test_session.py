@@ -0,0 +1,72 @@
+import yaml
+
+from instater import Session, main
+
+
+def test_runs_share_parsed_files_and_templates(tmp_path, write_setup):
+    setup_file = write_setup(
+        [
+            {"copy": {"content": "{{ value }}", "dest": str(tmp_path / "one")}, "tags": "one"},
+            {"copy": {"content": "{{ value }}", "dest": str(tmp_path / "two")}, "tags": "two"},
+        ],
+    )
+    session = Session(setup_file, {"value": "session"}, quiet=True, output="plain")
+
+    first = session.run(tags=["one"])
+    assert (tmp_path / "one").read_text() == "session\n"
+    assert not (tmp_path / "two").exists()
+
+    second = session.run(tags=["two"], variables={"value": "run"})
+    assert (tmp_path / "two").read_text() == "run\n"
+    assert second.yaml_cache is first.yaml_cache
+    assert second.jinja_env is first.jinja_env
+    # each run has its own statuses and variables
+    assert second.statuses["changed"] == 1
+    assert first.variables["value"] == "session"
+
+
+def test_invalidate_reloads_changed_files(tmp_path, write_setup):
+    setup_file = write_setup([{"copy": {"content": "before", "dest": str(tmp_path / "file")}}])
+    session = Session(setup_file, quiet=True, output="plain")
+    session.run()
+
+    # without invalidation, the cached setup is used
+    write_setup([{"copy": {"content": "after", "dest": str(tmp_path / "file")}}])
+    session.run()
+    assert (tmp_path / "file").read_text() == "before\n"
+
+    session.invalidate(setup_file)
+    session.run()
+    assert (tmp_path / "file").read_text() == "after\n"
+
+    write_setup([{"copy": {"content": "again", "dest": str(tmp_path / "file")}}])
+    session.invalidate()
+    session.run()
+    assert (tmp_path / "file").read_text() == "again\n"
+
+
+def test_prompted_variables_are_reused_but_not_printed(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(main, "_do_prompt", lambda *args: "hunter2")
+    setup_file = tmp_path / "setup.yml"
+    setup_file.write_text(
+        yaml.safe_dump(
+            {
+                "vars_prompt": [{"name": "pw", "private": True}],
+                "tasks": [{"copy": {"content": "{{ pw }}", "dest": str(tmp_path / "secret")}}],
+            }
+        )
+    )
+    session = Session(setup_file, {"other": "value"}, quiet=True, output="plain")
+
+    session.run()
+    monkeypatch.setattr(main, "_do_prompt", None)
+    session.run()
+
+    assert (tmp_path / "secret").read_text() == "hunter2\n"
+    output = capsys.readouterr().out
+    assert output.count("other='value'") == 2
+    assert "hunter2" not in output
+
+    # variables of a run still override prompted values
+    session.run(variables={"pw": "given"})
+    assert (tmp_path / "secret").read_text() == "given\n"
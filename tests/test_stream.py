@@ -0,0 +1,56 @@
+from typing import List
+
+import pytest
+import yaml
+
+from instater import util
+from instater.exceptions import InstaterError
+from instater.main import run_tasks
+
+
+def test_streamed_output_is_logged_and_bounded(tmp_path):
+    lines: List[str] = []
+    log_file = tmp_path / "logs" / "task.log"
+    stream = util.OutputStream(log_file, lines.append, max_lines=3)
+
+    result = util.shell("seq 1 10000; echo error >&2; printf 'no newline'", stream=stream)
+
+    assert result.stdout == "9999\n10000\nno newline"
+    assert result.stderr == "error"
+    assert len(lines) == 10002
+    assert log_file.read_text().startswith("1\n2\n3\n")
+
+
+def test_streamed_error_points_to_log(tmp_path):
+    stream = util.OutputStream(tmp_path / "task.log")
+
+    with pytest.raises(InstaterError, match="Full output written to"):
+        util.shell(["sh", "-c", "echo failed >&2; exit 2"], stream=stream)
+
+
+def test_command_output_is_tailed(tmp_path, capsys, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    setup_file = tmp_path / "setup.yml"
+    setup_file.write_text(yaml.safe_dump({"tasks": [{"name": "Count", "command": "seq 1 3"}]}))
+
+    run_tasks(setup_file, {}, (), output="plain", tail=True, quiet=True)
+
+    assert "1\n2\n3\n" in capsys.readouterr().out
+    assert (tmp_path / "cache" / "instater" / "logs" / "Count.log").read_text() == "1\n2\n3\n"
+
+
+def test_commands_of_a_task_share_its_log(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    setup_file = tmp_path / "setup.yml"
+    tasks = [
+        {"name": "Build", "command": ["echo first", "echo second"]},
+        {"name": "Build", "command": "echo other"},
+    ]
+    setup_file.write_text(yaml.safe_dump({"tasks": tasks}))
+
+    run_tasks(setup_file, {}, (), output="plain", quiet=True)
+
+    logs = tmp_path / "cache" / "instater" / "logs"
+    assert (logs / "Build.log").read_text() == "first\nsecond\n"
+    # tasks with the same name do not overwrite each other's logs
+    assert (logs / "Build-2.log").read_text() == "other\n"
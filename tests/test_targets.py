@@ -0,0 +1,127 @@
+import json
+import os
+
+import pytest
+
+from instater import InstaterError
+from instater.backend import SimulatedBackend
+from instater.main import run_tasks
+
+
+def test_setup_is_applied_to_each_target(tmp_path, write_setup):
+    setup_file = write_setup(
+        [
+            {"name": "Hostname", "copy": {"content": "{{ hostname }}", "dest": "/etc/hostname"}},
+            {"name": "Config directory", "directory": {"path": "/etc/app"}},
+            {"name": "Link", "symlink": {"path": "/etc/app/hostname", "target": "/etc/hostname"}},
+        ],
+    )
+    targets = {str(tmp_path / "one"): {"hostname": "one"}, str(tmp_path / "two"): {"hostname": "two"}}
+
+    context = run_tasks(setup_file, {}, (), quiet=True, output="plain", targets=targets, jobs=2)
+
+    for name in ("one", "two"):
+        root = tmp_path / name
+        assert (root / "etc/hostname").read_text() == f"{name}\n"
+        assert (root / "etc/app").is_dir()
+        # symlinks point inside the target, as if it were the root directory
+        assert os.readlink(root / "etc/app/hostname") == "/etc/hostname"
+
+    assert context.statuses["changed"] == 6
+
+
+def test_target_variables_override_shared_variables(tmp_path, write_setup):
+    setup_file = write_setup([{"copy": {"content": "{{ greeting }} {{ name }}", "dest": "/greeting"}}])
+    targets = {str(tmp_path / "one"): {"name": "one"}, str(tmp_path / "two"): {"name": "two", "greeting": "bye"}}
+
+    run_tasks(setup_file, {"greeting": "hello"}, (), quiet=True, output="plain", targets=targets)
+
+    assert (tmp_path / "one/greeting").read_text() == "hello one\n"
+    assert (tmp_path / "two/greeting").read_text() == "bye two\n"
+
+
+def test_tasks_that_cannot_be_rebased_are_rejected_before_running(tmp_path, write_setup):
+    backend = SimulatedBackend()
+    setup_file = write_setup(
+        [
+            {"copy": {"content": "data", "dest": "/file"}},
+            {"name": "Packages", "pacman": {"packages": ["git"]}},
+        ],
+    )
+
+    with pytest.raises(InstaterError, match="Packages"):
+        run_tasks(
+            setup_file, {}, (), quiet=True, output="plain", targets={str(tmp_path / "one"): None}, backend=backend
+        )
+
+    assert not (tmp_path / "one").exists()
+
+
+def test_workers_record_state_and_spans(tmp_path, write_setup):
+    (tmp_path / "config.j2").write_text("{{ name }}")
+    # a slow validation keeps both workers writing to the state database at once
+    validator = tmp_path / "validate.sh"
+    validator.write_text('#!/bin/sh\nsleep 0.2\ntest -f "$1"\n')
+    validator.chmod(0o755)
+    setup_file = write_setup(
+        [{"name": "Config", "template": {"src": "config.j2", "dest": "/config", "validate": f"{validator} %s"}}],
+    )
+    targets = {str(tmp_path / "one"): {"name": "one"}, str(tmp_path / "two"): {"name": "two"}}
+
+    def run(**options):
+        return run_tasks(
+            setup_file,
+            {},
+            (),
+            quiet=True,
+            output="plain",
+            targets=targets,
+            jobs=2,
+            incremental=True,
+            state_file=tmp_path / "state.db",
+            **options,
+        )
+
+    run(report_file=tmp_path / "report.jsonl", trace_file=tmp_path / "trace.json")
+
+    assert (tmp_path / "one/config").read_text() == "one\n"
+    assert (tmp_path / "two/config").read_text() == "two\n"
+    # each target has its own state database
+    assert len(list(tmp_path.glob("state-*.db"))) == 2
+
+    records = [json.loads(line) for line in (tmp_path / "report.jsonl").read_text().splitlines()]
+    tasks = [record for record in records if record["event"] == "task"]
+    assert [(task["task"], task["status"]) for task in tasks] == [("Config", "changed"), ("Config", "changed")]
+    assert all(task["commands"] == 1 and task["bytes_written"] == 4 for task in tasks)
+
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    task_pids = {event["pid"] for event in events if event["ph"] == "X" and event["cat"] == "task"}
+    assert len(task_pids) == 2 and os.getpid() not in task_pids
+
+    context = run()
+    assert context.statuses == {"skipped": 2}
+
+
+def test_symlinks_in_targets_are_resolved_within_the_target(tmp_path, write_setup):
+    host_file = tmp_path / "host" / "stub-resolv.conf"
+    host_file.parent.mkdir()
+    host_file.write_text("host\n")
+    root = tmp_path / "one"
+    (root / "etc").mkdir(parents=True)
+    # as images often ship, pointing to an absolute path that also exists on the host
+    (root / "etc/resolv.conf").symlink_to(host_file)
+    (root / "etc/app").symlink_to("../../../opt/app")
+    setup_file = write_setup(
+        [
+            {"copy": {"content": "nameserver 10.0.0.1", "dest": "/etc/resolv.conf"}},
+            {"directory": {"path": "/etc/app/conf.d"}},
+        ],
+    )
+
+    run_tasks(setup_file, {}, (), quiet=True, output="plain", targets={str(root): None})
+
+    assert host_file.read_text() == "host\n"
+    assert (root / host_file.relative_to("/")).read_text() == "nameserver 10.0.0.1\n"
+    assert (root / "etc/resolv.conf").is_symlink()
+    # `..` does not leave the target
+    assert (root / "opt/app/conf.d").is_dir()
@@ -0,0 +1,118 @@
+import sqlite3
+
+import yaml
+
+from instater import state
+from instater.context import Context
+from instater.main import run_tasks
+
+
+def _run(tmp_path, variables, **options):
+    (tmp_path / "setup.yml").write_text(
+        yaml.safe_dump({"tasks": [{"template": {"src": "config.j2", "dest": str(tmp_path / "config")}}]})
+    )
+    run_tasks(
+        tmp_path / "setup.yml", variables, quiet=True, output="plain", state_file=tmp_path / "state.db", **options
+    )
+
+
+def _count_renders(monkeypatch):
+    renders = []
+    jinja_string = Context.jinja_string
+
+    def counting_jinja_string(self, template, *args, **kwargs):
+        if "greeting" in template:
+            renders.append(template)
+        return jinja_string(self, template, *args, **kwargs)
+
+    monkeypatch.setattr(Context, "jinja_string", counting_jinja_string)
+    return renders
+
+
+def test_unchanged_templates_are_not_rendered_again(tmp_path, monkeypatch):
+    (tmp_path / "config.j2").write_text("{% for i in range(3) %}{{ greeting }} {{ i }}\n{% endfor %}")
+    renders = _count_renders(monkeypatch)
+
+    _run(tmp_path, {"greeting": "hello", "unused": "a"})
+    _run(tmp_path, {"greeting": "hello", "unused": "b"})
+    assert len(renders) == 1
+
+    _run(tmp_path, {"greeting": "bye"})
+    assert len(renders) == 2
+    assert (tmp_path / "config").read_text() == "bye 0\nbye 1\nbye 2\n"
+
+    # the destination is compared against the content written from the template
+    (tmp_path / "config").write_text("edited\n")
+    _run(tmp_path, {"greeting": "bye"})
+    assert len(renders) == 3
+    assert (tmp_path / "config").read_text() == "bye 0\nbye 1\nbye 2\n"
+
+    _run(tmp_path, {"greeting": "bye"}, use_cache=False)
+    assert len(renders) == 4
+
+
+def test_included_templates_are_part_of_the_cache_key(tmp_path, monkeypatch):
+    (tmp_path / "config.j2").write_text("{{ greeting }}\n{% include 'part.j2' %}")
+    (tmp_path / "part.j2").write_text("{{ name }}")
+    renders = _count_renders(monkeypatch)
+
+    _run(tmp_path, {"greeting": "hello", "name": "one"})
+    _run(tmp_path, {"greeting": "hello", "name": "two"})
+    assert (tmp_path / "config").read_text() == "hello\ntwo\n"
+
+    (tmp_path / "part.j2").write_text("{{ name }}!")
+    _run(tmp_path, {"greeting": "hello", "name": "two"})
+    assert (tmp_path / "config").read_text() == "hello\ntwo!\n"
+    assert len(renders) == 3
+
+
+def test_dynamically_included_templates_are_not_cached(tmp_path, monkeypatch):
+    (tmp_path / "config.j2").write_text("{{ greeting }}\n{% include part ~ '.j2' %}")
+    (tmp_path / "one.j2").write_text("one")
+    (tmp_path / "two.j2").write_text("two")
+    renders = _count_renders(monkeypatch)
+
+    _run(tmp_path, {"greeting": "hello", "part": "one"})
+    (tmp_path / "one.j2").write_text("changed")
+    _run(tmp_path, {"greeting": "hello", "part": "one"})
+
+    assert (tmp_path / "config").read_text() == "hello\nchanged\n"
+    assert len(renders) == 2
+
+    context = Context(root_directory=tmp_path, extra_vars={}, tags=())
+    assert context.template_dependencies("{% include part ~ '.j2' %}") is None
+    assert context.template_dependencies("{% include 'missing.j2' ignore missing %}") is None
+    assert context.template_dependencies("{% include 'one.j2' %}") == [tmp_path / "one.j2"]
+
+
+def test_dynamically_included_templates_are_rendered_incrementally(tmp_path):
+    (tmp_path / "config.j2").write_text("{% include part ~ '.j2' %}")
+    (tmp_path / "one.j2").write_text("one")
+    _run(tmp_path, {"part": "one"}, incremental=True)
+
+    (tmp_path / "one.j2").write_text("changed")
+    _run(tmp_path, {"part": "one"}, incremental=True)
+
+    assert (tmp_path / "config").read_text() == "changed\n"
+
+
+def test_nondeterministic_templates_are_not_cached(tmp_path):
+    context = Context(root_directory=tmp_path, extra_vars={"password": "secret"}, tags=())
+
+    assert context.template_render_key("{{ password | password_hash('sha512') }} {{ greeting }}") is None
+    assert context.template_render_key("{{ greeting }}") is not None
+
+
+def test_runs_do_not_fail_while_another_run_holds_the_state_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(state, "_LOCK_TIMEOUT", 0.05)
+    (tmp_path / "config.j2").write_text("{{ greeting }}")
+    _run(tmp_path, {"greeting": "hello"})
+
+    locking = sqlite3.connect(str(tmp_path / "state.db"), isolation_level=None)
+    locking.execute("BEGIN IMMEDIATE")
+    try:
+        _run(tmp_path, {"greeting": "bye"})
+    finally:
+        locking.close()
+
+    assert (tmp_path / "config").read_text() == "bye\n"
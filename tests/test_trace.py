@@ -0,0 +1,51 @@
+import json
+
+import yaml
+
+from instater.main import run_tasks
+
+
+def _spans(events, category):
+    return [event for event in events if event["ph"] == "X" and event["cat"] == category]
+
+
+def _within(inner, outer):
+    return outer["ts"] <= inner["ts"] and inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+
+
+def test_trace_has_nested_spans(tmp_path):
+    (tmp_path / "included.yml").write_text(
+        yaml.safe_dump([{"name": "Command", "command": "true", "when": "run_command"}])
+    )
+    (tmp_path / "setup.yml").write_text(yaml.safe_dump({"tasks": [{"include": "included.yml"}]}))
+    trace_file = tmp_path / "trace.json"
+
+    run_tasks(tmp_path / "setup.yml", {"run_command": True}, quiet=True, output="plain", trace_file=trace_file)
+
+    trace = json.loads(trace_file.read_text())
+    events = trace["traceEvents"]
+    assert all(event["ph"] in ("X", "M") for event in events)
+    assert any(event["ph"] == "M" and event["name"] == "thread_name" for event in events)
+    for event in events:
+        if event["ph"] == "X":
+            assert {"name", "cat", "ts", "dur", "pid", "tid", "args"} <= set(event)
+
+    load, run = _spans(events, "phase")
+    (setup_yaml, included_yaml) = _spans(events, "yaml")
+    (include,) = _spans(events, "include")
+    (task,) = _spans(events, "task")
+    (when,) = _spans(events, "when")
+    (shell,) = _spans(events, "shell")
+
+    assert (load["name"], run["name"]) == ("load", "run")
+    assert setup_yaml["name"] == str(tmp_path / "setup.yml")
+    assert included_yaml["name"] == str(tmp_path / "included.yml")
+    assert _within(setup_yaml, load)
+    assert _within(include, load)
+    assert _within(included_yaml, include)
+
+    assert (task["name"], task["args"]["status"]) == ("Command", "changed")
+    assert (shell["name"], shell["args"]["return_code"]) == ("true", 0)
+    assert _within(task, run)
+    assert _within(when, task)
+    assert _within(shell, task)
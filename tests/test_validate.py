@@ -0,0 +1,48 @@
+import pytest
+import yaml
+
+from instater import InstaterError
+from instater.main import run_tasks
+
+
+def _run(tmp_path, content, **options):
+    validator = tmp_path / "validate.sh"
+    validator.write_text(f'#!/bin/sh\necho "$1" >> {tmp_path}/validations\ngrep -q valid "$1"\n')
+    validator.chmod(0o755)
+
+    task = {"copy": {"content": content, "dest": str(tmp_path / "config"), "validate": f"{validator} %s"}}
+    (tmp_path / "setup.yml").write_text(yaml.safe_dump({"tasks": [task]}))
+    run_tasks(tmp_path / "setup.yml", {}, quiet=True, output="plain", state_file=tmp_path / "state.db", **options)
+
+
+def _validations(tmp_path):
+    path = tmp_path / "validations"
+    return len(path.read_text().splitlines()) if path.exists() else 0
+
+
+def test_content_is_only_validated_when_written(tmp_path):
+    _run(tmp_path, "valid")
+    assert _validations(tmp_path) == 1
+
+    _run(tmp_path, "valid")
+    assert _validations(tmp_path) == 1
+
+    # content that passed validation before is not validated again
+    (tmp_path / "config").write_text("edited\n")
+    _run(tmp_path, "valid")
+    assert _validations(tmp_path) == 1
+    assert (tmp_path / "config").read_text() == "valid\n"
+
+    (tmp_path / "config").write_text("edited\n")
+    _run(tmp_path, "valid", use_cache=False)
+    assert _validations(tmp_path) == 2
+
+
+def test_invalid_content_is_not_written(tmp_path):
+    (tmp_path / "config").write_text("valid\n")
+
+    with pytest.raises(InstaterError):
+        _run(tmp_path, "broken")
+
+    assert (tmp_path / "config").read_text() == "valid\n"
+    assert _validations(tmp_path) == 1
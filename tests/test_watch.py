@@ -0,0 +1,133 @@
+import os
+
+import pytest
+import yaml
+
+from instater import main, watch
+from instater.main import _load_context
+
+
+def _event(descriptor, name=b""):
+    # names are padded with null bytes, as the kernel does
+    padded = name + b"\0" * (-len(name) % 16) if name else b""
+    return watch._EVENT.pack(descriptor, watch._IN_CLOSE_WRITE, 0, len(padded)) + padded
+
+
+def test_inotify_events_are_parsed(tmp_path):
+    read_fd, write_fd = os.pipe()
+    watcher = watch._InotifyWatcher.__new__(watch._InotifyWatcher)
+    watcher._fd = read_fd
+    watcher._directories = {1: tmp_path, 2: tmp_path / "sub"}
+
+    os.write(write_fd, _event(1, b"file") + _event(2) + _event(3, b"unwatched") + _event(1, b"sixteen-bytes-ab"))
+    os.close(write_fd)
+
+    changed: set = set()
+    try:
+        watcher._read_events(changed)
+    finally:
+        watcher.close()
+
+    assert changed == {tmp_path / "file", tmp_path / "sub", tmp_path / "sixteen-bytes-ab"}
+
+
+def test_affected_tasks(tmp_path, write_setup):
+    (tmp_path / "files").mkdir()
+    (tmp_path / "files" / "one").write_text("one")
+    (tmp_path / "other").write_text("other")
+    setup_file = write_setup(
+        [
+            {"name": "Directory", "copy": {"src": "files", "dest": str(tmp_path / "dest")}},
+            {"name": "Other", "copy": {"src": "other", "dest": str(tmp_path / "other-dest")}},
+            {"name": "Content", "copy": {"content": "content", "dest": str(tmp_path / "content")}},
+        ],
+    )
+    context, _ = _load_context(setup_file, {}, None, quiet=True, output="plain")
+    index = watch._index_tasks(context)
+
+    def affected(*paths):
+        return [task.name for task in watch._affected_tasks(context, index, {tmp_path / path for path in paths})]
+
+    # files added to a copied directory are picked up
+    assert affected("files/two") == ["Directory"]
+    assert affected("other", "files/one") == ["Directory", "Other"]
+    assert affected("unrelated") == []
+
+
+class _ScriptedWatcher(watch._PollingWatcher):
+    """Makes the next scripted change before polling for it, then stops watching once the script is done"""
+
+    def __init__(self, script, paths, interval):
+        super().__init__(paths, 0.01)
+        self.script = script
+
+    def wait(self):
+        if not self.script:
+            raise KeyboardInterrupt
+        self.script.pop(0)()
+        return super().wait()
+
+
+def test_changes_rerun_affected_tasks(tmp_path, monkeypatch, write_setup):
+    (tmp_path / "source").write_text("source")
+    content = {"content": "content", "dest": str(tmp_path / "content")}
+    tasks = [
+        {"name": "Content", "copy": content},
+        {"name": "Source", "copy": {"src": "source", "dest": str(tmp_path / "dest")}},
+    ]
+    setup_file = write_setup(tasks)
+
+    def edit_setup():
+        # the unchanged task is not run again, so its edited destination is kept
+        (tmp_path / "dest").write_text("edited\n")
+        content["content"] = "changed"
+        write_setup(tasks)
+
+    def edit_source():
+        # the changed task was run again by the reload, and the unchanged one was not
+        assert (tmp_path / "content").read_text() == "changed\n"
+        assert (tmp_path / "dest").read_text() == "edited\n"
+        (tmp_path / "content").write_text("edited\n")
+        (tmp_path / "source").write_text("changed source")
+
+    script = [edit_setup, edit_source]
+    monkeypatch.setattr(watch, "_watcher", lambda paths, interval: _ScriptedWatcher(script, paths, interval))
+
+    with pytest.raises(KeyboardInterrupt):
+        watch.watch(setup_file, quiet=True, output="plain")
+
+    assert not script
+    assert (tmp_path / "content").read_text() == "edited\n"
+    assert (tmp_path / "dest").read_text() == "changed source"
+
+
+def test_reloads_do_not_print_prompted_variables(tmp_path, monkeypatch, capsys):
+    prompts = []
+
+    def prompt(*args):
+        prompts.append(args)
+        return "hunter2"
+
+    monkeypatch.setattr(main, "_do_prompt", prompt)
+    setup = {
+        "vars_prompt": [{"name": "password", "private": True}],
+        "tasks": [{"copy": {"content": "{{ password }}", "dest": str(tmp_path / "secret")}}],
+    }
+    setup_file = tmp_path / "setup.yml"
+    setup_file.write_text(yaml.safe_dump(setup))
+
+    def edit_setup():
+        setup["tasks"][0]["copy"]["content"] = "{{ password }}!"  # type: ignore
+        setup_file.write_text(yaml.safe_dump(setup))
+
+    script = [edit_setup]
+    monkeypatch.setattr(watch, "_watcher", lambda paths, interval: _ScriptedWatcher(script, paths, interval))
+
+    with pytest.raises(KeyboardInterrupt):
+        watch.watch(setup_file, {"other": "value"}, quiet=True, output="plain")
+
+    assert len(prompts) == 1
+    assert (tmp_path / "secret").read_text() == "hunter2!\n"
+    output = capsys.readouterr().out
+    assert output.count("other='value'") == 2
+    assert "hunter2" not in output